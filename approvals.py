@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ApprovalCache:
+    """ตารางอนุมัติจาก Sheet1 เก็บเป็น dict ในหน่วยความจำ (source_id -> status)
+
+    - เกิน `ttl` วินาที: ยังตอบจากตารางเดิม แล้วโหลดใหม่เบื้องหลัง
+    - source ที่ยังไม่อนุมัติ (negative) ตรวจซ้ำได้หลัง `negative_ttl` วินาที
+      การโหลดใหม่เป็นทั้งตาราง จึงโหลดได้ไม่เกินรอบละครั้งไม่ว่าจะมีข้อความเข้ามาเท่าไร
+    `loader()` ต้องคืน dict ของ source_id -> status
+    ถ้ายังไม่เคยโหลดตารางได้เลย (เช่น Sheets ตอบ 429) is_approved คืน None
+    เพื่อแยกจากกรณี "ยังไม่อนุมัติ"
+
+    `invalidate` เพิ่มเลข generation: ผลโหลดที่เริ่มก่อน invalidate จะไม่ถูกนำมาใช้
+    ถ้ามี `generation_path` จะเขียนไฟล์นี้ใหม่ด้วย worker อื่นตรวจไฟล์ทุก `poll_interval` วินาที
+    (os.stat แบบเดียวกับ ReferenceStore) แล้วล้างตารางของตัวเองตาม
+    """
+
+    def __init__(self, loader, ttl=300, negative_ttl=30, generation_path=None, poll_interval=1.0):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.generation_path = generation_path
+        self.poll_interval = poll_interval
+        self._table = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._shared_stamp = self._stamp()
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.hits = 0
+        self.loads = 0
+
+    def _stamp(self):
+        if not self.generation_path: return None
+        try:
+            st = os.stat(self.generation_path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        with self._lock: generation = self._generation
+        table = self.loader()
+        with self._lock:
+            # มีการ invalidate ระหว่างโหลด: ตารางนี้อาจเก่ากว่าที่ผู้สั่ง invalidate ต้องการ
+            if generation == self._generation:
+                self._table, self._loaded_at = table, time.monotonic()
+                self.loads += 1
+        return table
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+        def run():
+            try: self.refresh()
+            except Exception: logger.exception("Approval table refresh failed, keeping the old table")
+            finally:
+                with self._lock: self._refreshing = False
+        threading.Thread(target=run, name="approval-refresh", daemon=True).start()
+
+    def _invalidate_local(self):
+        with self._lock:
+            self._generation += 1
+            self._table = None
+
+    def invalidate(self):
+        """ล้างตารางของ worker นี้ และแจ้ง worker อื่นผ่าน generation_path (ถ้ามี)"""
+        self._invalidate_local()
+        if not self.generation_path: return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.generation_path)), exist_ok=True)
+            tmp_path = f"{self.generation_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f: f.write(f"{time.time_ns()} {os.getpid()}\n")
+            os.replace(tmp_path, self.generation_path)
+            with self._lock: self._shared_stamp = self._stamp()
+        except OSError:
+            logger.exception("Cannot publish approval generation to %s", self.generation_path)
+
+    def _check_shared(self):
+        now = time.monotonic()
+        if not self.generation_path or now - self._checked_at < self.poll_interval: return
+        self._checked_at = now
+        stamp = self._stamp()
+        if stamp == self._shared_stamp: return
+        with self._lock: self._shared_stamp = stamp
+        self._invalidate_local()
+
+    def is_approved(self, source_id):
+        self._check_shared()
+        table = self._table
+        if table is None:
+            try: table = self.refresh()
+            except Exception:
+                logger.exception("Approval table load failed")
+                return None
+        else:
+            self.hits += 1
+        age = time.monotonic() - self._loaded_at
+        approved = table.get(source_id) == 'approved'
+        if age > self.ttl or (not approved and age > self.negative_ttl):
+            self._refresh_in_background()
+        return approved
+
+    def __len__(self):
+        return len(self._table or {})
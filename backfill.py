@@ -0,0 +1,185 @@
+"""นำเข้าสลิปย้อนหลังทีละมากๆ (เช่น กลุ่มที่เพิ่งอนุมัติแล้วมีสลิปในแชทหลายเดือน)
+
+รับได้ทั้งโฟลเดอร์รูปสลิป หรือไฟล์ JSONL ของข้อความ OCR ที่มีอยู่แล้ว (บรรทัดละ
+{"text": "...", "sender_name": "...", "sender_id": "..."} โดย sender_* ไม่บังคับ)
+
+    python backfill.py slips/ --source-id C123... --group-name "บ้านเรา" --dry-run
+    python backfill.py ocr_dump.jsonl --source-id U456... --sender-name "สมชาย"
+
+- OCR + parse ทำใน process pool จำกัดอัตราการเรียก OCR ด้วย --ocr-per-minute
+- ใช้ parse_slip, ParsingRules, Aliases และรูปแบบแถวเดียวกับบอท (main.build_transaction_row)
+- ตัดสลิปซ้ำด้วยชุด ref_id ที่โหลดจากชีตครั้งเดียว (+ ดัชนี ref_id ของบอทถ้ามี)
+- เขียนลงชีตเป็นชุดใหญ่ด้วย append_rows ผ่านตัวจัดคิว Sheets ของบอท โดยจอง ref_id ในดัชนี
+  เฉพาะชุดที่กำลังจะเขียน (ล้ม/กด Ctrl-C ระหว่างเขียน การจองของชุดนั้นถูกปล่อยคืน)
+--dry-run อ่านอย่างเดียว ไม่เขียนชีตและไม่แตะดัชนี (ตัดสลิปซ้ำจากชีตอย่างเดียว) แต่รายงานเหมือนรันจริง
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from slip_parser import parse_slip, compile_rules
+from sheets_scheduler import TokenBucket
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# --- งานใน process ลูก ---
+_worker = {}
+
+def _init_worker(rule_rows, ocr_settings):
+    _worker['rules'] = compile_rules(rule_rows)
+    _worker['ocr'] = ocr_settings
+    _worker['client'] = None
+
+def _ocr_image(path):
+    from image_preprocess import preprocess
+    from ocr_client import OCRClient, OCRError, build_backend
+    from slip_qr import read_slip_qr
+    settings = _worker['ocr']
+    if _worker['client'] is None:
+        backends = [build_backend(name, api_key=settings['api_key'], url=settings['url']) for name in settings['backends']]
+        _worker['client'] = OCRClient(backends, deadline=settings['deadline'], retries=settings['retries'], max_concurrency=1)
+    with open(path, 'rb') as f:
+        qr_data = read_slip_qr(f) if settings['qr'] else None
+        f.seek(0)
+        upload = preprocess(f, settings['stages'], target_width=settings['target_width'], output_format=settings['upload_format'])
+    try: text = _worker['client'].recognize(*upload)
+    except OCRError as e: return None, None, f"OCR failed: {e}"
+    return text, qr_data, None
+
+def process_item(item):
+    """คืน (parsed, error) ของสลิปหนึ่งใบ"""
+    if 'path' in item:
+        text, qr_data, error = _ocr_image(item['path'])
+        if error: return None, error
+    else:
+        text, qr_data = item['text'], None
+    parsed = parse_slip(text, _worker['rules'])
+    if qr_data:
+        parsed['ref_id'] = qr_data['ref_id']
+        if qr_data['amount'] is not None and parsed.get('amount') in (None, 'N/A'): parsed['amount'] = qr_data['amount']
+    return parsed, None
+
+# --- ส่วน process หลัก ---
+def load_items(path):
+    if os.path.isdir(path):
+        return [{'path': p, 'name': os.path.basename(p)} for p in sorted(glob.glob(os.path.join(path, '*'))) if p.lower().endswith(IMAGE_EXTENSIONS)]
+    items = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip(): continue
+            record = json.loads(line)
+            items.append(dict(record, name=record.get('name') or f"{os.path.basename(path)}:{number}"))
+    return items
+
+def run_pool(items, rule_rows, ocr_settings, workers, ocr_per_minute):
+    """ผลของทุก item ตามลำดับเดิม โดยมีงานค้างใน pool ไม่เกิน workers * 2"""
+    bucket = TokenBucket(ocr_per_minute, capacity=workers) if ocr_per_minute else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rule_rows, ocr_settings)) as pool:
+        pending = collections.deque()
+        for item in items:
+            if bucket and 'path' in item: bucket.acquire()
+            pending.append((item, pool.submit(process_item, item)))
+            if len(pending) >= workers * 2:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+        while pending:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="โฟลเดอร์รูปสลิป หรือไฟล์ .jsonl ของข้อความ OCR")
+    parser.add_argument('--source-id', required=True, help="group id หรือ user id ที่สลิปเป็นของ (ต้องอนุมัติแล้ว)")
+    parser.add_argument('--group-name', default="N/A (Direct Message)")
+    parser.add_argument('--sender-name', default="N/A (Backfill)")
+    parser.add_argument('--sender-id', default="N/A")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--ocr-per-minute', type=float, default=60, help="จำกัดการเรียก OCR ต่อนาที (0 = ไม่จำกัด)")
+    parser.add_argument('--batch-size', type=int, default=500, help="จำนวนแถวต่อการเรียก append_rows")
+    parser.add_argument('--rejects', help="เขียนรายการที่ไม่ได้นำเข้าลงไฟล์ JSONL นี้")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    import main as bot
+    items = load_items(args.input)
+    if not items: parser.error(f"no slips found in {args.input}")
+    if bot.is_approved(args.source_id) is not True: parser.error(f"{args.source_id} is not approved (or the approval table cannot be loaded)")
+    snapshot = bot.reference_store.current()
+    worksheet = bot.sheets.worksheet("Transactions")
+    existing = set(bot.sheets.read(worksheet.col_values, 6))
+    index = None if args.dry_run else bot.get_ref_index()  # get_ref_index สร้าง/เขียนไฟล์ SQLite
+    # สร้างตารางสรุปก่อนเขียนชุดแรก ไม่อย่างนั้น rebuild จะนับแถวที่เพิ่งเขียนแล้ว add ซ้ำอีกรอบ
+    rollups = None if args.dry_run else bot.get_rollup_store()
+    ocr_settings = {'backends': bot.OCR_BACKENDS, 'api_key': bot.OCR_SPACE_API_KEY, 'url': os.environ.get('OCR_SPACE_URL', bot.OCR_SPACE_URL),
+                    'deadline': bot.OCR_DEADLINE, 'retries': bot.OCR_RETRIES, 'qr': bot.SLIP_QR_ENABLED, 'stages': bot.OCR_PREPROCESS_STAGES,
+                    'target_width': bot.OCR_TARGET_WIDTH, 'upload_format': bot.OCR_UPLOAD_FORMAT}
+
+    started = time.perf_counter()
+    batch, written = [], 0
+    rejects = collections.Counter()
+    rejects_file = open(args.rejects, 'w', encoding='utf-8') if args.rejects else None
+
+    def reject(item, reason, detail=''):
+        rejects[reason] += 1
+        if rejects_file: rejects_file.write(json.dumps({'name': item['name'], 'reason': reason, 'detail': detail}, ensure_ascii=False) + "\n")
+
+    def flush():
+        nonlocal written
+        if index:
+            # จองตอนจะเขียนเท่านั้น: ref_id ที่บอทเพิ่งบันทึก/จองไประหว่างนี้ถือว่าซ้ำ
+            for entry in list(batch):
+                if not index.claim(entry[1]['ref_id']):
+                    batch.remove(entry)
+                    reject(entry[2], 'duplicate', entry[1]['ref_id'])
+        if not batch: return
+        if not args.dry_run:
+            try:
+                ref_ids = {log_data['ref_id'] for _, log_data, _ in batch}
+                response = bot.sheets.write(worksheet.append_rows, [row for row, _, _ in batch], value_input_option='USER_ENTERED',
+                                            verify=lambda: len(bot.logged_rows(ref_ids)) == len(ref_ids))
+            except BaseException:
+                if index:
+                    for _, log_data, _ in batch: index.release(log_data['ref_id'])
+                raise
+            first_row = bot._row_from_append_response(response)
+            for offset, (_, log_data, _) in enumerate(batch):
+                if index: index.set_row(log_data['ref_id'], first_row + offset if first_row else 0)
+                bot.update_rollups(log_data, rollups)
+        written += len(batch)
+        print(f"{'would write' if args.dry_run else 'wrote'} {written} rows ({time.perf_counter() - started:.1f}s)")
+        batch.clear()
+
+    try:
+        for item, (parsed, error) in run_pool(items, list(map(dict, snapshot.rule_rows)), ocr_settings, args.workers, args.ocr_per_minute):
+            if error:
+                reject(item, 'ocr_failed', error); continue
+            ref_id = parsed.get('ref_id')
+            if not ref_id or ref_id == 'N/A':
+                reject(item, 'no_ref', parsed); continue
+            if ref_id in existing or (index and index.find(ref_id) is not None):
+                reject(item, 'duplicate', ref_id); continue
+            existing.add(ref_id)
+            display_account = snapshot.aliases.get(parsed.get('account'), parsed.get('account'))
+            display_recipient = snapshot.aliases.get(parsed.get('recipient'), parsed.get('recipient'))
+            log_data = {'date': parsed.get('date', 'N/A'), 'from': display_account, 'to': display_recipient, 'amount': parsed.get('amount', 0.0), 'ref_id': ref_id,
+                        'source_id': args.source_id, 'sender_name': item.get('sender_name', args.sender_name), 'sender_id': item.get('sender_id', args.sender_id),
+                        'source_group_name': args.group_name}
+            batch.append((bot.build_transaction_row(log_data), log_data, item))
+            if len(batch) >= args.batch_size: flush()
+        flush()
+    finally:
+        if rejects_file: rejects_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{len(items)} slips, {written} rows {'(dry run) ' if args.dry_run else ''}in {elapsed:.1f}s = {written / elapsed if elapsed else 0:.1f} rows/s")
+    print(f"rejected {sum(rejects.values())}: {json.dumps(dict(rejects), ensure_ascii=False)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""เทียบการส่งรูปไป OCR แบบเดิมกับแบบผ่าน image_preprocess
+
+corpus เป็นโฟลเดอร์ของรูปสลิป (*.jpg / *.png) คู่กับไฟล์ <ชื่อเดียวกัน>.json
+ที่เก็บค่าที่ถูกต้อง เช่น {"amount": 1250.0, "ref_id": "0152..."}
+
+    OCR_SPACE_API_KEY=... python benchmarks/preprocess_bench.py corpus/ \\
+        --variant gray=downscale,grayscale:jpeg --variant crop=downscale,grayscale,autocrop:png
+
+--offline วัดแค่ขนาดไฟล์และเวลาแปลงรูป (ไม่เรียก OCR ไม่วัดความแม่นยำ)
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_preprocess import preprocess
+from slip_parser import parse_slip, compile_rules
+from ocr_client import OCRClient, OCRError, OCRSpaceBackend
+
+FIELDS = ('date', 'amount', 'recipient', 'account', 'ref_id')
+OCR_CLIENT = OCRClient([OCRSpaceBackend(os.environ.get('OCR_SPACE_API_KEY'))], deadline=60, max_concurrency=1)
+
+
+def ocr_space(image_bytes, filename, mimetype):
+    try: return OCR_CLIENT.recognize(image_bytes, filename, mimetype)
+    except OCRError: return None
+
+
+def load_corpus(corpus_dir):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*'))):
+        stem, ext = os.path.splitext(path)
+        if ext.lower() not in ('.jpg', '.jpeg', '.png', '.webp'): continue
+        expected = {}
+        if os.path.exists(stem + '.json'):
+            with open(stem + '.json', encoding='utf-8') as f: expected = json.load(f)
+        samples.append((path, expected))
+    return samples
+
+
+def load_rules_csv(path):
+    if not path: return compile_rules([])
+    with open(path, encoding='utf-8-sig', newline='') as f: return compile_rules(list(csv.DictReader(f)))
+
+
+def parse_variant(spec):
+    name, _, rest = spec.partition('=')
+    stages, _, fmt = rest.partition(':')
+    return name, [stage for stage in stages.split(',') if stage], fmt or 'jpeg'
+
+
+def field_matches(expected, actual):
+    if isinstance(expected, (int, float)):
+        try: return abs(float(actual) - float(expected)) < 0.005
+        except (TypeError, ValueError): return False
+    return str(actual).strip() == str(expected).strip()
+
+
+def run_variant(samples, stages, fmt, rules, target_width, offline):
+    sizes, prep_times, ocr_times = [], [], []
+    correct = {field: 0 for field in FIELDS}
+    totals = {field: 0 for field in FIELDS}
+    for path, expected in samples:
+        with open(path, 'rb') as f:
+            started = time.perf_counter()
+            upload = preprocess(f, stages, target_width=target_width, output_format=fmt)
+            prep_times.append(time.perf_counter() - started)
+        sizes.append(len(upload[0]))
+        if offline: continue
+        started = time.perf_counter()
+        text = ocr_space(*upload)
+        ocr_times.append(time.perf_counter() - started)
+        parsed = parse_slip(text, rules) if text is not None else {}
+        for field in FIELDS:
+            if field not in expected: continue
+            totals[field] += 1
+            correct[field] += field_matches(expected[field], parsed.get(field))
+    report = {'bytes_total': sum(sizes), 'bytes_mean': statistics.mean(sizes) if sizes else 0,
+              'preprocess_ms_p50': statistics.median(prep_times) * 1000 if prep_times else 0}
+    if not offline:
+        report['ocr_ms_p50'] = statistics.median(ocr_times) * 1000 if ocr_times else 0
+        report['ocr_ms_mean'] = statistics.mean(ocr_times) * 1000 if ocr_times else 0
+        report['accuracy'] = {field: correct[field] / totals[field] for field in FIELDS if totals[field]}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus')
+    parser.add_argument('--variant', action='append', default=[], help="name=stage,stage:format (format = jpeg/png/original)")
+    parser.add_argument('--rules', help="ไฟล์ CSV ที่ export จากชีต ParsingRules")
+    parser.add_argument('--target-width', type=int, default=1000)
+    parser.add_argument('--offline', action='store_true')
+    args = parser.parse_args(argv)
+
+    samples = load_corpus(args.corpus)
+    if not samples: parser.error(f"no images found in {args.corpus}")
+    rules = load_rules_csv(args.rules)
+    variants = [('current', [], 'original')] + [parse_variant(spec) for spec in (args.variant or ['default=downscale,grayscale:jpeg'])]
+    results = {}
+    for name, stages, fmt in variants:
+        results[name] = run_variant(samples, stages, fmt, rules, args.target_width, args.offline)
+        print(f"{name:>12}: {json.dumps(results[name], ensure_ascii=False)}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
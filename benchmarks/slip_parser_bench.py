@@ -0,0 +1,152 @@
+"""วัดความเร็วและความแม่นยำของ slip_parser กับ corpus ข้อความ OCR (ทำงานออฟไลน์ ไม่เรียก OCR)
+
+corpus อยู่ใน benchmarks/corpus/<version>/ แยกไฟล์ตามธนาคาร เช่น kbank.json:
+
+    {"bank": "kbank", "slips": [{"id": "kbank-001", "text": "<ข้อความ OCR>",
+                                 "expected": {"date": "2024-01-15", "amount": 150.0, ...}}]}
+
+ข้อความทุกใบต้องลบข้อมูลจริงออกแล้ว (ชื่อ เลขบัญชี เลขอ้างอิง) ถ้าแก้ corpus ให้สร้าง version ใหม่
+แทนการแก้ของเดิม เพื่อให้ baseline เทียบกันได้
+
+    python benchmarks/slip_parser_bench.py                                  # กฎในโค้ดอย่างเดียว
+    python benchmarks/slip_parser_bench.py --rules parsing_rules.csv        # + กฎจากชีต ParsingRules
+    python benchmarks/slip_parser_bench.py --rules ... --update-baseline    # บันทึกผลเป็น baseline ใหม่
+
+exit code 1 ถ้า slips/s ต่ำกว่า baseline เกิน --max-slowdown หรือความแม่นยำฟิลด์ใดลดลงเกิน
+--max-accuracy-drop (baseline ของความเร็วขึ้นกับเครื่อง ควรสร้างบนเครื่องเดียวกับที่ใช้เทียบ)
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from slip_parser import parse_slip, compile_rules, find_amount, find_reference_id, _parse_kbank_slip, _parse_scb_slip, _parse_bbl_slip
+from preprocess_bench import FIELDS, field_matches, load_rules_csv
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, 'corpus', 'v1')
+BANK_PARSERS = {'kbank': _parse_kbank_slip, 'scb': _parse_scb_slip, 'bbl': _parse_bbl_slip}
+
+
+def load_corpus(corpus_dir):
+    slips = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.json'))):
+        if os.path.basename(path) == 'baseline.json': continue
+        with open(path, encoding='utf-8') as f: data = json.load(f)
+        slips.extend(dict(slip, bank=data['bank']) for slip in data['slips'])
+    return slips
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def time_calls(fn, inputs, repeat):
+    """เวลาต่อการเรียกหนึ่งครั้ง (วินาที) ของ fn กับทุก input ซ้ำ repeat รอบ"""
+    timings = []
+    for _ in range(repeat):
+        for args in inputs:
+            started = time.perf_counter()
+            fn(*args)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run_rules(slips, rules, repeat):
+    rules = compile_rules(rules)
+    correct, totals, misses = {field: 0 for field in FIELDS}, {field: 0 for field in FIELDS}, []
+    by_bank = {}
+    for slip in slips:
+        parsed = parse_slip(slip['text'], rules)
+        bank = by_bank.setdefault(slip['bank'], [0, 0])
+        for field, expected in slip['expected'].items():
+            ok = field_matches(expected, parsed.get(field))
+            totals[field] += 1
+            correct[field] += ok
+            bank[0] += ok
+            bank[1] += 1
+            if not ok: misses.append(f"{slip['id']}.{field}: {parsed.get(field)!r} != {expected!r}")
+    # รอบตรวจความแม่นยำด้านบนเป็น warm-up ให้การจับเวลาด้วย
+    timings = time_calls(parse_slip, [(slip['text'], rules) for slip in slips], repeat)
+    return {'slips_per_sec': round(len(timings) / sum(timings), 1),
+            'p50_us': round(statistics.median(timings) * 1e6, 1),
+            'p99_us': round(percentile(timings, 0.99) * 1e6, 1),
+            'accuracy': {field: round(correct[field] / totals[field], 4) for field in FIELDS if totals[field]},
+            'accuracy_by_bank': {bank: round(ok / total, 4) for bank, (ok, total) in sorted(by_bank.items())},
+            'misses': misses}
+
+
+def run_functions(slips, repeat):
+    """เวลาเฉลี่ย (µs) ของฟังก์ชันย่อยที่ parse_slip เรียก"""
+    texts = [(slip['text'],) for slip in slips]
+    report = {fn.__name__: statistics.mean(time_calls(fn, texts, repeat)) for fn in (find_amount, find_reference_id)}
+    for bank, fn in BANK_PARSERS.items():
+        bank_texts = [(slip['text'],) for slip in slips if slip['bank'] == bank]
+        if bank_texts: report[fn.__name__] = statistics.mean(time_calls(fn, bank_texts, repeat))
+    return {name: round(seconds * 1e6, 2) for name, seconds in report.items()}
+
+
+def compare(name, result, baseline, max_slowdown, max_accuracy_drop):
+    failures = []
+    if result['slips_per_sec'] < baseline['slips_per_sec'] * (1 - max_slowdown):
+        failures.append(f"{name}: {result['slips_per_sec']} slips/s < baseline {baseline['slips_per_sec']} (-{max_slowdown:.0%})")
+    for field, accuracy in baseline['accuracy'].items():
+        current = result['accuracy'].get(field, 0.0)
+        if current < accuracy - max_accuracy_drop:
+            failures.append(f"{name}: {field} accuracy {current:.2%} < baseline {accuracy:.2%}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--rules', action='append', default=[], help="ไฟล์ CSV ที่ export จากชีต ParsingRules (ระบุได้หลายไฟล์)")
+    parser.add_argument('--baseline', help="ไฟล์ baseline (ค่าเริ่มต้น <corpus>/baseline.json)")
+    parser.add_argument('--repeat', type=int, default=200, help="จำนวนรอบที่ parse corpus ทั้งชุดตอนจับเวลา")
+    parser.add_argument('--max-slowdown', type=float, default=0.3, help="ยอมให้ slips/s ลดลงได้กี่ส่วน (0.3 = 30%%)")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0, help="ยอมให้ความแม่นยำต่อฟิลด์ลดลงได้เท่าไร")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help="แสดงฟิลด์ที่อ่านผิดทุกรายการ")
+    args = parser.parse_args(argv)
+
+    slips = load_corpus(args.corpus)
+    if not slips: parser.error(f"no slips found in {args.corpus}")
+    baseline_path = args.baseline or os.path.join(args.corpus, 'baseline.json')
+    rule_sets = [('builtin', compile_rules([]))] + [(os.path.basename(path), load_rules_csv(path)) for path in args.rules]
+
+    print(f"corpus {os.path.basename(os.path.normpath(args.corpus))}: {len(slips)} slips")
+    print(f"functions (µs/call): {json.dumps(run_functions(slips, args.repeat), ensure_ascii=False)}")
+    results = {}
+    for name, rules in rule_sets:
+        results[name] = run_rules(slips, rules, args.repeat)
+        summary = {key: value for key, value in results[name].items() if key != 'misses'}
+        print(f"{name:>20}: {json.dumps(summary, ensure_ascii=False)}")
+        if args.verbose:
+            for miss in results[name]['misses']: print(f"{'':>22}{miss}")
+
+    if args.update_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({name: {key: value for key, value in result.items() if key in ('slips_per_sec', 'accuracy')}
+                       for name, result in results.items()}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"baseline written to {baseline_path}")
+        return 0
+    if not os.path.exists(baseline_path):
+        print(f"no baseline at {baseline_path} (run with --update-baseline)")
+        return 0
+    with open(baseline_path, encoding='utf-8') as f: baseline = json.load(f)
+    failures = []
+    for name, result in results.items():
+        if name in baseline: failures.extend(compare(name, result, baseline[name], args.max_slowdown, args.max_accuracy_drop))
+        else: print(f"{name}: not in baseline, skipped")
+    for failure in failures: print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
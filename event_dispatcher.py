@@ -0,0 +1,116 @@
+"""แยก webhook body ที่มีหลาย event ให้ทำงานพร้อมกัน โดย event จากต้นทางเดียวกันยังทำตามลำดับ
+
+LINE รวมหลาย event ไว้ใน body เดียว ถ้าส่งทั้ง body ให้ WebhookHandler.handle จะทำทีละ event
+dispatcher แยกเป็น body ย่อยทีละ event (เซ็นใหม่ด้วย channel secret เดิม) แล้วจัดเข้า "lane"
+ตาม source (group / room / user) แต่ละ lane ทำงานทีละ event ใน worker ของ JobQueue
+lane ต่างกันจึงทำพร้อมกันได้ ส่วน event ของกลุ่มเดียวกันยังเห็นผลของ event ก่อนหน้าเสมอ
+(เช่น เช็คสลิปซ้ำ, สรุปยอด)
+
+- คิวเต็มตั้งแต่ event แรกของ body: raise QueueFullError (ตอบ 503 ให้ LINE ส่งซ้ำ)
+  ถ้ารับ event ไปแล้วบางส่วน lane ที่เหลือจะรอให้ worker ที่ว่างก่อนรับไปทำต่อ (ไม่ทิ้ง event)
+- `deadline` (วินาที): event ที่ทำนานเกินกำหนด (นับจากเริ่มทำ) จะถูกนับใน timed_out, log เตือน และเรียก on_timeout
+  แต่ lane ยังรอจน event นั้นเสร็จ (ไม่ข้ามไป event ถัดไป เพื่อรักษาลำดับ และไม่เปิด thread เพิ่มไม่จำกัด)
+"""
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import threading
+
+from job_queue import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+def sign(channel_secret, body):
+    """ค่า X-Line-Signature ของ body (ใช้เซ็น body ย่อย และสร้าง payload ทดสอบ)"""
+    return base64.b64encode(hmac.new(channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()).decode('utf-8')
+
+
+def lane_key(event):
+    source = event.get('source') or {}
+    return source.get('groupId') or source.get('roomId') or source.get('userId') or event.get('webhookEventId')
+
+
+class EventDispatcher:
+    def __init__(self, handle, channel_secret, submit, deadline=None, on_timeout=None):
+        self.handle = handle          # เช่น WebhookHandler.handle(body, signature)
+        self.channel_secret = channel_secret
+        self.submit = submit          # เช่น JobQueue.submit(fn, *args)
+        self.deadline = deadline
+        self.on_timeout = on_timeout  # เรียกเมื่อ event ทำนานเกิน deadline (เช่น นับ metric)
+        self._lanes = {}              # lane -> deque ของ body ย่อยที่รอทำ
+        self._orphans = collections.deque()  # lane ที่ยังไม่มี worker รับ (คิวเต็มตอนส่ง)
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.timed_out = 0
+
+    def dispatch(self, body):
+        """แยก body (ที่ตรวจ signature แล้ว) เป็น event ย่อยแล้วส่งเข้า lane"""
+        payload = json.loads(body)
+        groups = collections.OrderedDict()
+        for event in payload.get('events', []):
+            sub_body = json.dumps({'destination': payload.get('destination'), 'events': [event]}, ensure_ascii=False)
+            groups.setdefault(lane_key(event), []).append(sub_body)
+        accepted = False
+        for key, items in groups.items():
+            with self._lock:
+                lane = self._lanes.get(key)
+                if lane is not None:
+                    lane.extend(items)  # lane นี้มี worker อยู่แล้ว ต่อท้ายให้ทำตามลำดับ
+                    accepted = True
+                    continue
+                self._lanes[key] = collections.deque(items)
+            try:
+                self.submit(self._run_lane, key)
+            except QueueFullError:
+                with self._lock:
+                    if not accepted:
+                        del self._lanes[key]
+                        raise
+                    self._orphans.append(key)
+                    logger.warning("Job queue full, lane %s waits for a free worker", key)
+            accepted = True
+        self.dispatched += sum(len(items) for items in groups.values())
+
+    def _run_lane(self, key):
+        while key is not None:
+            while True:
+                with self._lock:
+                    lane = self._lanes[key]
+                    if not lane:
+                        del self._lanes[key]
+                        break
+                    sub_body = lane.popleft()
+                self._handle(sub_body)
+            with self._lock:
+                key = self._orphans.popleft() if self._orphans else None
+
+    def _handle(self, sub_body):
+        signature = sign(self.channel_secret, sub_body)
+        timer = threading.Timer(self.deadline, self._overdue) if self.deadline else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try: self.handle(sub_body, signature)
+        except Exception: logger.exception("Event handler failed")
+        finally:
+            if timer: timer.cancel()
+
+    def _overdue(self):
+        with self._lock: self.timed_out += 1
+        logger.warning("Event still running after its %ss deadline, the lane keeps waiting for it", self.deadline)
+        if self.on_timeout:
+            try: self.on_timeout()
+            except Exception: logger.exception("Event timeout callback failed")
+
+    def pending(self):
+        """(lane, body ย่อย) ของ event ที่ยังไม่ได้เริ่มทำ (ใช้ log ตอนปิด worker)"""
+        with self._lock: return [(key, sub_body) for key, lane in self._lanes.items() for sub_body in lane]
+
+    def stats(self):
+        with self._lock:
+            return {'lanes': len(self._lanes), 'waiting': sum(len(lane) for lane in self._lanes.values()),
+                    'orphans': len(self._orphans), 'dispatched': self.dispatched, 'timed_out': self.timed_out}
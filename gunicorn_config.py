@@ -1,3 +1,19 @@
 # gunicorn_config.py
+import os
+
 # ตั้งค่า timeout ของ worker เป็น 120 วินาที (จากค่าเริ่มต้น 30)
-timeout = 120
\ No newline at end of file
+timeout = 120
+
+def on_starting(server):
+    # เริ่ม server ใหม่: ทิ้ง snapshot ข้อมูลอ้างอิงรอบก่อน ให้ worker แรกโหลดจาก Sheets ครั้งเดียวแล้วแชร์ให้ worker อื่น
+    path = os.environ.get('REFERENCE_SNAPSHOT_PATH', 'reference_snapshot.json')
+    if os.path.exists(path): os.remove(path)
+    # ค่า metric ของ worker รอบก่อน (ไฟล์ <pid>.json) ไม่เกี่ยวกับรอบนี้แล้ว
+    from metrics import clear_directory
+    clear_directory(os.environ.get('METRICS_DIR', 'metrics'))
+
+def worker_exit(server, worker):
+    # worker thread ของคิวงานเป็น daemon: ต้องรองานที่ค้างก่อน process ปิด ไม่อย่างนั้น event ที่ตอบ LINE ไปแล้วจะหาย
+    import sys
+    bot = sys.modules.get('main')
+    if bot is not None: bot.drain_background_work()
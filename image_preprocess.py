@@ -0,0 +1,90 @@
+import hashlib
+import io
+import logging
+import tempfile
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:  # ไม่มี Pillow: ส่งไฟล์เดิมไป OCR (แต่ยังระบุชนิดไฟล์ให้ถูก)
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('downscale', 'grayscale', 'autocrop')
+OUTPUT_FORMATS = ('jpeg', 'png', 'original')
+FORMATS = {'jpeg': ('receipt.jpg', 'image/jpeg'), 'png': ('receipt.png', 'image/png'),
+           'gif': ('receipt.gif', 'image/gif'), 'webp': ('receipt.webp', 'image/webp')}
+
+
+def sniff_format(head):
+    if head.startswith(b'\x89PNG'): return 'png'
+    if head.startswith(b'GIF8'): return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return 'webp'
+    return 'jpeg'
+
+
+def download_content(message_content, chunk_size=64 * 1024, max_memory=1024 * 1024):
+    """อ่านรูปจาก LINE แบบ stream ลงไฟล์ชั่วคราว (เกิน max_memory จะลงดิสก์) พร้อมคำนวณ SHA-256"""
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    digest = hashlib.sha256()
+    for chunk in message_content.iter_content(chunk_size):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def _autocrop(img, threshold=16, margin=8):
+    # ตัดขอบที่สีเดียวกับมุมซ้ายบน (พื้นหลัง/แถบสถานะ) ออก เหลือเฉพาะส่วนของสลิป
+    gray = img.convert('L')
+    background = Image.new('L', gray.size, gray.getpixel((0, 0)))
+    diff = ImageChops.difference(gray, background).point(lambda value: 255 if value > threshold else 0)
+    bbox = diff.getbbox()
+    if not bbox: return img
+    left, top, right, bottom = bbox
+    return img.crop((max(0, left - margin), max(0, top - margin), min(img.width, right + margin), min(img.height, bottom + margin)))
+
+
+def preprocess(fileobj, stages=('downscale', 'grayscale'), target_width=1000, output_format='jpeg', jpeg_quality=85):
+    """แปลงรูปก่อนส่ง OCR คืน (bytes, filename, mimetype)
+
+    stages ทำตามลำดับที่ให้มา: downscale (ย่อให้กว้างไม่เกิน target_width px),
+    grayscale, autocrop  ส่วน output_format เป็น 'jpeg', 'png' หรือ 'original'
+    ถ้าแปลงรูปไม่ได้ (ไฟล์เสีย, ใหญ่เกิน MAX_IMAGE_PIXELS ฯลฯ) จะส่งไฟล์เดิมไปให้ OCR ตัดสินเอง
+    """
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown: raise ValueError(f"Unknown preprocess stage: {', '.join(unknown)}")
+    if output_format not in OUTPUT_FORMATS: raise ValueError(f"Unknown output format: {output_format}")
+    fileobj.seek(0)
+    head = fileobj.read(16)
+    fileobj.seek(0)
+    original = sniff_format(head)
+    if Image is None or (not stages and output_format == 'original'):
+        filename, mimetype = FORMATS[original]
+        return fileobj.read(), filename, mimetype
+    try:
+        return _convert(fileobj, stages, target_width, output_format, jpeg_quality, original)
+    except Exception as e:  # รวม DecompressionBombError ซึ่งไม่ใช่ OSError
+        logger.warning("Preprocessing failed (%s: %s), sending the original image", type(e).__name__, e)
+        fileobj.seek(0)
+        filename, mimetype = FORMATS[original]
+        return fileobj.read(), filename, mimetype
+
+
+def _convert(fileobj, stages, target_width, output_format, jpeg_quality, original):
+    with Image.open(fileobj) as source:
+        img = ImageOps.exif_transpose(source)
+        for stage in stages:
+            if stage == 'downscale' and img.width > target_width:
+                img = img.resize((target_width, round(img.height * target_width / img.width)), Image.LANCZOS)
+            elif stage == 'grayscale':
+                img = img.convert('L')
+            elif stage == 'autocrop':
+                img = _autocrop(img)
+        fmt = original if output_format == 'original' else output_format
+        if fmt == 'jpeg' and img.mode not in ('L', 'RGB'): img = img.convert('RGB')
+        out = io.BytesIO()
+        if fmt == 'jpeg': img.save(out, 'JPEG', quality=jpeg_quality, optimize=True)
+        else: img.save(out, fmt.upper(), optimize=True)
+    filename, mimetype = FORMATS[fmt]
+    return out.getvalue(), filename, mimetype
@@ -0,0 +1,104 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """คิวเต็ม (backpressure) - ให้ webhook ตอบ 503 เพื่อให้ LINE ส่งซ้ำภายหลัง"""
+
+
+class JobQueue:
+    """คิวงานแบบจำกัดขนาด + pool ของ worker threads
+
+    webhook แค่ตรวจ signature แล้วโยนงานเข้าคิว ส่วน OCR / parse / บันทึกชีต
+    ทำใน worker ซึ่งจำกัดจำนวนงานที่ทำพร้อมกันไว้ที่ `workers`
+    `backend` รับ object ที่มี put/get/task_done/join/qsize แบบ queue.Queue
+    (ใช้คิวในเครื่องแทนตอนทดสอบได้)
+    ตอน process ปิด (atexit หรือ gunicorn worker_exit) `drain` รองานที่ค้างไม่เกิน
+    `drain_timeout` วินาที งานที่เหลือจะถูก log ไว้แทนการหายไปเงียบๆ
+    """
+
+    def __init__(self, workers=4, maxsize=100, put_timeout=0.5, backend=None, drain_timeout=25.0):
+        self.workers = max(1, int(workers))
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+        self._closed = False
+        self._queue = backend if backend is not None else queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._active = 0
+
+    def start(self):
+        # สร้าง thread ตอนใช้งานครั้งแรกใน process นี้ (gunicorn fork worker หลัง import)
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        atexit.register(self.drain)
+
+    def submit(self, fn, *args, **kwargs):
+        if self._closed: raise QueueFullError("job queue is shutting down")
+        self.start()
+        try:
+            self._queue.put((fn, args, kwargs), timeout=self.put_timeout)
+        except queue.Full:
+            raise QueueFullError(f"job queue is full ({self._queue.qsize()} jobs waiting)")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None: return
+                fn, args, kwargs = job
+                with self._lock: self._active += 1
+                try: fn(*args, **kwargs)
+                finally:
+                    with self._lock: self._active -= 1
+            except Exception:
+                logger.exception("Background job failed")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """รอจนงานในคิวเสร็จหมด"""
+        self._queue.join()
+
+    def drain(self, timeout=None):
+        """หยุดรับงานใหม่ แล้วรองานที่ค้างให้เสร็จไม่เกิน timeout วินาที (ค่าเริ่มต้น drain_timeout)
+
+        งานที่ยังไม่ได้เริ่มเมื่อหมดเวลาจะถูกเอาออกจากคิวและ log ไว้ทีละงาน คืนจำนวนงานที่ทิ้ง
+        """
+        if self._pid != os.getpid() or self._closed: return 0
+        self._closed = True
+        waiter = threading.Thread(target=self._queue.join, name="job-drain", daemon=True)
+        waiter.start()
+        waiter.join(self.drain_timeout if timeout is None else timeout)
+        dropped = 0
+        while True:
+            try: job = self._queue.get(block=False)
+            except queue.Empty: break
+            if job is not None:
+                fn, args, kwargs = job
+                dropped += 1
+                logger.error("Dropped queued job at shutdown: %s args=%r kwargs=%r", getattr(fn, '__qualname__', fn), args, kwargs)
+            self._queue.task_done()
+        if self._active: logger.error("%d jobs were still running at shutdown", self._active)
+        return dropped
+
+    def stop(self):
+        for _ in self._threads: self._queue.put(None)
+        for t in self._threads: t.join()
+        self._threads = []
+        self._pid = None
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'active': self._active, 'workers': self.workers}
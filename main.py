@@ -1,7 +1,6 @@
 # === FINAL, COMPLETE, AND VERIFIED main.py (All Features Included) ===
-import os, json, re
-from flask import Flask, request, abort
-import requests
+import os, json, re, time
+from flask import Flask, request, abort, jsonify, Response, stream_with_context
 from datetime import datetime, timezone, timedelta
 import gspread
 from google.oauth2.service_account import Credentials
@@ -12,6 +11,21 @@ from linebot.exceptions import (InvalidSignatureError, LineBotApiError)
 from linebot.models import (MessageEvent, ImageMessage, TextSendMessage, JoinEvent, FollowEvent, SourceUser, SourceGroup, TextMessage)
 
 from slip_parser import parse_slip
+from job_queue import JobQueue, QueueFullError
+from event_dispatcher import EventDispatcher
+from ref_index import RefIndex
+from write_behind import WriteBehindBuffer
+from rollups import RollupStore
+from approvals import ApprovalCache
+from ttl_cache import TTLCache
+from ocr_cache import OCRCache
+from image_preprocess import download_content, preprocess, STAGES as PREPROCESS_STAGES, OUTPUT_FORMATS as UPLOAD_FORMATS
+from slip_qr import read_slip_qr, available as slip_qr_available
+from ocr_client import OCRClient, OCRError, RetryableOCRError, build_backend, OCR_SPACE_URL
+from reference_data import ReferenceStore, fetch_reference_values
+from sheets_scheduler import SheetsScheduler, is_transient as is_transient_sheets_error
+from metrics import Metrics
+import transaction_export
 
 # --- ส่วนตั้งค่า ---
 CHANNEL_ACCESS_TOKEN = os.environ.get('CHANNEL_ACCESS_TOKEN')
@@ -20,67 +34,163 @@ OCR_SPACE_API_KEY = os.environ.get('OCR_SPACE_API_KEY')
 ADMIN_USER_ID = os.environ.get('ADMIN_USER_ID')
 GOOGLE_CREDENTIALS_JSON_STRING = os.environ.get('GOOGLE_CREDENTIALS_JSON')
 GOOGLE_SHEET_ID = os.environ.get('GOOGLE_SHEET_ID')
+# 'queue' = ตอบ LINE ทันทีแล้วประมวลผลเบื้องหลัง, 'inline' = ประมวลผลใน request เหมือนเดิม
+JOB_QUEUE_MODE = os.environ.get('JOB_QUEUE_MODE', 'queue')
+WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', 4))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))
+# ตอนปิด worker รองานที่ค้างในคิวได้นานสุดกี่วินาที (ควรน้อยกว่า graceful_timeout ของ gunicorn)
+JOB_DRAIN_TIMEOUT = float(os.environ.get('JOB_DRAIN_TIMEOUT', 25))
+# reply token ใช้ได้ราว 1 นาที เกินกว่านี้ให้ส่งผลด้วย push_message แทน
+REPLY_TOKEN_TTL = int(os.environ.get('REPLY_TOKEN_TTL', 50))
+# event ที่ทำนานเกินกี่วินาทีให้ log เตือนและนับ metric (event ถัดไปของกลุ่มเดียวกันยังรอจนเสร็จ, 0 = ไม่ตรวจ)
+EVENT_DEADLINE = float(os.environ.get('EVENT_DEADLINE', 90))
+REF_INDEX_PATH = os.environ.get('REF_INDEX_PATH', 'ref_index.sqlite3')
+# การจองเลขอ้างอิงที่ค้างนานกว่านี้ (วินาที) และไม่มีในชีต/journal จะถูกปล่อยตอน reconcile
+REF_CLAIM_STALE_AFTER = float(os.environ.get('REF_CLAIM_STALE_AFTER', 600))
+# write-behind: ตอบผู้ใช้ทันทีหลังบันทึก journal แล้วค่อยส่งเข้าชีตเป็นชุดด้วย append_rows
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '1') == '1'
+WRITE_BEHIND_DIR = os.environ.get('WRITE_BEHIND_DIR', 'journal')
+FLUSH_INTERVAL = float(os.environ.get('FLUSH_INTERVAL', 5))
+FLUSH_BATCH_SIZE = int(os.environ.get('FLUSH_BATCH_SIZE', 20))
+# แถวที่ส่งเข้าชีตไม่ผ่านด้วย error ที่ไม่ใช่ชั่วคราว (เช่น HTTP 400) ครบกี่ครั้งจึงย้ายไปไฟล์ dead letter
+FLUSH_MAX_ATTEMPTS = int(os.environ.get('FLUSH_MAX_ATTEMPTS', 5))
+DEAD_LETTER_PATH = os.environ.get('DEAD_LETTER_PATH', os.path.join(WRITE_BEHIND_DIR, 'dead-letter.jsonl'))
+ROLLUP_PATH = os.environ.get('ROLLUP_PATH', 'rollups.sqlite3')
+APPROVAL_TTL = int(os.environ.get('APPROVAL_TTL', 300))
+APPROVAL_NEGATIVE_TTL = int(os.environ.get('APPROVAL_NEGATIVE_TTL', 30))
+# ไฟล์ที่ "reload approvals" / source ใหม่ เขียนใหม่เพื่อให้ทุก worker ล้างตารางอนุมัติ
+APPROVAL_GENERATION_PATH = os.environ.get('APPROVAL_GENERATION_PATH', 'approval_generation')
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 2048))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 3600))
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', 'ocr_cache.sqlite3')
+OCR_CACHE_MAX_MB = int(os.environ.get('OCR_CACHE_MAX_MB', 50))
+# 0 = เทียบแค่ SHA-256, >0 = ยอมให้ dHash ต่างกันได้ไม่เกินกี่บิต (ต้องมี Pillow และ SLIP_QR_ENABLED
+# เพราะผลจาก dHash ใช้ได้เมื่อเลขอ้างอิงจาก QR ตรงกับของเดิมเท่านั้น)
+OCR_CACHE_PHASH_DISTANCE = int(os.environ.get('OCR_CACHE_PHASH_DISTANCE', 0))
+# ขั้นตอนแปลงรูปก่อนส่ง OCR (downscale, grayscale, autocrop) และรูปแบบไฟล์ที่ส่ง (jpeg, png, original)
+OCR_PREPROCESS_STAGES = [stage.strip() for stage in os.environ.get('OCR_PREPROCESS', 'downscale,grayscale').split(',') if stage.strip()]
+OCR_TARGET_WIDTH = int(os.environ.get('OCR_TARGET_WIDTH', 1000))
+OCR_UPLOAD_FORMAT = os.environ.get('OCR_UPLOAD_FORMAT', 'jpeg')
+# ตั้งค่าผิดให้ล้มตั้งแต่เริ่ม ไม่ใช่ตอนสลิปแรกเข้ามา
+if set(OCR_PREPROCESS_STAGES) - set(PREPROCESS_STAGES):
+    raise ValueError(f"Unknown OCR_PREPROCESS stage(s): {', '.join(sorted(set(OCR_PREPROCESS_STAGES) - set(PREPROCESS_STAGES)))} (expected {', '.join(PREPROCESS_STAGES)})")
+if OCR_UPLOAD_FORMAT not in UPLOAD_FORMATS:
+    raise ValueError(f"Unknown OCR_UPLOAD_FORMAT: {OCR_UPLOAD_FORMAT} (expected {', '.join(UPLOAD_FORMATS)})")
+# อ่านเลขอ้างอิงจาก QR บนสลิปก่อน OCR (ต้องมี opencv-python-headless จาก requirements.txt หรือ pyzbar)
+SLIP_QR_ENABLED = os.environ.get('SLIP_QR_ENABLED', '1') == '1'
+if SLIP_QR_ENABLED and not slip_qr_available():
+    print("Warning: SLIP_QR_ENABLED but no QR decoder is installed (OpenCV or pyzbar), slips go straight to OCR")
+# backend ของ OCR ตามลำดับ (ตัวแรกหลัก ที่เหลือเป็น fallback) เช่น 'ocrspace,tesseract'
+OCR_BACKENDS = [name.strip() for name in os.environ.get('OCR_BACKENDS', 'ocrspace').split(',') if name.strip()]
+OCR_DEADLINE = float(os.environ.get('OCR_DEADLINE', 30))
+OCR_RETRIES = int(os.environ.get('OCR_RETRIES', 2))
+OCR_MAX_CONCURRENCY = int(os.environ.get('OCR_MAX_CONCURRENCY', 4))
+# >0 = ถ้า backend แรกยังไม่ตอบภายในกี่วินาที ให้ยิง backend ถัดไปคู่กัน
+OCR_HEDGE_AFTER = float(os.environ.get('OCR_HEDGE_AFTER', 0))
+# ไฟล์ snapshot ของ Config/Aliases/ParsingRules ที่ทุก worker ใช้ร่วมกัน
+REFERENCE_SNAPSHOT_PATH = os.environ.get('REFERENCE_SNAPSHOT_PATH', 'reference_snapshot.json')
+REFERENCE_POLL_INTERVAL = float(os.environ.get('REFERENCE_POLL_INTERVAL', 1))
+# โหลดข้อมูลอ้างอิงไม่สำเร็จ: รอกี่วินาทีก่อนลองโหลดเองอีกครั้ง
+REFERENCE_RETRY_AFTER = float(os.environ.get('REFERENCE_RETRY_AFTER', 30))
+# โควตา Google Sheets (request ต่อนาที) ที่ตัวจัดคิวใช้เป็นขนาด token bucket
+SHEETS_REQUESTS_PER_MINUTE = int(os.environ.get('SHEETS_REQUESTS_PER_MINUTE', 60))
+# ไฟล์ token bucket ที่ทุก worker (และ backfill) ใช้ร่วมกัน โควตาข้างบนจึงเป็นของทั้งเครื่อง (ว่าง = แยกต่อ process)
+SHEETS_BUCKET_PATH = os.environ.get('SHEETS_BUCKET_PATH', 'sheets_bucket.bin')
+# โฟลเดอร์ที่แต่ละ worker เขียนค่า metric ไว้ให้ /metrics รวมผล (ว่าง = ดูเฉพาะ worker ที่ตอบ)
+METRICS_DIR = os.environ.get('METRICS_DIR', 'metrics')
+# >0 = log เวลาแยกตามขั้นตอนของ request ที่ใช้เวลาเกินกี่วินาที
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))
+# ลิงก์ดาวน์โหลดไฟล์ export: URL สาธารณะของบอท, key ที่ใช้เซ็นลิงก์ และอายุลิงก์ (วินาที)
+# EXPORT_SECRET ต้องตั้งแยกจาก CHANNEL_SECRET (ไม่ตั้ง = ปิด export และ /export ตอบ 404)
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL')
+EXPORT_SECRET = os.environ.get('EXPORT_SECRET')
+if EXPORT_SECRET and EXPORT_SECRET == CHANNEL_SECRET:
+    raise ValueError("EXPORT_SECRET must be different from CHANNEL_SECRET")
+EXPORT_LINK_TTL = int(os.environ.get('EXPORT_LINK_TTL', 3600))
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 1000))
 
 # --- ส่วนเริ่มต้นโปรแกรม ---
 app = Flask(__name__)
 line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(CHANNEL_SECRET)
+job_queue = JobQueue(workers=WORKER_POOL_SIZE, maxsize=JOB_QUEUE_SIZE, drain_timeout=JOB_DRAIN_TIMEOUT)
+# event หลายอันใน body เดียวทำพร้อมกันได้ แต่ event จากกลุ่ม/ผู้ใช้เดียวกันทำตามลำดับ
+event_dispatcher = EventDispatcher(handler.handle, CHANNEL_SECRET, job_queue.submit, deadline=EVENT_DEADLINE or None,
+                                   on_timeout=lambda: metrics.inc('slip_event_overdue_total'))
+ocr_client = OCRClient([build_backend(name, api_key=OCR_SPACE_API_KEY, url=os.environ.get('OCR_SPACE_URL', OCR_SPACE_URL)) for name in OCR_BACKENDS],
+                       deadline=OCR_DEADLINE, retries=OCR_RETRIES, max_concurrency=OCR_MAX_CONCURRENCY, hedge_after=OCR_HEDGE_AFTER or None)
+metrics = Metrics(METRICS_DIR, slow_threshold=SLOW_REQUEST_THRESHOLD)
+metrics.describe('slip_request_seconds', "Time spent handling one webhook request or LINE event")
+metrics.describe('slip_stage_seconds', "Time spent in each stage of a handler")
+metrics.describe('slip_cache_total', "OCR cache lookups by result")
+metrics.describe('ocr_failures_total', "OCR calls that returned no text")
+metrics.describe('slip_duplicates_total', "Slips rejected as duplicates, by the check that caught them")
+metrics.describe('slip_parse_misses_total', "Parsed slips missing a field")
+metrics.describe('slip_event_overdue_total', "LINE events still running after EVENT_DEADLINE")
+metrics.describe('slip_write_behind_backlog', "Journaled rows not yet written to the sheet")
+metrics.describe('slip_write_behind_lag_seconds', "Age of the oldest journaled row not yet written to the sheet")
+metrics.describe('slip_write_behind_dead_lettered', "Rows moved to the dead-letter file since the worker started")
+ocr_cache = OCRCache(OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024, phash_distance=OCR_CACHE_PHASH_DISTANCE)
 
 # --- ระบบ Cache ---
-_spreadsheet = None
-_aliases_cache = None
-_config_cache = None
-_parsing_rules_cache = None
+_ref_index = None
+_rollup_store = None
 
 # --- ฟังก์ชัน Helpers ---
+def open_spreadsheet():
+    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file']
+    credentials = Credentials.from_service_account_info(json.loads(GOOGLE_CREDENTIALS_JSON_STRING), scopes=scopes)
+    gc = gspread.authorize(credentials)
+    return gc.open_by_key(GOOGLE_SHEET_ID), credentials
+
+# ทุกการเรียก Sheets ผ่าน sheets.read / sheets.write (คุมโควตา, retry, รวม request ที่ซ้ำกัน)
+sheets = SheetsScheduler(open_spreadsheet, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, bucket_path=SHEETS_BUCKET_PATH or None)
+
 def get_spreadsheet():
-    global _spreadsheet
-    if _spreadsheet: return _spreadsheet
-    try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file']
-        credentials = Credentials.from_service_account_info(json.loads(GOOGLE_CREDENTIALS_JSON_STRING), scopes=scopes)
-        gc = gspread.authorize(credentials)
-        _spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
-        return _spreadsheet
-    except: return None
+    return sheets.spreadsheet()
 
-def get_parsing_rules():
-    global _parsing_rules_cache
-    if _parsing_rules_cache is not None: return _parsing_rules_cache
+def fetch_reference_sheets():
     spreadsheet = get_spreadsheet()
-    if not spreadsheet: _parsing_rules_cache = []; return _parsing_rules_cache
-    try:
-        rules_sheet = spreadsheet.worksheet("ParsingRules")
-        records = rules_sheet.get_all_records()
-        _parsing_rules_cache = [
-            r for r in records if r.get('IdentifierText') and r.get('TargetField') and r.get('SearchMethod')
-        ]
-        return _parsing_rules_cache
-    except: _parsing_rules_cache = []; return _parsing_rules_cache
+    if not spreadsheet: raise RuntimeError("DB connection error")
+    # Config, Aliases, ParsingRules ในการเรียก Sheets ครั้งเดียว (ชีตที่หายไปได้ข้อมูลว่างเฉพาะชีตนั้น)
+    return fetch_reference_values(spreadsheet, sheets.read)
+
+reference_store = ReferenceStore(REFERENCE_SNAPSHOT_PATH, fetch_reference_sheets, poll_interval=REFERENCE_POLL_INTERVAL, retry_after=REFERENCE_RETRY_AFTER)
+
+def get_parsing_rules():
+    return reference_store.current().rules_engine
 
 def get_aliases():
-    global _aliases_cache
-    if _aliases_cache is not None: return _aliases_cache
-    spreadsheet = get_spreadsheet()
-    if not spreadsheet: _aliases_cache = {}; return _aliases_cache
-    try:
-        alias_sheet = spreadsheet.worksheet("Aliases")
-        records = alias_sheet.get_all_records()
-        _aliases_cache = {record['OriginalName']: record['Nickname'] for record in records if record.get('OriginalName')}
-        return _aliases_cache
-    except: _aliases_cache = {}; return _aliases_cache
+    return reference_store.current().aliases
 
 def get_config():
-    global _config_cache
-    if _config_cache is not None: return _config_cache
-    spreadsheet = get_spreadsheet()
-    if not spreadsheet: _config_cache = {}; return _config_cache
-    try:
-        config_sheet = spreadsheet.worksheet("Config")
-        records = config_sheet.get_all_records()
-        _config_cache = {record['Key']: record['Value'] for record in records if record.get('Key')}
-        return _config_cache
-    except: _config_cache = {}; return _config_cache
+    return reference_store.current().config
+
+# ชื่อกลุ่ม/ชื่อสมาชิกแทบไม่เปลี่ยน จึง cache ไว้ (สลิปหลายใบจากคนเดียวกันเรียก API ครั้งเดียว)
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+def get_group_name(group_id):
+    return profile_cache.get_or_load(('group', group_id), lambda: line_bot_api.get_group_summary(group_id).group_name)
+
+def get_member_name(group_id, user_id):
+    return profile_cache.get_or_load(('member', group_id, user_id), lambda: line_bot_api.get_group_member_profile(group_id, user_id).display_name)
+
+def get_user_name(user_id):
+    return profile_cache.get_or_load(('user', user_id), lambda: line_bot_api.get_profile(user_id).display_name)
+
+def get_push_target(source):
+    return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or source.user_id
+
+def send_reply(event, text):
+    message = TextSendMessage(text=text)
+    if time.time() - event.timestamp / 1000 < REPLY_TOKEN_TTL:
+        try:
+            line_bot_api.reply_message(event.reply_token, message)
+            return
+        except LineBotApiError as e:
+            if e.status_code != 400: raise
+    # reply token หมดอายุแล้ว (งานรอในคิวนาน) -> push ไปที่ต้นทางแทน
+    line_bot_api.push_message(get_push_target(event.source), message)
 
 def get_string(key, **kwargs):
     config = get_config()
@@ -91,99 +201,213 @@ def add_alias_to_sheet(original_name, nickname):
     spreadsheet = get_spreadsheet()
     if not spreadsheet: return False, "DB connection error"
     try:
-        alias_sheet = spreadsheet.worksheet("Aliases")
-        cell = alias_sheet.find(original_name, in_column=1)
+        alias_sheet = sheets.worksheet("Aliases")
+        cell = sheets.read(alias_sheet.find, original_name, in_column=1)
         if cell:
-            alias_sheet.update_cell(cell.row, 2, nickname)
+            sheets.write(alias_sheet.update_cell, cell.row, 2, nickname, idempotent=True)
             message = get_string('MSG_ALIAS_UPDATED')
         else:
-            alias_sheet.append_row([original_name, nickname])
+            sheets.write(alias_sheet.append_row, [original_name, nickname], verify=lambda: bool(sheets.read(alias_sheet.find, original_name, in_column=1, coalesce=False)))
             message = get_string('MSG_ALIAS_ADDED')
-        global _aliases_cache
-        _aliases_cache = None
+        try: reference_store.reload()
+        except Exception as e: message += f"\n(บันทึกแล้ว แต่โหลดข้อมูลอ้างอิงใหม่ไม่สำเร็จ: {e})"
         return True, message
     except Exception as e: return False, f"เกิดข้อผิดพลาด: {e}"
 
+def load_approval_table():
+    rows = sheets.read(sheets.worksheet("Sheet1").get_all_values, background=True)
+    return {row[0]: str(row[3]).strip().lower() for row in rows if len(row) >= 4 and row[0]}
+
+approval_cache = ApprovalCache(load_approval_table, ttl=APPROVAL_TTL, negative_ttl=APPROVAL_NEGATIVE_TTL,
+                               generation_path=APPROVAL_GENERATION_PATH, poll_interval=REFERENCE_POLL_INTERVAL)
+
 def is_approved(source_id):
-    spreadsheet = get_spreadsheet()
-    if not spreadsheet: return False
-    try:
-        worksheet = spreadsheet.worksheet("Sheet1")
-        cell = worksheet.find(source_id)
-        return cell and worksheet.cell(cell.row, 4).value.lower() == 'approved'
-    except: return False
+    return approval_cache.is_approved(source_id)
 
 def register_source(source_id, display_name, source_type):
     spreadsheet = get_spreadsheet()
     if not spreadsheet: return
     try:
-        worksheet = spreadsheet.worksheet("Sheet1")
-        if not worksheet.find(source_id):
-            worksheet.append_row([source_id, display_name, source_type, 'pending', datetime.now().isoformat()])
+        worksheet = sheets.worksheet("Sheet1")
+        if not sheets.read(worksheet.find, source_id):
+            sheets.write(worksheet.append_row, [source_id, display_name, source_type, 'pending', datetime.now().isoformat()],
+                         verify=lambda: bool(sheets.read(worksheet.find, source_id, coalesce=False)))
+            approval_cache.invalidate()
             if ADMIN_USER_ID:
                 line_bot_api.push_message(ADMIN_USER_ID, TextSendMessage(text=f"New {source_type} needs approval:\nName: {display_name}"))
     except Exception as e: print(f"Error registering source: {e}")
 
+def get_ref_index():
+    global _ref_index
+    if _ref_index is not None: return _ref_index
+    spreadsheet = get_spreadsheet()
+    if not spreadsheet: return None
+    try:
+        index = RefIndex(REF_INDEX_PATH)
+        if not index.is_built():
+            _reconcile(index)
+        _ref_index = index
+        return _ref_index
+    except Exception as e:
+        print(f"Error building ref index: {e}")
+        return None
+
+def _reconcile(index):
+    # อ่าน journal ก่อนชีต: แถวที่ flush เสร็จระหว่างนั้นจะเจออย่างน้อยในที่ใดที่หนึ่ง (หรือมี written_at หลัง started_at)
+    started_at = time.time()
+    pending = {entry.get('ref_id') for entry in transaction_writer.pending_entries()} if WRITE_BEHIND else set()
+    return index.reconcile(sheets.read(sheets.worksheet("Transactions").col_values, 6, background=True), pending=pending,
+                           stale_after=REF_CLAIM_STALE_AFTER, started_at=started_at)
+
+def reconcile_ref_index():
+    spreadsheet = get_spreadsheet()
+    index = get_ref_index()
+    if not spreadsheet or not index: return False, "DB connection error"
+    try:
+        added, removed, released = _reconcile(index)
+        return True, f"ซิงก์เลขอ้างอิงกับชีตแล้ว (เพิ่ม {added}, ลบ {removed}, ปล่อยการจองที่ค้าง {released})"
+    except Exception as e: return False, f"เกิดข้อผิดพลาด: {e}"
+
+def _row_from_append_response(response):
+    # เช่น {'updates': {'updatedRange': "Transactions!A42:J42"}}
+    match = re.search(r'![A-Z]+(\d+)', (response or {}).get('updates', {}).get('updatedRange', ''))
+    return int(match.group(1)) if match else 0
+
+def logged_rows(ref_ids):
+    """ref_id -> เลขแถวในชีต ของ ref_id ที่อยู่ในคอลัมน์ RefId แล้ว (ใช้ตรวจว่าการเขียนที่ไม่ได้คำตอบสำเร็จหรือไม่)"""
+    wanted, rows = set(ref_ids), {}
+    for row, value in enumerate(sheets.read(sheets.worksheet("Transactions").col_values, 6, coalesce=False), start=1):
+        if value in wanted: rows.setdefault(value, row)
+    return rows
+
+def _flush_transactions(entries):
+    index = get_ref_index()
+    if any(entry.get('uncertain') for entry in entries):
+        # ชุดนี้อาจเขียนสำเร็จไปแล้วแต่ไม่ได้คำตอบ (flush ก่อนหน้าล้ม / process ตายกลางทาง): ตัดแถวที่อยู่ในชีตแล้วออก
+        written = logged_rows(entry['ref_id'] for entry in entries if entry.get('uncertain'))
+        if index:
+            for ref_id, row in written.items(): index.set_row(ref_id, row)
+        entries = [entry for entry in entries if not (entry.get('uncertain') and entry['ref_id'] in written)]
+        if not entries: return
+    ref_ids = {entry['ref_id'] for entry in entries}
+    response = sheets.write(sheets.worksheet("Transactions").append_rows, [entry['row'] for entry in entries], value_input_option='USER_ENTERED',
+                            verify=lambda: len(logged_rows(ref_ids)) == len(ref_ids))
+    first_row = _row_from_append_response(response)
+    if index:
+        for offset, entry in enumerate(entries):
+            index.set_row(entry['ref_id'], first_row + offset if first_row else 0)
+
+transaction_writer = WriteBehindBuffer(WRITE_BEHIND_DIR, _flush_transactions, flush_interval=FLUSH_INTERVAL, max_batch=FLUSH_BATCH_SIZE,
+                                       max_attempts=FLUSH_MAX_ATTEMPTS, dead_letter_path=DEAD_LETTER_PATH, is_transient=is_transient_sheets_error)
+metrics.gauge('slip_write_behind_backlog', lambda: transaction_writer.stats()['backlog'])
+metrics.gauge('slip_write_behind_lag_seconds', lambda: transaction_writer.stats()['flush_lag_seconds'], aggregate='max')
+metrics.gauge('slip_write_behind_dead_lettered', lambda: transaction_writer.dead_lettered)
+
+def build_transaction_row(log_data):
+    thai_tz = timezone(timedelta(hours=7))
+    timestamp = datetime.now(thai_tz).strftime("%Y-%m-%d %H:%M:%S")
+    return [ timestamp, log_data.get('date', 'N/A'), log_data.get('from', 'N/A'), log_data.get('to', 'N/A'), log_data.get('amount', 0.0), log_data.get('ref_id'), log_data.get('source_id', 'N/A'), log_data.get('sender_name', 'N/A'), log_data.get('sender_id', 'N/A'), log_data.get('source_group_name', 'N/A') ]
+
+def find_logged_ref(ref_id):
+    """เลขแถวของ ref_id ที่บันทึกแล้ว (0 = ยังรอเขียน) หรือ None ถ้ายังไม่เคยบันทึก/ไม่มีดัชนี"""
+    index = get_ref_index()
+    return index.find(ref_id) if index else None
+
 def log_transaction_to_sheet(log_data):
     spreadsheet = get_spreadsheet()
     if not spreadsheet: return False, "DB connection error"
     try:
-        worksheet = spreadsheet.worksheet("Transactions")
         ref_id = log_data.get('ref_id')
         if not ref_id or ref_id == 'N/A':
             return False, get_string('MSG_LOG_NO_REF')
-        cell = worksheet.find(ref_id, in_column=6)
-        if cell:
-            return False, get_string('MSG_LOG_DUPLICATE', row=cell.row)
-        thai_tz = timezone(timedelta(hours=7))
-        timestamp = datetime.now(thai_tz).strftime("%Y-%m-%d %H:%M:%S")
-        new_row = [ timestamp, log_data.get('date', 'N/A'), log_data.get('from', 'N/A'), log_data.get('to', 'N/A'), log_data.get('amount', 0.0), ref_id, log_data.get('source_id', 'N/A'), log_data.get('sender_name', 'N/A'), log_data.get('sender_id', 'N/A'), log_data.get('source_group_name', 'N/A') ]
-        worksheet.append_row(new_row, value_input_option='USER_ENTERED')
+        index = get_ref_index()
+        if index:
+            row = index.find(ref_id)
+            if row is not None or not index.claim(ref_id):
+                metrics.inc('slip_duplicates_total', check='index')
+                return False, get_string('MSG_LOG_DUPLICATE', row=row or '-')
+        else:
+            cell = sheets.read(sheets.worksheet("Transactions").find, ref_id, in_column=6)
+            if cell:
+                metrics.inc('slip_duplicates_total', check='sheet')
+                return False, get_string('MSG_LOG_DUPLICATE', row=cell.row)
+        # สร้างตารางสรุปก่อนเขียน: ถ้า rebuild หลังเขียน แถวใหม่จะอยู่ในชีตแล้วและถูก add ซ้ำอีกครั้ง
+        rollups = get_rollup_store()
+        new_row = build_transaction_row(log_data)
+        try:
+            if WRITE_BEHIND and index:
+                transaction_writer.append({'ref_id': ref_id, 'row': new_row})
+            else:
+                response = sheets.write(sheets.worksheet("Transactions").append_row, new_row, value_input_option='USER_ENTERED',
+                                        verify=lambda: bool(logged_rows([ref_id])))
+                if index: index.set_row(ref_id, _row_from_append_response(response))
+        except Exception:
+            if index: index.release(ref_id)
+            raise
+        update_rollups(log_data, rollups)
         return True, get_string('MSG_LOG_SUCCESS')
     except Exception as e: return False, get_string('MSG_LOG_ERROR')
 
-def generate_summary(period, source_id):
+def get_rollup_store():
+    global _rollup_store
+    if _rollup_store is not None: return _rollup_store
     spreadsheet = get_spreadsheet()
-    if not spreadsheet: return "ไม่สามารถเชื่อมต่อกับฐานข้อมูลได้"
+    if not spreadsheet: return None
     try:
-        transactions_sheet = spreadsheet.worksheet("Transactions")
-        all_records = transactions_sheet.get_all_records()
-        my_records = [rec for rec in all_records if rec.get('SourceId') == source_id]
-        if not my_records:
-            return f"ไม่พบข้อมูลรายจ่ายสำหรับ{'คุณ' if source_id.startswith('U') else 'กลุ่มนี้'} ใน{'เดือนนี้' if period == 'month' else 'ปีนี้'}"
-        aliases = get_aliases()
-        known_nicknames = set(aliases.values())
-        now = datetime.now(timezone(timedelta(hours=7)))
-        filtered_records = []
-        accepted_date_formats = ['%Y-%m-%d', '%m-%d-%Y', '%d-%m-%Y']
-        for record in my_records:
-            record_date = None
-            date_str = record.get('TransactionDate')
-            if not date_str: continue
-            for fmt in accepted_date_formats:
-                try:
-                    record_date = datetime.strptime(date_str, fmt)
-                    break
-                except (ValueError, TypeError): continue
-            if not record_date: continue
-            if period == 'month' and record_date.year == now.year and record_date.month == now.month:
-                filtered_records.append(record)
-            elif period == 'year' and record_date.year == now.year:
-                filtered_records.append(record)
-        if not filtered_records:
-            return f"ไม่พบข้อมูลรายจ่ายสำหรับ{'คุณ' if source_id.startswith('U') else 'กลุ่มนี้'} ใน{'เดือนนี้' if period == 'month' else 'ปีนี้'}"
+        store = RollupStore(ROLLUP_PATH)
+        if not store.is_built():
+            store.rebuild(sheets.read(sheets.worksheet("Transactions").get_all_records, background=True))
+        _rollup_store = store
+        return _rollup_store
+    except Exception as e:
+        print(f"Error building rollups: {e}")
+        return None
+
+def update_rollups(log_data, store):
+    """เพิ่มรายการที่เพิ่งเขียนลง store ที่ได้จาก get_rollup_store() ก่อนเขียน (None = ไม่มีตารางสรุป)"""
+    try:
+        if store: store.add(log_data.get('source_id'), log_data.get('date'), log_data.get('to'), log_data.get('amount'))
+    except Exception as e: print(f"Error updating rollups: {e}")
+
+def rebuild_rollups():
+    spreadsheet = get_spreadsheet()
+    store = get_rollup_store()
+    if not spreadsheet or not store: return False, "DB connection error"
+    try:
+        if WRITE_BEHIND: transaction_writer.flush()
+        count = store.rebuild(sheets.read(sheets.worksheet("Transactions").get_all_records, background=True))
+        return True, f"สร้างข้อมูลสรุปใหม่จาก {count} รายการสำเร็จ!"
+    except Exception as e: return False, f"เกิดข้อผิดพลาด: {e}"
+
+SUMMARY_PERIOD_LABELS = {'month': 'เดือนนี้', 'year': 'ปีนี้', 'week': 'ช่วง 7 วันที่ผ่านมา'}
+
+def get_summary_range(period, today):
+    if period == 'month':
+        start = today.replace(day=1)
+        return start, (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    if period == 'year':
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    if period == 'week':
+        return today - timedelta(days=6), today
+    raise ValueError(f"Unknown summary period: {period}")
+
+def generate_summary(period, source_id):
+    store = get_rollup_store()
+    if not store: return "ไม่สามารถเชื่อมต่อกับฐานข้อมูลได้"
+    period_label = SUMMARY_PERIOD_LABELS[period]
+    try:
+        today = datetime.now(timezone(timedelta(hours=7))).date()
+        start, end = get_summary_range(period, today)
+        totals = store.totals(source_id, start, end)
+        if not totals:
+            return f"ไม่พบข้อมูลรายจ่ายสำหรับ{'คุณ' if source_id.startswith('U') else 'กลุ่มนี้'} ใน{period_label}"
+        known_nicknames = set(get_aliases().values())
         summary_data = defaultdict(float)
-        total_amount = 0.0
-        for record in filtered_records:
-            try:
-                amount_str = str(record.get('Amount', '0')).replace(',', '')
-                amount = float(amount_str)
-                recipient = record['ToRecipient']
-                total_amount += amount
-                if recipient in known_nicknames: summary_data[recipient] += amount
-                else: summary_data['อื่นๆ'] += amount
-            except (ValueError, TypeError): continue
-        header = f"สรุปรายจ่าย{'เดือนนี้' if period == 'month' else 'ปีนี้'} ({'ส่วนตัว' if source_id.startswith('U') else 'ของกลุ่ม'})"
+        for recipient, amount in totals.items():
+            if recipient in known_nicknames: summary_data[recipient] += amount
+            else: summary_data['อื่นๆ'] += amount
+        total_amount = sum(totals.values())
+        header = f"สรุปรายจ่าย{period_label} ({'ส่วนตัว' if source_id.startswith('U') else 'ของกลุ่ม'})"
         reply_lines = [header, f"รายจ่ายทั้งหมด   {total_amount:,.2f} บาท", "รายละเอียด"]
         sorted_summary = sorted(summary_data.items(), key=lambda item: item[1], reverse=True)
         for recipient, amount in sorted_summary:
@@ -192,58 +416,167 @@ def generate_summary(period, source_id):
     except Exception as e:
         return f"เกิดข้อผิดพลาดในการสร้างสรุป: {e}"
 
+def read_transactions_page(first_row, last_row):
+    return sheets.read(sheets.worksheet("Transactions").get, f"A{first_row}:{transaction_export.LAST_COLUMN}{last_row}")
+
+def create_export_link(source_id, period, fmt):
+    if not PUBLIC_BASE_URL: return False, "ยังไม่ได้ตั้งค่า PUBLIC_BASE_URL จึงสร้างลิงก์ดาวน์โหลดไม่ได้"
+    if not EXPORT_SECRET: return False, "ยังไม่ได้ตั้งค่า EXPORT_SECRET จึงสร้างลิงก์ดาวน์โหลดไม่ได้"
+    if fmt not in transaction_export.FORMATS: return False, f"ไม่รู้จักรูปแบบไฟล์ '{fmt}' (ใช้ได้: {', '.join(transaction_export.FORMATS)})"
+    if fmt == 'xlsx' and transaction_export.Workbook is None: return False, "ส่งออก xlsx ไม่ได้เพราะไม่ได้ติดตั้ง openpyxl (ใช้ csv แทนได้)"
+    try: start, end = transaction_export.parse_period(period)
+    except ValueError: return False, "รูปแบบช่วงเวลาไม่ถูกต้อง เช่น export 2026-09, export 2026 หรือ export 2026-09-01:2026-09-15"
+    url = transaction_export.export_url(PUBLIC_BASE_URL, EXPORT_SECRET, source_id, period, fmt, time.time() + EXPORT_LINK_TTL)
+    return True, f"ดาวน์โหลดรายการ {start} ถึง {end} ({fmt}) ได้ที่ลิงก์นี้ภายใน {EXPORT_LINK_TTL // 60} นาที:\n{url}"
+
+def run_ocr(image_bytes, filename="receipt.jpg", mimetype="image/jpeg"):
+    try:
+        return ocr_client.recognize(image_bytes, filename, mimetype)
+    except OCRError as e:
+        metrics.inc('ocr_failures_total', reason='transient' if isinstance(e, RetryableOCRError) else 'unreadable')
+        print(f"OCR failed: {e}")
+        return None
+
 # --- Web Server Routes ---
 @app.route("/health", methods=['GET'])
 def health_check():
     return "OK", 200
 
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({'job_queue': job_queue.stats(), 'events': event_dispatcher.stats(), 'write_behind': transaction_writer.stats(), 'profile_cache': profile_cache.stats(), 'ocr_cache': ocr_cache.stats(), 'ocr_circuits': ocr_client.stats(), 'sheets': sheets.stats()})
+
+def drain_background_work():
+    """เรียกตอน worker กำลังปิด (gunicorn worker_exit): รองานที่ค้างให้เสร็จ แล้ว log event ที่ไม่ได้ทำ"""
+    dropped = job_queue.drain()
+    for lane, sub_body in event_dispatcher.pending():
+        print(f"Dropped LINE event at shutdown (lane {lane}): {sub_body}")
+    if dropped: print(f"Dropped {dropped} queued jobs at shutdown")
+    if WRITE_BEHIND: transaction_writer.flush()
+
+@app.route("/metrics", methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/export", methods=['GET'])
+def export_transactions():
+    if not EXPORT_SECRET: abort(404)
+    source_id, period = request.args.get('source', ''), request.args.get('period', '')
+    fmt = request.args.get('format', 'csv')
+    if not transaction_export.verify_export(EXPORT_SECRET, source_id, period, fmt, request.args.get('expires'), request.args.get('sig'), time.time()):
+        abort(403)
+    if fmt not in transaction_export.FORMATS or (fmt == 'xlsx' and transaction_export.Workbook is None): abort(400)
+    try: start, end = transaction_export.parse_period(period)
+    except ValueError: abort(400)
+    if not get_spreadsheet(): abort(503)
+    # รายการที่ยังรอเขียนลงชีต (write-behind) ต้องอยู่ในไฟล์ด้วย
+    if WRITE_BEHIND: transaction_writer.flush()
+    # แถวสุดท้ายที่ใช้ = จำนวนค่าในคอลัมน์ Timestamp (อ่านหลัง flush เพื่อให้รวมแถวที่เพิ่งเขียน)
+    last_row = len(sheets.read(sheets.worksheet("Transactions").col_values, 1, coalesce=False))
+    header, rows = transaction_export.iter_rows(read_transactions_page, source_id, start, end, last_row, page_size=EXPORT_PAGE_SIZE)
+    chunks = transaction_export.xlsx_chunks(header, rows) if fmt == 'xlsx' else transaction_export.csv_chunks(header, rows)
+    return Response(stream_with_context(chunks), mimetype=transaction_export.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="transactions_{period.replace(":", "_")}.{fmt}"'})
+
 @app.route("/", methods=['GET', 'HEAD'])
 def home():
     return "OK", 200
 
 @app.route("/callback", methods=['POST'])
+@metrics.traced('callback')
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
+    if WRITE_BEHIND: transaction_writer.start()
     try:
-        handler.handle(body, signature)
+        if JOB_QUEUE_MODE == 'inline':
+            handler.handle(body, signature)
+        else:
+            with metrics.stage('signature'):
+                valid = handler.parser.signature_validator.validate(body, signature)
+            if not valid:
+                raise InvalidSignatureError('Invalid signature. signature=' + signature)
+            with metrics.stage('enqueue'):
+                event_dispatcher.dispatch(body)
     except InvalidSignatureError:
         abort(400)
+    except QueueFullError:
+        abort(503)
     return 'OK'
 
 # --- LINE Event Handlers ---
 @handler.add(MessageEvent, message=ImageMessage)
+@metrics.traced('image')
 def handle_image_message(event):
+    metrics.tag(message_id=event.message.id)
     source = event.source
     sender_id = source.user_id
     sender_name, group_name = "N/A", "N/A (Direct Message)"
     source_id_for_approval_and_log = sender_id
-    if isinstance(source, SourceGroup):
-        group_id = source.group_id
-        source_id_for_approval_and_log = group_id
-        try:
-            group_summary = line_bot_api.get_group_summary(group_id)
-            group_name = group_summary.group_name
-            member_profile = line_bot_api.get_group_member_profile(group_id, sender_id)
-            sender_name = member_profile.display_name
-        except LineBotApiError: sender_name = "N/A (API Error)"
-    elif isinstance(source, SourceUser):
-        try:
-            profile = line_bot_api.get_profile(sender_id)
-            sender_name = profile.display_name
-        except LineBotApiError: sender_name = "N/A (API Error)"
+    with metrics.stage('profile'):
+        if isinstance(source, SourceGroup):
+            group_id = source.group_id
+            source_id_for_approval_and_log = group_id
+            try:
+                group_name = get_group_name(group_id)
+                sender_name = get_member_name(group_id, sender_id)
+            except LineBotApiError: sender_name = "N/A (API Error)"
+        elif isinstance(source, SourceUser):
+            try:
+                sender_name = get_user_name(sender_id)
+            except LineBotApiError: sender_name = "N/A (API Error)"
 
-    if not is_approved(source_id_for_approval_and_log):
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=get_string('MSG_APPROVAL_PENDING')))
+    with metrics.stage('approval'):
+        approved = is_approved(source_id_for_approval_and_log)
+    if approved is None:
+        send_reply(event, "ระบบฐานข้อมูลไม่ว่างชั่วคราว กรุณาส่งสลิปอีกครั้งในภายหลัง")
         return
-    message_content = line_bot_api.get_message_content(event.message.id)
-    url_api = "https://api.ocr.space/parse/image"
-    response = requests.post(url_api, files={"image": ("receipt.jpg", message_content.content, "image/jpeg")}, data={"apikey": OCR_SPACE_API_KEY, "language": "tha", "OCREngine": "2"})
-    result = response.json()
-    if result.get("IsErroredOnProcessing") == False and result.get("ParsedResults"):
-        detected_text = result["ParsedResults"][0]["ParsedText"]
-        parsing_rules = get_parsing_rules()
-        parsed_data = parse_slip(detected_text, parsing_rules)
+    if not approved:
+        send_reply(event, get_string('MSG_APPROVAL_PENDING'))
+        return
+    with metrics.stage('download'):
+        message_content = line_bot_api.get_message_content(event.message.id)
+        image_file, image_sha256 = download_content(message_content)
+    parsing_rules = get_parsing_rules()
+    qr_data, qr_read = None, False
+    def same_slip(entry):
+        # dHash ใกล้กันอาจเป็นสลิปคนละใบจากแม่แบบเดียวกัน: ใช้ผลเดิมเมื่อเลขอ้างอิงจาก QR ตรงกันเท่านั้น
+        nonlocal qr_data, qr_read
+        with metrics.stage('qr'):
+            qr_data, qr_read = (read_slip_qr(image_file) if SLIP_QR_ENABLED else None), True
+        return bool(qr_data) and qr_data['ref_id'] == (entry['parsed'] or {}).get('ref_id')
+    # สลิปที่ถูกส่งต่อ/โพสต์ซ้ำ: ใช้ผล OCR เดิมจาก cache ไม่ต้องส่งไป OCR ใหม่
+    with metrics.stage('ocr_cache'):
+        cache_keys = ocr_cache.keys(image_file, sha256=image_sha256)
+        cached = ocr_cache.lookup(cache_keys, confirm=same_slip)
+    metrics.inc('slip_cache_total', cache='ocr', result='hit' if cached else 'miss')
+    if cached:
+        detected_text = cached['text']
+        parsed_data = cached['parsed'] if cached['rules_version'] == parsing_rules.version else None
+    else:
+        # QR บนสลิปให้เลขอ้างอิงได้ทันที: ถ้าบันทึกไปแล้วก็ตอบว่าซ้ำโดยไม่ต้อง OCR
+        with metrics.stage('qr'):
+            if not qr_read: qr_data = read_slip_qr(image_file) if SLIP_QR_ENABLED else None
+            logged_row = find_logged_ref(qr_data['ref_id']) if qr_data else None
+        if logged_row is not None:
+            metrics.inc('slip_duplicates_total', check='qr')
+            send_reply(event, f"{get_string('LABEL_REF')}: {qr_data['ref_id']}\n{get_string('LABEL_STATUS')}: {get_string('MSG_LOG_DUPLICATE', row=logged_row or '-')}")
+            return
+        with metrics.stage('preprocess'):
+            upload = preprocess(image_file, OCR_PREPROCESS_STAGES, target_width=OCR_TARGET_WIDTH, output_format=OCR_UPLOAD_FORMAT)
+        with metrics.stage('ocr'):
+            detected_text, parsed_data = run_ocr(*upload), None
+    if detected_text is not None:
+        if parsed_data is None:
+            with metrics.stage('parse'):
+                parsed_data = parse_slip(detected_text, parsing_rules)
+            if qr_data:
+                # ค่าจาก QR แม่นกว่า regex บนข้อความ OCR
+                parsed_data['ref_id'] = qr_data['ref_id']
+                if qr_data['amount'] is not None and parsed_data.get('amount') in (None, 'N/A'): parsed_data['amount'] = qr_data['amount']
+            for field, value in parsed_data.items():
+                if value in (None, 'N/A'): metrics.inc('slip_parse_misses_total', field=field)
+            ocr_cache.store(cache_keys, detected_text, parsed_data, parsing_rules.version)
         
         aliases = get_aliases()
         display_account = aliases.get(parsed_data.get('account'), parsed_data.get('account'))
@@ -255,26 +588,41 @@ def handle_image_message(event):
             f"{get_string('LABEL_REF')}: {parsed_data.get('ref_id', 'N/A')}"
         )
         log_data = {'date': parsed_data.get('date', 'N/A'), 'from': display_account, 'to': display_recipient, 'amount': parsed_data.get('amount', 0.0), 'ref_id': parsed_data.get('ref_id', 'N/A'), 'source_id': source_id_for_approval_and_log, 'sender_name': sender_name, 'sender_id': sender_id, 'source_group_name': group_name}
-        log_success, log_message = log_transaction_to_sheet(log_data)
+        with metrics.stage('log'):
+            log_success, log_message = log_transaction_to_sheet(log_data)
         final_reply_text = f"{summary_text}\n-------------------\n{get_string('LABEL_STATUS')}: {log_message}"
     else:
         final_reply_text = get_string('MSG_OCR_ERROR')
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=final_reply_text))
+    with metrics.stage('reply'):
+        send_reply(event, final_reply_text)
 
 @handler.add(MessageEvent, message=TextMessage)
+@metrics.traced('text')
 def handle_text_message(event):
     text = event.message.text.lower().strip()
     source = event.source
     user_id = source.user_id
     source_id_for_approval_and_summary = source.group_id if isinstance(source, SourceGroup) else user_id
-    if is_approved(source_id_for_approval_and_summary):
+    with metrics.stage('approval'):
+        approved = is_approved(source_id_for_approval_and_summary)
+    if approved:
         if text == "สรุปเดือนนี้":
-            reply_text = generate_summary('month', source_id_for_approval_and_summary)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            with metrics.stage('summary'):
+                reply_text = generate_summary('month', source_id_for_approval_and_summary)
+            with metrics.stage('reply'):
+                send_reply(event, reply_text)
             return
         elif text == "สรุปปีนี้":
-            reply_text = generate_summary('year', source_id_for_approval_and_summary)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            with metrics.stage('summary'):
+                reply_text = generate_summary('year', source_id_for_approval_and_summary)
+            with metrics.stage('reply'):
+                send_reply(event, reply_text)
+            return
+        elif text == "สรุป 7 วัน":
+            with metrics.stage('summary'):
+                reply_text = generate_summary('week', source_id_for_approval_and_summary)
+            with metrics.stage('reply'):
+                send_reply(event, reply_text)
             return
             
     if user_id == ADMIN_USER_ID:
@@ -286,45 +634,75 @@ def handle_text_message(event):
                 success, message = add_alias_to_sheet(original_name, nickname)
                 reply_text = message
             except ValueError: reply_text = get_string('MSG_ALIAS_CMD_ERROR')
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            send_reply(event, reply_text)
             return
         elif text == "reload aliases":
-            global _aliases_cache
-            _aliases_cache = None; aliases = get_aliases()
-            reply_text = get_string('MSG_ALIAS_RELOAD_SUCCESS', count=len(aliases))
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            try:
+                aliases = reference_store.reload().aliases
+                reply_text = get_string('MSG_ALIAS_RELOAD_SUCCESS', count=len(aliases))
+            except Exception as e: reply_text = f"เกิดข้อผิดพลาด: {e}"
+            send_reply(event, reply_text)
             return
         elif text == "reload rules":
-            global _parsing_rules_cache
-            _parsing_rules_cache = None; rules = get_parsing_rules()
-            reply_text = f"โหลดกฎการอ่านสลิปใหม่ {len(rules)} ข้อสำเร็จ!"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            try:
+                rules = reference_store.reload().rules_engine
+                reply_text = f"โหลดกฎการอ่านสลิปใหม่ {len(rules)} ข้อสำเร็จ!"
+                if rules.errors:
+                    reply_text += f"\nกฎที่ใช้ไม่ได้ {len(rules.errors)} ข้อ:\n" + "\n".join(f"- แถว {row}: {error}" for row, term, error in rules.errors)
+            except Exception as e: reply_text = f"เกิดข้อผิดพลาด: {e}"
+            send_reply(event, reply_text)
             return
         elif text == "reload config":
-            global _config_cache
-            _config_cache = None; config = get_config()
-            reply_text = f"โหลดข้อความใหม่ {len(config)} รายการสำเร็จ!"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            try:
+                config = reference_store.reload().config
+                reply_text = f"โหลดข้อความใหม่ {len(config)} รายการสำเร็จ!"
+            except Exception as e: reply_text = f"เกิดข้อผิดพลาด: {e}"
+            send_reply(event, reply_text)
+            return
+        elif text == "reload approvals":
+            approval_cache.invalidate()
+            try:
+                approval_cache.refresh()
+                reply_text = f"โหลดสถานะการอนุมัติใหม่ {len(approval_cache)} รายการสำเร็จ!"
+            except Exception as e: reply_text = f"เกิดข้อผิดพลาด: {e}"
+            send_reply(event, reply_text)
+            return
+        elif text == "rebuild summaries":
+            success, reply_text = rebuild_rollups()
+            send_reply(event, reply_text)
+            return
+        elif text == "reconcile refs":
+            success, reply_text = reconcile_ref_index()
+            send_reply(event, reply_text)
+            return
+        elif text.startswith("export "):
+            # export <ช่วงเวลา> [csv|xlsx] [source id] (ไม่ระบุ source = กลุ่ม/แชทที่สั่ง)
+            args = original_text.split()[1:]
+            period = args.pop(0)
+            fmt = args.pop(0).lower() if args and not re.match(r'^[CUR][0-9a-f]{32}$', args[0]) else 'csv'
+            export_source_id = args[0] if args else source_id_for_approval_and_summary
+            success, reply_text = create_export_link(export_source_id, period, fmt)
+            send_reply(event, reply_text)
             return
             
     if text in ["ping", "wake up", "ตื่น", "หวัดดี", "สวัสดี"]:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=get_string('MSG_WAKE_UP')))
+        send_reply(event, get_string('MSG_WAKE_UP'))
 
 @handler.add(JoinEvent)
 def handle_join(event):
     if isinstance(event.source, SourceGroup):
-        try: group_name = line_bot_api.get_group_summary(event.source.group_id).group_name
+        try: group_name = get_group_name(event.source.group_id)
         except: group_name = "Unknown Group"
         register_source(event.source.group_id, group_name, 'group')
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"สวัสดีครับ! บอทได้รับการเพิ่มเข้ากลุ่ม '{group_name}' แล้ว และกำลังรอการอนุมัติเพื่อเริ่มใช้งานครับ"))
+        send_reply(event, f"สวัสดีครับ! บอทได้รับการเพิ่มเข้ากลุ่ม '{group_name}' แล้ว และกำลังรอการอนุมัติเพื่อเริ่มใช้งานครับ")
 
 @handler.add(FollowEvent)
 def handle_follow(event):
     if isinstance(event.source, SourceUser):
-        try: display_name = line_bot_api.get_profile(event.source.user_id).display_name
+        try: display_name = get_user_name(event.source.user_id)
         except: display_name = "Unknown User"
         register_source(event.source.user_id, display_name, 'user')
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="ขอบคุณที่เพิ่มเป็นเพื่อนครับ! กำลังรอการอนุมัติเพื่อเริ่มใช้งาน"))
+        send_reply(event, "ขอบคุณที่เพิ่มเป็นเพื่อนครับ! กำลังรอการอนุมัติเพื่อเริ่มใช้งาน")
 
 # --- บรรทัดที่เพิ่มกลับเข้ามา ---
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+"""ตัวเก็บ metric แบบเบา (ไม่ต้องพึ่ง prometheus_client) ส่งออกเป็น Prometheus text format
+
+- histogram เวลาของแต่ละขั้นตอน และ counter ของเหตุการณ์ (cache hit, OCR พลาด, สลิปซ้ำ, อ่านฟิลด์ไม่ได้)
+- gauge อ่านค่าจากฟังก์ชันตอน dump/render (เช่น backlog ของ write-behind) รวมเฉพาะ worker ที่ยังทำงานอยู่
+- แต่ละ gunicorn worker เขียนค่าของตัวเองลง `<directory>/<pid>.json` ทุก `dump_interval` วินาที
+  /metrics รวมค่าจากทุกไฟล์ จึงได้ผลรวมเท่ากันไม่ว่า worker ไหนตอบ
+  (ไฟล์ของ worker ที่ตายแล้วยังนับรวม เพื่อไม่ให้ counter ลดลง ล้างทิ้งตอนเริ่ม server ใหม่)
+- trace ต่อ request: ถ้าใช้เวลารวมเกิน `slow_threshold` วินาที จะ log เวลาแยกตามขั้นตอน
+"""
+import atexit
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def clear_directory(directory):
+    """ลบไฟล์ค่า metric ของ worker รอบก่อน (เรียกตอนเริ่ม server ใหม่ ก่อน fork worker)"""
+    if not directory or not os.path.isdir(directory): return 0
+    removed = 0
+    for filename in os.listdir(directory):
+        if filename.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, filename))
+            removed += 1
+    return removed
+
+
+def _format_labels(labels):
+    if not labels: return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self, directory=None, dump_interval=5.0, slow_threshold=0, buckets=DEFAULT_BUCKETS):
+        self.directory = directory or None
+        self.dump_interval = dump_interval
+        self.slow_threshold = slow_threshold
+        self.buckets = tuple(buckets)
+        self._counters = {}    # (name, labels) -> ค่า
+        self._histograms = {}  # (name, labels) -> [จำนวนต่อ bucket (ช่องสุดท้ายคือ +Inf), ผลรวม]
+        self._gauges = {}      # (name, labels) -> (ฟังก์ชันคืนค่าปัจจุบัน, วิธีรวมข้าม worker: 'sum' หรือ 'max')
+        self._help = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+        self._start_dumper()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None: histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+        self._start_dumper()
+
+    def gauge(self, name, fn, aggregate='sum', **labels):
+        """ลงทะเบียน gauge: `fn()` ถูกเรียกตอน dump/render ค่าของหลาย worker รวมด้วย sum หรือ max"""
+        if aggregate not in ('sum', 'max'): raise ValueError(f"Unknown gauge aggregate: {aggregate}")
+        with self._lock: self._gauges[(name, tuple(sorted(labels.items())))] = (fn, aggregate)
+
+    # --- จับเวลา ---
+    @contextmanager
+    def trace(self, handler, **context):
+        """จับเวลารวมของ request หนึ่ง ขั้นตอนที่จับด้วย stage() ภายใน thread เดียวกันจะถูกรวมไว้ใน trace นี้"""
+        trace = {'handler': handler, 'stages': [], 'context': dict(context)}
+        previous = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        started = time.perf_counter()
+        try: yield trace
+        finally:
+            self._local.trace = previous
+            elapsed = time.perf_counter() - started
+            self.observe('slip_request_seconds', elapsed, handler=handler)
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in trace['stages']) or "no stages"
+                details = "".join(f" {key}={value}" for key, value in trace['context'].items())
+                logger.warning("Slow %s request %.0fms%s: %s", handler, elapsed * 1000, details, breakdown)
+
+    def traced(self, handler):
+        """decorator: ครอบทั้งฟังก์ชันด้วย trace(handler)"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.trace(handler): return fn(*args, **kwargs)
+            # WebhookHandler นับ argument ของฟังก์ชันเพื่อเลือกว่าจะส่ง destination มาด้วยหรือไม่
+            wrapper.__signature__ = inspect.signature(fn)
+            return wrapper
+        return decorator
+
+    def tag(self, **values):
+        """แนบข้อมูล (เช่น message id) ไปกับ trace ปัจจุบัน เพื่อแสดงใน slow-request log"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None: trace['context'].update(values)
+
+    @contextmanager
+    def stage(self, name):
+        trace = getattr(self._local, 'trace', None)
+        started = time.perf_counter()
+        try: yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('slip_stage_seconds', elapsed, handler=trace['handler'] if trace else 'none', stage=name)
+            if trace is not None: trace['stages'].append((name, elapsed))
+
+    # --- แชร์ค่าระหว่าง worker ---
+    def _start_dumper(self):
+        # เริ่ม thread ครั้งแรกที่มีข้อมูลใน process นี้ (gunicorn fork worker หลัง import)
+        if self.directory is None or self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            if self._pid is not None: self._counters, self._histograms = {}, {}  # ค่าที่ติดมาจาก process แม่
+            self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._dump_loop, name="metrics-dump", daemon=True).start()
+        atexit.register(self.dump)
+
+    def _dump_loop(self):
+        while True:
+            time.sleep(self.dump_interval)
+            try: self.dump()
+            except Exception: logger.exception("Writing metrics failed")
+
+    def _snapshot(self):
+        with self._lock:
+            snapshot = {'buckets': list(self.buckets),
+                        'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                        'histograms': [[name, dict(labels), list(counts), total] for (name, labels), (counts, total) in self._histograms.items()]}
+            gauges = list(self._gauges.items())
+        snapshot['gauges'] = []
+        for (name, labels), (fn, aggregate) in gauges:
+            try: snapshot['gauges'].append([name, dict(labels), float(fn()), aggregate])
+            except Exception: logger.exception("Reading gauge %s failed", name)
+        return snapshot
+
+    @staticmethod
+    def _alive(pid):
+        try: os.kill(pid, 0)
+        except ProcessLookupError: return False
+        except PermissionError: return True
+        return True
+
+    def dump(self):
+        if self.directory is None: return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f: json.dump(self._snapshot(), f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """รวมค่าของ process นี้ (ค่าล่าสุด) กับไฟล์ของ worker อื่น คืน (counters, histograms, gauges)"""
+        snapshots = [(True, self._snapshot())]
+        if self.directory is not None and os.path.isdir(self.directory):
+            own = f"{os.getpid()}.json"
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json') or filename == own: continue
+                try:
+                    with open(os.path.join(self.directory, filename), encoding='utf-8') as f: snapshot = json.load(f)
+                except (OSError, ValueError): continue  # worker กำลังเขียนหรือไฟล์เสีย ข้ามไปรอบนี้
+                pid = filename[:-len('.json')]
+                snapshots.append((pid.isdigit() and self._alive(int(pid)), snapshot))
+        counters, histograms, gauges = {}, {}, {}
+        for alive, snapshot in snapshots:
+            if alive:  # gauge ของ worker ที่ตายแล้วเป็นค่าค้าง ไม่นับ
+                for name, labels, value, aggregate in snapshot.get('gauges', []):
+                    key = (name, tuple(sorted(labels.items())))
+                    if key not in gauges: gauges[key] = value
+                    else: gauges[key] = max(gauges[key], value) if aggregate == 'max' else gauges[key] + value
+            for name, labels, value in snapshot.get('counters', []):
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            if snapshot.get('buckets') != list(self.buckets): continue
+            for name, labels, counts, total in snapshot.get('histograms', []):
+                key = (name, tuple(sorted(labels.items())))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        return counters, histograms, gauges
+
+    def render(self):
+        counters, histograms, gauges = self.collect()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name: lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name: lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name: continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
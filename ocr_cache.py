@@ -0,0 +1,123 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow เป็น optional: ไม่มีก็ใช้ได้แค่ SHA-256
+    Image = None
+
+
+def dhash(content, size=8):
+    """perceptual hash (difference hash) ขนาด size*size บิต ใช้จับรูปเดิมที่ถูกบีบอัดซ้ำ"""
+    if Image is None: return None
+    try:
+        with Image.open(content if hasattr(content, 'read') else io.BytesIO(content)) as img:
+            pixels = img.convert('L').resize((size + 1, size)).tobytes()  # โหมด L: 1 ไบต์ต่อพิกเซล
+    except Exception: return None
+    finally:
+        if hasattr(content, 'seek'): content.seek(0)
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return bits
+
+
+class OCRCache:
+    """cache ผล OCR (ข้อความ + ผล parse) ตาม SHA-256 ของไฟล์รูป เก็บในไฟล์ SQLite
+
+    จำกัดขนาดรวมไว้ที่ `max_bytes` โดยลบรายการที่ไม่ได้ใช้นานที่สุดออกก่อน (LRU)
+    ถ้าตั้ง `phash_distance` (และมี Pillow) จะเทียบ dHash ด้วย เพื่อให้รูปเดิม
+    ที่ถูกส่งต่อ/บีบอัดใหม่ (ไบต์ไม่ตรงกัน) ก็ยังเจอใน cache
+    แต่สลิปคนละใบจากแม่แบบเดียวกันก็มี dHash ใกล้กันได้ ผลจาก dHash จึงต้องผ่าน `confirm` ของผู้เรียกก่อน
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, phash_distance=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance if Image is not None else 0
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.similar_hits = 0
+        self.similar_rejected = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr (sha256 TEXT PRIMARY KEY, phash TEXT, text TEXT, parsed TEXT, rules_version TEXT, size INTEGER, last_used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr (last_used)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def keys(self, content, sha256=None):
+        """content เป็น bytes หรือ file object (ถ้าส่ง sha256 ที่คำนวณไว้แล้วมาด้วยจะไม่อ่านซ้ำ)"""
+        phash = dhash(content) if self.phash_distance else None
+        if sha256 is None: sha256 = hashlib.sha256(content).hexdigest()
+        return sha256, (f"{phash:016x}" if phash is not None else None)
+
+    def _find_similar(self, phash):
+        target = int(phash, 16)
+        best = None
+        for sha256, other in self._conn().execute("SELECT sha256, phash FROM ocr WHERE phash IS NOT NULL"):
+            distance = bin(target ^ int(other, 16)).count('1')
+            if distance <= self.phash_distance and (best is None or distance < best[0]): best = (distance, sha256)
+        return best[1] if best else None
+
+    def lookup(self, keys, confirm=None):
+        """คืน {'text', 'parsed', 'rules_version'} หรือ None
+
+        รายการที่เจอจาก dHash ใช้ได้เมื่อ confirm(entry) คืน True เท่านั้น (ไม่ส่ง confirm = ไม่ใช้)
+        """
+        sha256, phash = keys
+        conn = self._conn()
+        row = conn.execute("SELECT sha256, text, parsed, rules_version FROM ocr WHERE sha256 = ?", (sha256,)).fetchone()
+        entry = self._entry(row)
+        if entry is None and phash and confirm is not None:
+            similar = self._find_similar(phash)
+            if similar:
+                entry = self._entry(conn.execute("SELECT sha256, text, parsed, rules_version FROM ocr WHERE sha256 = ?", (similar,)).fetchone())
+                if entry is not None and confirm(entry):
+                    self.similar_hits += 1
+                    row = (similar,)
+                else:
+                    if entry is not None: self.similar_rejected += 1
+                    entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with conn: conn.execute("UPDATE ocr SET last_used = ? WHERE sha256 = ?", (time.time(), row[0]))
+        return entry
+
+    @staticmethod
+    def _entry(row):
+        if row is None: return None
+        return {'text': row[1], 'parsed': json.loads(row[2]) if row[2] else None, 'rules_version': row[3]}
+
+    def store(self, keys, text, parsed=None, rules_version=None):
+        sha256, phash = keys
+        parsed_json = json.dumps(parsed, ensure_ascii=False) if parsed is not None else None
+        size = len(text.encode('utf-8')) + len((parsed_json or '').encode('utf-8'))
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO ocr (sha256, phash, text, parsed, rules_version, size, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (sha256, phash, text, parsed_json, rules_version, size, time.time()))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr").fetchone()[0]
+            if total > self.max_bytes:
+                # ลบรายการที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกินที่กำหนด
+                for old_sha256, old_size in conn.execute("SELECT sha256, size FROM ocr ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes: break
+                    conn.execute("DELETE FROM ocr WHERE sha256 = ?", (old_sha256,))
+                    total -= old_size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'similar_hits': self.similar_hits, 'similar_rejected': self.similar_rejected}
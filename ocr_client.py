@@ -0,0 +1,212 @@
+"""OCR client กลางที่ทุกการเรียก OCR ต้องผ่าน
+
+- session แบบ pool (keep-alive) ต่อ backend
+- deadline ต่อการเรียกหนึ่งครั้ง (รวมทุก retry)
+- retry แบบ exponential backoff + full jitter เฉพาะ error ชั่วคราว (network, 429, 5xx)
+- circuit breaker ต่อ backend และจำกัดจำนวนงาน OCR ที่ทำพร้อมกัน
+- backend เสียบเปลี่ยนได้: OCR.space, Tesseract (ในเครื่อง), Fake (สำหรับทดสอบ)
+- hedged request: ถ้า backend แรกช้าเกิน hedge_after วินาที ยิง backend ถัดไปคู่กัน
+"""
+import io
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+OCR_SPACE_URL = "https://api.ocr.space/parse/image"
+
+
+class OCRError(Exception):
+    """OCR อ่านรูปไม่ได้ (ไม่ควร retry เช่น รูปเสีย)"""
+
+
+class RetryableOCRError(OCRError):
+    """error ชั่วคราว (network, timeout, 429, 5xx) ลองใหม่ได้"""
+
+
+class CircuitOpenError(RetryableOCRError):
+    pass
+
+
+class OCRSpaceBackend:
+    name = 'ocrspace'
+
+    def __init__(self, api_key, url=OCR_SPACE_URL, pool_size=10, language='tha', engine='2'):
+        self.api_key, self.url, self.language, self.engine = api_key, url, language, engine
+        self.session = requests.Session()
+        self.session.mount(url.split('://')[0] + '://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def recognize(self, image_bytes, filename, mimetype, timeout):
+        try:
+            response = self.session.post(self.url, files={"image": (filename, image_bytes, mimetype)},
+                                         data={"apikey": self.api_key, "language": self.language, "OCREngine": self.engine},
+                                         timeout=(min(5.0, timeout), timeout))
+        except requests.RequestException as e:
+            raise RetryableOCRError(f"OCR.space request failed: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableOCRError(f"OCR.space HTTP {response.status_code}")
+        try: result = response.json()
+        except ValueError: raise OCRError(f"OCR.space returned non-JSON (HTTP {response.status_code})")
+        if result.get("IsErroredOnProcessing") == False and result.get("ParsedResults"):
+            return result["ParsedResults"][0]["ParsedText"]
+        raise OCRError(f"OCR.space error: {result.get('ErrorMessage')}")
+
+
+class TesseractBackend:
+    """OCR ในเครื่องด้วย Tesseract (ต้องมี pytesseract + tesseract-ocr-tha) ใช้เป็น fallback/ออฟไลน์"""
+    name = 'tesseract'
+
+    def __init__(self, language='tha+eng'):
+        if pytesseract is None: raise RuntimeError("pytesseract is not installed")
+        self.language = language
+
+    def recognize(self, image_bytes, filename, mimetype, timeout):
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                return pytesseract.image_to_string(img, lang=self.language, timeout=timeout)
+        except RuntimeError as e:  # pytesseract แจ้ง timeout เป็น RuntimeError
+            raise RetryableOCRError(f"Tesseract: {e}") from e
+        except OSError as e:
+            raise OCRError(f"Tesseract cannot read image: {e}") from e
+
+
+class FakeBackend:
+    """backend สำหรับทดสอบ: คืนข้อความตามที่กำหนด (หรือ raise ถ้าเป็น exception) หลังหน่วงเวลา delay วินาที"""
+
+    def __init__(self, responses=("",), delay=0.0, name='fake'):
+        self.responses, self.delay, self.name = list(responses), delay, name
+        self.calls = 0
+
+    def recognize(self, image_bytes, filename, mimetype, timeout):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if self.delay:
+            if self.delay > timeout:
+                time.sleep(timeout)
+                raise RetryableOCRError("fake backend timed out")
+            time.sleep(self.delay)
+        if isinstance(response, Exception): raise response
+        return response
+
+
+class CircuitBreaker:
+    """เปิดวงจรเมื่อพลาดติดกัน `threshold` ครั้ง แล้วปล่อยให้ลองใหม่ 1 ครั้ง (half-open) หลัง `reset_timeout` วินาที"""
+
+    def __init__(self, threshold=5, reset_timeout=60.0):
+        self.threshold, self.reset_timeout = threshold, reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()  # half-open: ให้ผ่าน 1 ครั้ง ที่เหลือรอรอบถัดไป
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock: self.failures, self.opened_at = 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold: self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return 'closed' if self.opened_at is None else 'open'
+
+
+class OCRClient:
+    def __init__(self, backends, deadline=30.0, retries=2, backoff=0.5, max_backoff=4.0, max_concurrency=4,
+                 hedge_after=None, breaker_threshold=5, breaker_reset=60.0):
+        if not backends: raise ValueError("at least one OCR backend is required")
+        self.backends = list(backends)
+        self.deadline, self.retries, self.backoff, self.max_backoff = deadline, retries, backoff, max_backoff
+        self.hedge_after = hedge_after
+        self.breakers = {backend.name: CircuitBreaker(breaker_threshold, breaker_reset) for backend in self.backends}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="ocr-hedge") if hedge_after else None
+
+    def recognize(self, image_bytes, filename="receipt.jpg", mimetype="image/jpeg"):
+        """คืนข้อความที่อ่านได้ หรือ raise OCRError"""
+        deadline_at = time.monotonic() + self.deadline
+        if not self._slots.acquire(timeout=self.deadline):
+            raise RetryableOCRError("too many OCR requests in flight")
+        try:
+            if self._executor and len(self.backends) > 1:
+                return self._recognize_hedged(image_bytes, filename, mimetype, deadline_at)
+            last_error = None
+            for backend in self.backends:
+                try: return self._call(backend, image_bytes, filename, mimetype, deadline_at)
+                except RetryableOCRError as e:
+                    last_error = e  # backend นี้ใช้ไม่ได้ตอนนี้ ลอง backend ถัดไป
+            raise last_error
+        finally:
+            self._slots.release()
+
+    def _call(self, backend, image_bytes, filename, mimetype, deadline_at):
+        breaker = self.breakers[backend.name]
+        last_error = None
+        for attempt in range(self.retries + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0: break
+            if not breaker.allow(): raise CircuitOpenError(f"circuit open for {backend.name}")
+            try:
+                text = backend.recognize(image_bytes, filename, mimetype, timeout=remaining)
+                breaker.record_success()
+                return text
+            except RetryableOCRError as e:
+                breaker.record_failure()
+                last_error = e
+                logger.warning("OCR %s attempt %d failed: %s", backend.name, attempt + 1, e)
+            except OCRError:
+                breaker.record_success()  # backend ตอบได้ปกติ แค่รูปนี้อ่านไม่ได้
+                raise
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            time.sleep(max(0.0, min(delay, deadline_at - time.monotonic())))
+        raise last_error or RetryableOCRError(f"OCR {backend.name} deadline exceeded")
+
+    def _recognize_hedged(self, image_bytes, filename, mimetype, deadline_at):
+        backends = iter(self.backends)
+        pending = {self._executor.submit(self._call, next(backends), image_bytes, filename, mimetype, deadline_at)}
+        last_error = None
+        timeout = self.hedge_after
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, min(timeout, deadline_at - time.monotonic())), return_when=FIRST_COMPLETED)
+            for future in done:
+                try: return future.result()
+                except OCRError as e: last_error = e
+            backend = next(backends, None)
+            if backend is not None:
+                # ช้าเกินไปหรือพลาด: ยิง backend ถัดไปคู่กัน (ใครเสร็จก่อนใช้ผลนั้น)
+                pending.add(self._executor.submit(self._call, backend, image_bytes, filename, mimetype, deadline_at))
+            elif time.monotonic() >= deadline_at:
+                break
+            else:
+                timeout = deadline_at - time.monotonic()
+        raise last_error or RetryableOCRError("OCR deadline exceeded")
+
+    def stats(self):
+        return {name: breaker.state for name, breaker in self.breakers.items()}
+
+
+def build_backend(name, api_key=None, url=OCR_SPACE_URL):
+    if name == 'ocrspace': return OCRSpaceBackend(api_key, url=url)
+    if name == 'tesseract': return TesseractBackend()
+    if name == 'fake': return FakeBackend()
+    raise ValueError(f"Unknown OCR backend: {name}")
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class RefIndex:
+    """ดัชนี ref_id ที่บันทึกแล้ว เก็บในไฟล์ SQLite (ใช้ร่วมกันทุก gunicorn worker)
+
+    มี dict ในหน่วยความจำไว้หน้า SQLite สำหรับ ref_id ที่เคยเห็นแล้ว
+    ค่า row เป็นเลขแถวในชีต Transactions หรือ 0 ถ้ายังไม่รู้แถว
+    (จองไว้แล้วแต่ยังเขียนลงชีตไม่เสร็จ) หรือ NULL ระหว่างจอง (เก็บเวลาที่จองไว้ใน claimed_at)
+    written_at เป็นเวลาที่ set_row ครั้งล่าสุด (กันไม่ให้ reconcile ลบแถวที่เขียนหลังเริ่มอ่านชีต)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._seen = {}
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (ref_id TEXT PRIMARY KEY, row INTEGER, claimed_at REAL, written_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # ไฟล์ดัชนีจากเวอร์ชันก่อนยังไม่มี claimed_at/written_at (การจองเดิมถือว่าเก่าแล้ว)
+            columns = {column[1] for column in conn.execute("PRAGMA table_info(refs)")}
+            for column in ('claimed_at', 'written_at'):
+                if column not in columns: conn.execute(f"ALTER TABLE refs ADD COLUMN {column} REAL")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def is_built(self):
+        return self._conn().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+    def find(self, ref_id):
+        """คืนเลขแถว (0 = ยังไม่รู้แถว) หรือ None ถ้ายังไม่เคยบันทึก"""
+        row = self._seen.get(ref_id)
+        if row: return row
+        found = self._conn().execute("SELECT row FROM refs WHERE ref_id = ?", (ref_id,)).fetchone()
+        if found is None: return None
+        row = found[0] or 0
+        if row: self._seen[ref_id] = row
+        return row
+
+    def claim(self, ref_id):
+        """จอง ref_id ก่อนเขียนลงชีต คืน False ถ้ามี worker อื่นบันทึก/จองไปแล้ว"""
+        with self._conn() as conn:
+            return conn.execute("INSERT OR IGNORE INTO refs (ref_id, row, claimed_at) VALUES (?, NULL, ?)", (ref_id, time.time())).rowcount == 1
+
+    def release(self, ref_id):
+        """ยกเลิกการจอง (เขียนลงชีตไม่สำเร็จ)"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM refs WHERE ref_id = ? AND row IS NULL", (ref_id,))
+        self._seen.pop(ref_id, None)
+
+    def set_row(self, ref_id, row):
+        with self._conn() as conn:
+            conn.execute("UPDATE refs SET row = ?, written_at = ? WHERE ref_id = ?", (row, time.time(), ref_id))
+        if row: self._seen[ref_id] = row
+
+    def reconcile(self, column_values, first_row=2, pending=(), stale_after=600, started_at=None):
+        """ซิงก์กับค่าในคอลัมน์ RefId ของชีต (list จาก col_values รวมหัวตาราง)
+
+        ref_id ที่มีในชีตถูกเพิ่ม/อัปเดตแถว, ref_id ที่เคยเขียนแล้วแต่หายไปจากชีตถูกลบ
+        ยกเว้นที่อยู่ใน `pending` หรือเขียน (set_row) ตั้งแต่ `started_at` (เวลาที่เริ่มอ่าน journal/ชีต)
+        เพราะอาจ flush เสร็จหลังจากอ่านคอลัมน์ไปแล้ว
+        การจอง (row เป็น NULL) ที่ไม่มีในชีต ไม่อยู่ใน `pending` (ref_id ที่ยังค้างใน journal
+        ของ write-behind) และจองมานานกว่า `stale_after` วินาที ถือว่าค้างจากงานที่ล้มไปแล้ว จึงถูกปล่อย
+        คืน (จำนวนที่เพิ่ม, จำนวนที่ลบ, จำนวนการจองที่ปล่อย)
+        """
+        sheet_refs = {}
+        for row, value in enumerate(column_values[first_row - 1:], start=first_row):
+            value = str(value).strip()
+            if value and value != 'N/A' and value not in sheet_refs: sheet_refs[value] = row
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            known = {ref_id for ref_id, in conn.execute("SELECT ref_id FROM refs")}
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS sheet_refs (ref_id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM sheet_refs")
+            conn.executemany("INSERT INTO sheet_refs (ref_id) VALUES (?)", ((ref_id,) for ref_id in sheet_refs))
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS pending_refs (ref_id TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM pending_refs")
+            conn.executemany("INSERT OR IGNORE INTO pending_refs (ref_id) VALUES (?)", ((ref_id,) for ref_id in pending if ref_id))
+            removed = conn.execute("DELETE FROM refs WHERE row IS NOT NULL AND (written_at IS NULL OR written_at < ?)"
+                                   " AND ref_id NOT IN (SELECT ref_id FROM sheet_refs) AND ref_id NOT IN (SELECT ref_id FROM pending_refs)",
+                                   (time.time() if started_at is None else started_at,)).rowcount
+            released = conn.execute("DELETE FROM refs WHERE row IS NULL AND (claimed_at IS NULL OR claimed_at < ?)"
+                                    " AND ref_id NOT IN (SELECT ref_id FROM sheet_refs) AND ref_id NOT IN (SELECT ref_id FROM pending_refs)",
+                                    (time.time() - stale_after,)).rowcount
+            conn.executemany("INSERT OR REPLACE INTO refs (ref_id, row) VALUES (?, ?)", sheet_refs.items())
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+        self._seen = dict(sheet_refs)
+        return len(set(sheet_refs) - known), removed, released
@@ -0,0 +1,153 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from gspread.exceptions import APIError
+
+from slip_parser import compile_rules
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_SHEETS = ("Config", "Aliases", "ParsingRules")
+
+
+def records_from_values(values):
+    """แปลงค่าจาก values_batch_get (แถวแรกเป็นหัวตาราง) เป็น list ของ dict แบบ get_all_records"""
+    if not values: return []
+    header = [str(name).strip() for name in values[0]]
+    return [dict(zip(header, list(row) + [''] * (len(header) - len(row)))) for row in values[1:]]
+
+
+def _is_missing_range(error):
+    # ชีตที่ไม่มีอยู่ Sheets ตอบ 400 "Unable to parse range" (ต่างจาก 429/5xx ที่ควรลองใหม่ทั้งชุด)
+    if not isinstance(error, APIError): return False
+    return (getattr(error, 'code', None) or getattr(getattr(error, 'response', None), 'status_code', None)) == 400
+
+
+def fetch_reference_values(spreadsheet, read, names=REFERENCE_SHEETS):
+    """อ่านชีตอ้างอิงทั้งหมดด้วย values_batch_get ครั้งเดียว คืน dict ของชื่อชีต -> list ของ record
+
+    `read(fn, *args, key=...)` คือ SheetsScheduler.read ถ้ามีชีตใดหายไป batch ทั้งชุดจะล้ม
+    จึงอ่านทีละชีตแทน ชีตที่หายไปได้ข้อมูลว่างเฉพาะชีตนั้น (error อื่นยัง raise ตามเดิม)
+    """
+    try:
+        response = read(spreadsheet.values_batch_get, list(names), key='reference_sheets')
+        return {name: records_from_values(value_range.get('values', [])) for name, value_range in zip(names, response.get('valueRanges', []))}
+    except APIError as e:
+        if not _is_missing_range(e): raise
+        logger.warning("Batch read of reference sheets failed (%s), reading them one by one", e)
+    sheets = {}
+    for name in names:
+        try:
+            sheets[name] = records_from_values(read(spreadsheet.values_get, name, key=f'reference_sheet:{name}').get('values', []))
+        except APIError as e:
+            if not _is_missing_range(e): raise
+            logger.warning("Reference sheet %s cannot be read, using no data for it: %s", name, e)
+            sheets[name] = []
+    return sheets
+
+
+class ReferenceSnapshot:
+    """ข้อมูลอ้างอิง (Config, Aliases, ParsingRules) ชุดหนึ่ง แก้ไขไม่ได้ มีเลข version"""
+
+    def __init__(self, version, sheets):
+        self.version = version
+        self.config = MappingProxyType({r['Key']: r['Value'] for r in sheets.get('Config', []) if r.get('Key')})
+        self.aliases = MappingProxyType({r['OriginalName']: r['Nickname'] for r in sheets.get('Aliases', []) if r.get('OriginalName')})
+        self.rule_rows = tuple(MappingProxyType(dict(r)) for r in sheets.get('ParsingRules', []))
+        self._rules_engine = None
+
+    @property
+    def rules_engine(self):
+        if self._rules_engine is None:
+            self._rules_engine = compile_rules([dict(r) for r in self.rule_rows])
+            for row, term, error in self._rules_engine.errors:
+                logger.warning("ParsingRules row %s skipped (%s): %s", row, term, error)
+        return self._rules_engine
+
+
+EMPTY_SNAPSHOT = ReferenceSnapshot(0, {})
+
+
+class ReferenceStore:
+    """โหลดชีตอ้างอิงทั้ง 3 ชีตด้วยการเรียก Sheets ครั้งเดียว แล้วแชร์ให้ทุก gunicorn worker ผ่านไฟล์
+
+    worker ที่สั่ง reload จะเขียนไฟล์ใหม่ (version + 1) แบบ atomic
+    worker อื่นตรวจไฟล์ทุก `poll_interval` วินาที (os.stat) แล้วโหลด snapshot ใหม่ตาม
+    `fetch()` ต้องคืน dict ของชื่อชีต -> list ของ record
+    ถ้ายังไม่มี snapshot แล้ว fetch ล้ม จะไม่ลองโหลดเองอีกจนพ้น `retry_after` วินาที
+    (อย่างน้อย poll_interval) ระหว่างนั้นใช้ snapshot เดิม/ว่าง (reload() สั่งโหลดได้เสมอ)
+    `current()` ไม่ raise แต่ `reload()` raise error ของ fetch ต่อให้ผู้สั่งรู้ว่าโหลดไม่สำเร็จ
+    """
+
+    def __init__(self, path, fetch, poll_interval=1.0, retry_after=30.0):
+        self.path = path
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.retry_after = max(poll_interval, retry_after)
+        self._failed_at = None
+        self._snapshot = None
+        self._file_stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def _read_file(self):
+        with open(self.path, encoding='utf-8') as f: data = json.load(f)
+        return ReferenceSnapshot(data['version'], data['sheets'])
+
+    def current(self):
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.poll_interval: return self._snapshot
+        with self._lock:
+            self._checked_at = now
+            stamp = self._stamp()
+            if stamp is None:
+                if self._failed_at is not None and now - self._failed_at < self.retry_after: return self._snapshot or EMPTY_SNAPSHOT
+                return self._publish(only_if_missing=True)
+            if stamp != self._file_stamp or self._snapshot is None:
+                try:
+                    self._snapshot, self._file_stamp = self._read_file(), stamp
+                except (OSError, ValueError, KeyError):
+                    logger.exception("Cannot read reference snapshot %s", self.path)
+            return self._snapshot or EMPTY_SNAPSHOT
+
+    def reload(self):
+        """โหลดจาก Sheets ใหม่แล้วเผยแพร่ให้ทุก worker คืน snapshot ใหม่ (โหลดไม่ได้: raise, snapshot เดิมยังใช้ต่อ)"""
+        with self._lock:
+            return self._publish(only_if_missing=False, raise_errors=True)
+
+    def _publish(self, only_if_missing, raise_errors=False):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # ให้ worker เดียวโหลดจาก Sheets ตอน cold start
+            if only_if_missing and self._stamp() is not None:
+                self._snapshot, self._file_stamp = self._read_file(), self._stamp()
+                return self._snapshot
+            try:
+                sheets = self.fetch()
+            except Exception:
+                self._failed_at = time.monotonic()
+                logger.exception("Loading reference sheets failed, retrying in %ss", self.retry_after)
+                if raise_errors: raise
+                return self._snapshot or EMPTY_SNAPSHOT
+            self._failed_at = None
+            previous = self._read_file().version if self._stamp() is not None else 0
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': previous + 1, 'loaded_at': time.time(), 'sheets': sheets}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._snapshot, self._file_stamp = ReferenceSnapshot(previous + 1, sheets), self._stamp()
+            return self._snapshot
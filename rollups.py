@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+ACCEPTED_DATE_FORMATS = ['%Y-%m-%d', '%m-%d-%Y', '%d-%m-%Y']
+
+def parse_transaction_date(value):
+    if not value: return None
+    for fmt in ACCEPTED_DATE_FORMATS:
+        try: return datetime.strptime(str(value), fmt).date()
+        except (ValueError, TypeError): continue
+    return None
+
+def parse_amount(value):
+    try: return float(str(value).replace(',', ''))
+    except (ValueError, TypeError): return None
+
+
+class RollupStore:
+    """ยอดรวมรายวันต่อ (SourceId, วันที่, ผู้รับ) เก็บในไฟล์ SQLite
+
+    สรุปช่วงเวลาใดๆ อ่านแค่แถวของ source นั้นในช่วงวันที่ที่ขอ (range scan บน
+    primary key) จึงไม่ขึ้นกับจำนวนรายการทั้งหมดในชีต Transactions
+    bucket เก็บชื่อผู้รับตามที่บันทึก (ผ่าน alias แล้ว) ส่วนการรวมเป็น 'อื่นๆ'
+    ทำตอนสรุปเพื่อให้ alias ที่เพิ่มทีหลังมีผลย้อนหลัง
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS daily (source_id TEXT, day TEXT, bucket TEXT, total REAL, count INTEGER, PRIMARY KEY (source_id, day, bucket))")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def is_built(self):
+        return self._conn().execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone() is not None
+
+    @staticmethod
+    def _key(source_id, date_value, bucket, amount):
+        day = parse_transaction_date(date_value)
+        amount = parse_amount(amount)
+        if not source_id or day is None or amount is None: return None
+        return (source_id, day.isoformat(), str(bucket or 'N/A'), amount)
+
+    def add(self, source_id, date_value, bucket, amount):
+        key = self._key(source_id, date_value, bucket, amount)
+        if key is None: return False
+        with self._conn() as conn:
+            conn.execute("INSERT INTO daily (source_id, day, bucket, total, count) VALUES (?, ?, ?, ?, 1) "
+                         "ON CONFLICT (source_id, day, bucket) DO UPDATE SET total = total + excluded.total, count = count + 1", key)
+        return True
+
+    def rebuild(self, records):
+        """สร้างใหม่ทั้งหมดจากแถวของชีต Transactions (dict จาก get_all_records) ในรอบเดียว"""
+        totals = {}
+        for record in records:
+            key = self._key(record.get('SourceId'), record.get('TransactionDate'), record.get('ToRecipient'), record.get('Amount'))
+            if key is None: continue
+            total, count = totals.get(key[:3], (0.0, 0))
+            totals[key[:3]] = (total + key[3], count + 1)
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM daily")
+            conn.executemany("INSERT INTO daily (source_id, day, bucket, total, count) VALUES (?, ?, ?, ?, ?)",
+                             (key + value for key, value in totals.items()))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+        return sum(count for total, count in totals.values())
+
+    def totals(self, source_id, start, end):
+        """ยอดรวมต่อ bucket ของ source ระหว่างวันที่ start ถึง end (รวมทั้งสองวัน)"""
+        rows = self._conn().execute(
+            "SELECT bucket, SUM(total) FROM daily WHERE source_id = ? AND day BETWEEN ? AND ? GROUP BY bucket",
+            (source_id, start.isoformat(), end.isoformat()))
+        return dict(rows.fetchall())
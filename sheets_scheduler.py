@@ -0,0 +1,270 @@
+"""ตัวจัดคิวการเรียก Google Sheets ทุกครั้ง (แทนการเรียก gspread ตรงๆ)
+
+- token bucket ตามโควตาต่อนาที แบ่งลำดับ: เขียน > อ่าน > อ่านเบื้องหลัง
+  ถ้าให้ `bucket_path` token จะเก็บในไฟล์นั้น (ล็อกด้วย fcntl) ทุก gunicorn worker และ backfill
+  จึงใช้โควตาก้อนเดียวกัน (ลำดับความสำคัญมีผลภายใน process)
+- retry 429 / 5xx / network error แบบ exponential backoff + jitter
+  (การเขียนที่ไม่ idempotent เช่น append retry เองได้เฉพาะเมื่อแน่ใจว่ายังไม่ถูกเขียน ดู `write`)
+- การอ่านที่เหมือนกันและเกิดพร้อมกันรวมเป็น request เดียว
+- refresh access token ล่วงหน้าก่อนหมดอายุ
+- เชื่อมต่อไม่ได้: เว้นช่วง (cooldown) ก่อนลองใหม่ แทนการ reconnect ทุกครั้งที่เรียก
+`open_spreadsheet()` ต้องคืน (spreadsheet, credentials) ใส่ spreadsheet ปลอมสำหรับทดสอบได้
+"""
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import random
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+
+logger = logging.getLogger(__name__)
+
+WRITE, READ, BACKGROUND = 0, 1, 2
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class SheetsUnavailableError(Exception):
+    pass
+
+
+def is_transient(error):
+    """error ที่ลองใหม่ภายหลังน่าจะผ่าน (โควตา, 5xx, network, ยังเชื่อมต่อชีตไม่ได้) ต่างจากคำขอที่ผิดเอง เช่น HTTP 400"""
+    return isinstance(error, SheetsUnavailableError) or SheetsScheduler._status(error) in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """token bucket ที่คนรอได้ token ตามลำดับ priority (เลขน้อยก่อน) แล้วตามลำดับที่มาถึง
+
+    `state_path`: เก็บ (จำนวน token, เวลาที่อัปเดต) ในไฟล์ที่ทุก process ใช้ร่วมกันแทนในหน่วยความจำ
+    """
+
+    def __init__(self, per_minute, capacity=None, state_path=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.state_path = state_path
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._fd = None
+        self._fd_pid = None
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _shared(self, take):
+        # เปิดไฟล์ใหม่หลัง fork: flock ผูกกับ open file ที่ process แม่/ลูกใช้ร่วมกัน
+        if self._fd is None or self._fd_pid != os.getpid():
+            self._fd, self._fd_pid = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o644), os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            now = time.time()
+            try: tokens, updated = struct.unpack('dd', os.pread(self._fd, 16, 0))
+            except struct.error: tokens, updated = float(self.capacity), now  # ไฟล์ใหม่
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+            taken = take and tokens >= 1
+            if taken: tokens -= 1
+            if take: os.pwrite(self._fd, struct.pack('dd', tokens, now), 0)
+            return tokens, taken
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _take(self):
+        """หยิบ 1 token คืน 0 ถ้าได้ หรือจำนวนวินาทีที่ควรรอ"""
+        if self.state_path:
+            tokens, taken = self._shared(take=True)
+        else:
+            self._refill()
+            tokens, taken = self._tokens, self._tokens >= 1
+            if taken: self._tokens -= 1
+        return 0.0 if taken else max(0.01, (1 - tokens) / self.rate)
+
+    def available(self):
+        if self.state_path: return self._shared(take=False)[0]
+        with self._cond:
+            self._refill()
+            return self._tokens
+
+    def acquire(self, priority=READ, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == ticket:
+                        wait = self._take()
+                        if not wait: return True
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0: return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SheetsScheduler:
+    def __init__(self, open_spreadsheet, requests_per_minute=60, max_retries=5, base_backoff=1.0, max_backoff=32.0,
+                 reconnect_cooldown=30.0, refresh_margin=300.0, bucket_path=None):
+        self.open_spreadsheet = open_spreadsheet
+        self.bucket = TokenBucket(requests_per_minute, state_path=bucket_path)
+        self.max_retries, self.base_backoff, self.max_backoff = max_retries, base_backoff, max_backoff
+        self.reconnect_cooldown = reconnect_cooldown
+        self.refresh_margin = refresh_margin
+        self._spreadsheet = None
+        self._credentials = None
+        self._failed_at = None
+        self._worksheets = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._refreshing = False
+        self.retries = 0
+        self.coalesced = 0
+
+    # --- การเชื่อมต่อ ---
+    def spreadsheet(self):
+        """spreadsheet ที่เปิดไว้แล้ว หรือ None ถ้าเชื่อมต่อไม่ได้ (จะไม่ลองใหม่จนพ้น cooldown)"""
+        if self._spreadsheet is not None: return self._spreadsheet
+        with self._connect_lock:
+            if self._spreadsheet is not None: return self._spreadsheet
+            if self._failed_at is not None and time.monotonic() - self._failed_at < self.reconnect_cooldown: return None
+            try:
+                self._spreadsheet, self._credentials = self._execute(READ, self.open_spreadsheet, (), {})
+                self._failed_at = None
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                logger.error("Cannot open spreadsheet, retrying in %ss: %s", self.reconnect_cooldown, e)
+        return self._spreadsheet
+
+    def worksheet(self, title):
+        worksheet = self._worksheets.get(title)
+        if worksheet is None:
+            spreadsheet = self.spreadsheet()
+            if spreadsheet is None: raise SheetsUnavailableError("spreadsheet is not available")
+            worksheet = self._worksheets[title] = self.read(spreadsheet.worksheet, title)
+        return worksheet
+
+    def _refresh_credentials_if_needed(self):
+        credentials = self._credentials
+        expiry = getattr(credentials, 'expiry', None)
+        if expiry is None or self._refreshing: return
+        if expiry - datetime.utcnow() > timedelta(seconds=self.refresh_margin): return
+        self._refreshing = True
+        def run():
+            try:
+                from google.auth.transport.requests import Request
+                credentials.refresh(Request())
+            except Exception:
+                logger.exception("Refreshing Google credentials failed")
+            finally:
+                self._refreshing = False
+        threading.Thread(target=run, name="sheets-token-refresh", daemon=True).start()
+
+    # --- การเรียก API ---
+    def read(self, fn, *args, background=False, key=None, coalesce=True, **kwargs):
+        """อ่านข้อมูล ถ้ามีการอ่านเดียวกัน (fn + args เดียวกัน) ค้างอยู่จะรอผลนั้นแทน
+
+        `coalesce=False` อ่านใหม่เสมอ (ใช้ตรวจผลการเขียน: ผลของการอ่านที่เริ่มก่อนเขียนเสร็จใช้ไม่ได้)
+        """
+        if not coalesce: return self._execute(BACKGROUND if background else READ, fn, args, kwargs)
+        if key is None:
+            owner = getattr(fn, '__self__', None)
+            key = (getattr(owner, 'id', id(owner)), getattr(fn, '__name__', fn), args, tuple(sorted(kwargs.items())))
+        try: hash(key)
+        except TypeError:  # args ที่ hash ไม่ได้ (เช่น list): ไม่รวม request
+            return self._execute(BACKGROUND if background else READ, fn, args, kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader: flight = self._flights[key] = _Flight()
+            else: self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None: raise flight.error
+            return flight.value
+        try:
+            flight.value = self._execute(BACKGROUND if background else READ, fn, args, kwargs)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock: self._flights.pop(key, None)
+            flight.done.set()
+
+    def write(self, fn, *args, idempotent=False, verify=None, **kwargs):
+        """เขียนข้อมูล (ลำดับก่อนการอ่าน)
+
+        การเขียนที่ส่งซ้ำแล้วได้แถวซ้ำ (append) จะ retry เองเฉพาะ 429 หรือเชื่อมต่อไม่ได้ตั้งแต่แรก
+        ซึ่งแปลว่า Sheets ยังไม่ได้รับคำขอ ส่วน 5xx / timeout / การเชื่อมต่อหลุดกลางทาง
+        อาจเขียนสำเร็จไปแล้ว: เรียก `verify()` (อ่านชีตดูว่ามีข้อมูลนั้นหรือยัง) ถ้าคืน True ถือว่าสำเร็จ
+        (คืน None แทน response) ถ้าคืน False จึงส่งใหม่ ไม่มี verify ก็ raise ให้ผู้เรียกตัดสินเอง
+        `idempotent=True` (เช่น update_cell) retry ได้ทุกกรณีเหมือนการอ่าน
+        """
+        return self._execute(WRITE, fn, args, kwargs, idempotent=idempotent, verify=verify)
+
+    @staticmethod
+    def _not_applied(error, status):
+        # 429 = ถูกปฏิเสธก่อนทำงาน, ConnectTimeout = ยังไม่ได้ส่งคำขอ
+        return status == 429 or isinstance(error, requests.ConnectTimeout)
+
+    @staticmethod
+    def _status(error):
+        if isinstance(error, APIError):
+            return getattr(error, 'code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)): return 503
+        return None
+
+    def _execute(self, priority, fn, args, kwargs, idempotent=True, verify=None):
+        self._refresh_credentials_if_needed()
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(priority)
+            try:
+                return fn(*args, **kwargs)
+            except WorksheetNotFound:
+                raise
+            except Exception as e:
+                status = self._status(e)
+                if status not in RETRYABLE_STATUS: raise
+                ambiguous = not idempotent and not self._not_applied(e, status)
+                if (ambiguous and verify is None) or (not ambiguous and attempt == self.max_retries): raise
+                delay = min(self.max_backoff, self.base_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                # รอก่อน verify ด้วย: คำขอเดิม (ถ้า Sheets ได้รับแล้ว) จะได้เขียนเสร็จก่อนอ่าน
+                time.sleep(delay)
+                if ambiguous:
+                    try: applied = verify()
+                    except Exception:
+                        logger.exception("Cannot verify %s after HTTP %s", getattr(fn, '__name__', fn), status)
+                        raise e
+                    if applied:
+                        logger.warning("Sheets %s returned %s but the write was applied", getattr(fn, '__name__', fn), status)
+                        return None
+                    if attempt == self.max_retries: raise
+                self.retries += 1
+                logger.warning("Sheets %s returned %s, retrying", getattr(fn, '__name__', fn), status)
+
+    def stats(self):
+        return {'tokens': round(self.bucket.available(), 2), 'retries': self.retries, 'coalesced': self.coalesced,
+                'connected': self._spreadsheet is not None}
@@ -1,4 +1,6 @@
 import re
+import json
+import hashlib
 from datetime import datetime
 
 # --- พจนานุกรมและฟังก์ชันช่วยเหลือ (เหมือนเดิม) ---
@@ -17,26 +19,36 @@ def normalize_date(day_str, month_str, year_str):
         return f"{year:04d}-{month:02d}-{day:02d}"
     except: return None
 
+# --- Regex พื้นฐาน (compile ครั้งเดียวตอน import) ---
+DATE_PATTERN = re.compile(r'(\d{1,2})\s+(ม\.ค\.|ก\.พ\.|มี\.ค\.|เม\.ย\.|พ\.ค\.|มิ\.ย\.|ก\.ค\.|ส\.ค\.|ก\.ย\.|ต\.ค\.|พ\.ย\.|ธ\.ค\.)\s+(\d{2,4})')
+AMOUNT_PATTERNS = [
+    re.compile(r'(?:จำนวน|Amount)[\s:]*([,\d]+\.\d{2})', re.IGNORECASE),
+    re.compile(r'([,\d]+\.\d{2})\s*THB', re.IGNORECASE)
+]
+ANY_AMOUNT_PATTERN = re.compile(r'(\d{1,3}(?:,\d{3})*\.\d{2})')
+REF_ID_PATTERNS = [
+    re.compile(r'เลขที่รายการ[:\s]*([a-zA-Z0-9]{15,})', re.IGNORECASE),
+    re.compile(r'รหัสอ้างอิง[:\s]*([a-zA-Z0-9]{15,})', re.IGNORECASE),
+    re.compile(r'เลขที่อ้างอิง[:\s]*([a-zA-Z0-9]{15,})', re.IGNORECASE),
+    re.compile(r'\b([a-zA-Z0-9]{20,})\b', re.IGNORECASE)
+]
+KBANK_ACCOUNT_PATTERN = re.compile(r'(?:น\.ส\.|นาย)\s+(.*?)\n')
+KBANK_PROMPTPAY_PATTERN = re.compile(r'Prompt\s*Pay\s*\n(.*?)\n', re.MULTILINE)
+FROM_LINE_PATTERN = re.compile(r'จาก\s*\n(.*?)\n', re.MULTILINE)
+FROM_TITLE_PATTERN = re.compile(r'จาก\s+(นาย|นาง|น\.ส\.)\s+([^\n]+)')
+TO_LINE_PATTERN = re.compile(r'ไปยัง\s*\n(.*?)\n', re.MULTILINE)
+BBL_TO_LINE_PATTERN = re.compile(r'ไปที่\s*\n(.*?)\n', re.MULTILINE)
+
 def find_amount(text):
-    patterns = [
-        r'(?:จำนวน|Amount)[\s:]*([,\d]+\.\d{2})',
-        r'([,\d]+\.\d{2})\s*THB'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in AMOUNT_PATTERNS:
+        match = pattern.search(text)
         if match: return float(match.group(1).replace(',', ''))
-    all_amounts = [float(amount.replace(',', '')) for amount in re.findall(r'(\d{1,3}(?:,\d{3})*\.\d{2})', text)]
+    all_amounts = [float(amount.replace(',', '')) for amount in ANY_AMOUNT_PATTERN.findall(text)]
     return max(all_amounts) if all_amounts else None
 
 def find_reference_id(text):
-    patterns = [
-        r'เลขที่รายการ[:\s]*([a-zA-Z0-9]{15,})',
-        r'รหัสอ้างอิง[:\s]*([a-zA-Z0-9]{15,})',
-        r'เลขที่อ้างอิง[:\s]*([a-zA-Z0-9]{15,})',
-        r'\b([a-zA-Z0-9]{20,})\b'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in REF_ID_PATTERNS:
+        match = pattern.search(text)
         if match:
             return match.group(1)
     return None
@@ -44,74 +56,172 @@ def find_reference_id(text):
 # --- Parser เฉพาะสำหรับแต่ละธนาคาร (เหมือนเดิม) ---
 def _parse_kbank_slip(text):
     data = {}
-    account_match = re.search(r'(?:น\.ส\.|นาย)\s+(.*?)\n', text)
+    account_match = KBANK_ACCOUNT_PATTERN.search(text)
     if account_match: data['account'] = account_match.group(1).strip()
     if "TrueMoney Wallet" in text: data['recipient'] = "TrueMoney Wallet"
     elif "ShopeePay" in text or "รี Shopee" in text: data['recipient'] = "ShopeePay"
     else:
-        recipient_match = re.search(r'Prompt\s*Pay\s*\n(.*?)\n', text, re.MULTILINE)
+        recipient_match = KBANK_PROMPTPAY_PATTERN.search(text)
         if recipient_match: data['recipient'] = recipient_match.group(1).strip()
     return data
 
 def _parse_scb_slip(text):
     data = {}
-    from_match = re.search(r'จาก\s*\n(.*?)\n', text, re.MULTILINE)
+    from_match = FROM_LINE_PATTERN.search(text)
     if from_match: data['account'] = from_match.group(1).strip()
-    to_match = re.search(r'ไปยัง\s*\n(.*?)\n', text, re.MULTILINE)
+    to_match = TO_LINE_PATTERN.search(text)
     if to_match: data['recipient'] = to_match.group(1).strip()
     return data
 
 def _parse_bbl_slip(text):
     data = {}
     try:
-        from_match = re.search(r'จาก\s*\n(.*?)\n', text, re.MULTILINE)
-        if not from_match: from_match = re.search(r'จาก\s+(นาย|นาง|น\.ส\.)\s+([^\n]+)', text)
+        from_match = FROM_LINE_PATTERN.search(text)
+        if not from_match: from_match = FROM_TITLE_PATTERN.search(text)
         if from_match: data['account'] = from_match.group(1).strip() if len(from_match.groups()) == 1 else " ".join(from_match.groups())
 
-        to_match = re.search(r'ไปที่\s*\n(.*?)\n', text, re.MULTILINE)
-        if not to_match: to_match = re.search(r'ไปยัง\s*\n(.*?)\n', text, re.MULTILINE)
+        to_match = BBL_TO_LINE_PATTERN.search(text)
+        if not to_match: to_match = TO_LINE_PATTERN.search(text)
         if to_match: data['recipient'] = to_match.group(1).strip()
     except Exception: pass
     return data
 
-# --- ฟังก์ชันหลัก (อัปเกรด Rules Engine) ---
+# --- Rules Engine (compile จากชีต ParsingRules ครั้งเดียวต่อการโหลด) ---
+class IdentifierMatcher:
+    """หา IdentifierText ทุกตัวที่อยู่ในข้อความด้วยการสแกนรอบเดียว (Aho-Corasick)"""
+
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for word in words:
+            if not word: continue
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({}); self._fail.append(0); self._out.append(set())
+                node = nxt
+            self._out[node].add(word)
+        # สร้าง failure link แบบ BFS
+        pending = list(self._goto[0].values())
+        while pending:
+            node = pending.pop(0)
+            for ch, nxt in self._goto[node].items():
+                pending.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]: fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def find_all(self, text):
+        found = set()
+        if len(self._goto) == 1: return found
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]: node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]: found |= out[node]
+        return found
+
+class RulesEngine:
+    """กฎจากชีต ParsingRules ที่ compile แล้ว จัดกลุ่มตาม TargetField
+
+    - แถวที่ไม่มี IdentifierText, TargetField หรือ SearchMethod ถูกข้าม (เหมือนตัวโหลดกฎเดิม)
+    - FIXED_VALUE ใช้ได้เมื่อพบ IdentifierText ในข้อความ
+    - REGEX ลองทุกข้อตามลำดับ (เหมือนเดิม) จนกว่า field นั้นจะมีค่า
+    กฎที่ใช้ไม่ได้ (เช่น regex ผิด) จะถูกเก็บไว้ใน `errors` ตั้งแต่ตอนโหลด
+    `version` เป็น hash ของกฎทั้งชุด (เท่ากันทุก worker ถ้ากฎเหมือนกัน)
+    """
+
+    def __init__(self, rules, first_row=2):
+        self.errors = []
+        self._by_field = {}
+        self._always_positions = {}  # field -> ตำแหน่งของกฎ REGEX (ลองทุกข้อความ)
+        self._fixed_positions = {}  # identifier -> [(field, ตำแหน่ง)] ของกฎ FIXED_VALUE
+        self._count = 0
+        identifiers = []
+        for index, rule in enumerate(rules):
+            row = first_row + index
+            identifier = str(rule.get('IdentifierText') or '')
+            target_field = rule.get('TargetField')
+            method = rule.get('SearchMethod')
+            if not (identifier and target_field and method): continue
+            if method == 'FIXED_VALUE':
+                value = rule.get('FixedValue')
+                if not value:
+                    self.errors.append((row, identifier, "FixedValue ว่าง")); continue
+                compiled = (method, identifier, str(value))
+                identifiers.append(identifier)
+            elif method == 'REGEX':
+                search_term = rule.get('SearchTerm')
+                if not search_term:
+                    self.errors.append((row, identifier, "SearchTerm ว่าง")); continue
+                try:
+                    # ใช้ re.DOTALL เพื่อให้ . แมทช์ newline ได้ด้วย
+                    compiled = (method, identifier, re.compile(str(search_term), re.DOTALL))
+                except re.error as e:
+                    self.errors.append((row, search_term, f"Regex ผิด: {e}")); continue
+            else:
+                self.errors.append((row, identifier, f"ไม่รู้จัก SearchMethod '{method}'")); continue
+            field_rules = self._by_field.setdefault(target_field, [])
+            if method == 'REGEX': self._always_positions.setdefault(target_field, []).append(len(field_rules))
+            else: self._fixed_positions.setdefault(identifier, []).append((target_field, len(field_rules)))
+            field_rules.append(compiled)
+            self._count += 1
+        self._matcher = IdentifierMatcher(identifiers)
+        # ใช้บอกว่าผล parse ที่ cache ไว้ได้จากกฎชุดเดียวกันหรือไม่
+        self.version = hashlib.sha1(json.dumps(list(rules), sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+    def __len__(self):
+        return self._count
+
+    def apply(self, text, final_data):
+        # ไล่เฉพาะกฎที่มีโอกาสใช้ได้ (REGEX + FIXED_VALUE ที่เจอ identifier) ตามลำดับในชีต
+        candidates = {field: list(positions) for field, positions in self._always_positions.items()}
+        if self._fixed_positions:
+            for identifier in self._matcher.find_all(text):
+                for field, position in self._fixed_positions[identifier]:
+                    candidates.setdefault(field, []).append(position)
+        for target_field, positions in candidates.items():
+            if final_data.get(target_field) != 'N/A': continue
+            field_rules = self._by_field[target_field]
+            for position in sorted(positions):
+                method, identifier, term = field_rules[position]
+                value_found = None
+                if method == 'FIXED_VALUE':
+                    value_found = term
+                else:
+                    match = term.search(text)
+                    if match:
+                        value_found = match.group(1) if match.groups() else match.group(0)
+                # ทำความสะอาดข้อมูลที่ได้จากกฎ แล้วหยุดที่กฎแรกที่ได้ค่า
+                if value_found:
+                    cleaned_value = value_found.replace('\n', ' ').strip()
+                    final_data[target_field] = ' '.join(cleaned_value.split()) # รวมเว้นวรรคหลายๆ อันเป็นอันเดียว
+                    break
+        return final_data
+
+def compile_rules(rules):
+    return rules if isinstance(rules, RulesEngine) else RulesEngine(rules or [])
+
+# --- ฟังก์ชันหลัก ---
 def parse_slip(text, rules):
     final_data = {'date': 'N/A', 'amount': 'N/A', 'recipient': 'N/A', 'account': 'N/A', 'ref_id': 'N/A'}
     
     # 1. หาข้อมูลพื้นฐาน
-    date_match = re.search(r'(\d{1,2})\s+(ม\.ค\.|ก\.พ\.|มี\.ค\.|เม\.ย\.|พ\.ค\.|มิ\.ย\.|ก\.ค\.|ส\.ค\.|ก\.ย\.|ต\.ค\.|พ\.ย\.|ธ\.ค\.)\s+(\d{2,4})', text)
+    date_match = DATE_PATTERN.search(text)
     if date_match:
         final_data['date'] = normalize_date(date_match.group(1), date_match.group(2), date_match.group(3))
     final_data['amount'] = find_amount(text)
     final_data['ref_id'] = find_reference_id(text)
     
-    # 2. *** Rules Engine ใหม่ ***
-    for rule in rules:
-        identifier = rule.get('IdentifierText', '')
-        target_field = rule.get('TargetField')
-        method = rule.get('SearchMethod')
-        
-        if final_data.get(target_field) == 'N/A' and (identifier in text or method == 'REGEX'):
-            value_found = None
-            if method == 'FIXED_VALUE':
-                value_found = rule.get('FixedValue')
-            elif method == 'REGEX':
-                search_term = rule.get('SearchTerm')
-                if not search_term: continue
-                try:
-                    # ใช้ re.DOTALL เพื่อให้ . แมทช์ newline ได้ด้วย
-                    match = re.search(search_term, text, re.DOTALL)
-                    if match:
-                        value_found = match.group(1) if match.groups() else match.group(0)
-                except re.error:
-                    continue # ข้ามกฎที่มี Regex ผิด
-            
-            # --- ส่วนที่เพิ่มเข้ามา ---
-            # ทำความสะอาดข้อมูลที่ได้จากกฎ
-            if value_found:
-                cleaned_value = value_found.replace('\n', ' ').strip()
-                final_data[target_field] = ' '.join(cleaned_value.split()) # รวมเว้นวรรคหลายๆ อันเป็นอันเดียว
-            # --- สิ้นสุดส่วนที่เพิ่ม ---
+    # 2. Rules Engine (รับได้ทั้ง RulesEngine ที่ compile แล้ว หรือ list ของแถวจากชีต)
+    compile_rules(rules).apply(text, final_data)
 
     # 3. *** Fallback Mechanism ***
     if final_data['recipient'] == 'N/A' or final_data['account'] == 'N/A':
@@ -0,0 +1,102 @@
+"""อ่าน mini-QR สำหรับตรวจสอบสลิปของธนาคารไทย (KBank, SCB, BBL ฯลฯ) โดยไม่ต้อง OCR
+
+payload เป็น TLV แบบ EMVCo (tag 2 หลัก + ความยาว 2 หลัก + ค่า) เช่น
+    0041 [00 06 000001][01 03 004][02 20 <เลขอ้างอิง>] 5102TH 9104<CRC>
+tag 00 มี sub-tag 01 = รหัสธนาคารผู้โอน, 02 = เลขอ้างอิงรายการ
+บาง QR มี tag 54 (จำนวนเงิน) ด้วย  tag 91 เป็น CRC-16/CCITT ของ payload ก่อนค่า CRC (ไม่ตรง = ไม่ใช้)
+
+ตัวถอด QR: OpenCV (opencv-python-headless อยู่ใน requirements.txt) หรือ pyzbar (ต้องมี libzbar) ถ้าติดตั้งไว้
+ถ้าไม่มีทั้งคู่ หรือรูปเปิด/ถอดไม่ได้ read_slip_qr จะคืน None (ไปใช้ OCR ตามปกติ)
+"""
+import logging
+import re
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    from pyzbar import pyzbar
+except ImportError:
+    pyzbar = None
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+REF_ID_PATTERN = re.compile(r'^[A-Za-z0-9]{10,}$')
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, เริ่ม 0xFFFF) แบบเดียวกับ EMVCo QR"""
+    crc = 0xFFFF
+    for byte in data.encode('utf-8'):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return f"{crc:04X}"
+
+
+def parse_tlv(payload):
+    fields = {}
+    pos = 0
+    while pos < len(payload):
+        tag, length = payload[pos:pos + 2], payload[pos + 2:pos + 4]
+        if len(tag) < 2 or not length.isdigit(): raise ValueError(f"bad TLV at {pos}")
+        end = pos + 4 + int(length)
+        if end > len(payload): raise ValueError(f"TLV value overruns payload at {pos}")
+        fields[tag] = payload[pos + 4:end]
+        pos = end
+    return fields
+
+
+def parse_slip_qr(payload):
+    """คืน {'ref_id', 'bank_code', 'amount'} จาก payload ของ QR สลิป หรือ None ถ้าไม่ใช่ QR สลิป"""
+    payload = payload.strip()
+    try:
+        fields = parse_tlv(payload)
+        api = parse_tlv(fields.get('00', ''))
+    except ValueError:
+        return None
+    if '91' in fields and not (payload.endswith('9104' + fields['91']) and crc16(payload[:-4]) == fields['91'].upper()): return None
+    ref_id = api.get('02', '')
+    if not REF_ID_PATTERN.match(ref_id): return None
+    data = {'ref_id': ref_id, 'bank_code': api.get('01'), 'amount': None}
+    try:
+        if '54' in fields: data['amount'] = float(fields['54'])
+    except ValueError: pass
+    return data
+
+
+def available():
+    """มีตัวถอด QR ติดตั้งอยู่หรือไม่"""
+    return Image is not None and (pyzbar is not None or cv2 is not None)
+
+
+def decode_qr_payloads(fileobj):
+    if not available(): return []
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            gray = img.convert('L')
+            gray.load()
+        if pyzbar is not None:
+            return [symbol.data.decode('utf-8', 'replace') for symbol in pyzbar.decode(gray, symbols=[pyzbar.ZBarSymbol.QRCODE])]
+        found, payloads, _, _ = cv2.QRCodeDetector().detectAndDecodeMulti(numpy.array(gray))
+        return [payload for payload in payloads if payload] if found else []
+    except Exception as e:  # รวม DecompressionBombError และ cv2.error ซึ่งไม่ใช่ OSError
+        logger.warning("Reading slip QR failed (%s: %s), falling back to OCR", type(e).__name__, e)
+        return []
+    finally:
+        fileobj.seek(0)
+
+
+def read_slip_qr(fileobj):
+    for payload in decode_qr_payloads(fileobj):
+        data = parse_slip_qr(payload)
+        if data: return data
+    return None
@@ -0,0 +1,107 @@
+"""spreadsheet ปลอมสำหรับทดสอบโค้ดที่เรียก Sheets (รูปแบบค่าที่คืนเหมือน gspread)"""
+import json
+
+import requests
+from gspread.exceptions import APIError
+
+
+def api_error(status, message="error"):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({'error': {'code': status, 'message': message, 'status': ''}}).encode('utf-8')
+    return APIError(response)
+
+
+class FakeSpreadsheet:
+    """tabs: ชื่อชีต -> list ของแถว (แถวแรกเป็นหัวตาราง) ทุกการเรียกถูกบันทึกไว้ใน `calls`"""
+
+    def __init__(self, tabs=None):
+        self.id = 'fake-spreadsheet'
+        self.tabs = {name: [list(row) for row in rows] for name, rows in (tabs or {}).items()}
+        self.calls = []
+        self.errors = []  # error ที่จะ raise ในการเรียกครั้งถัดๆ ไป (ตามลำดับ)
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None: raise error
+
+    def _range(self, name):
+        if name not in self.tabs: raise api_error(400, f"Unable to parse range: {name}")
+        return {'range': name, 'values': self.tabs[name]}
+
+    def values_batch_get(self, ranges):
+        self._call('values_batch_get', tuple(ranges))
+        return {'valueRanges': [self._range(name) for name in ranges]}
+
+    def values_get(self, name):
+        self._call('values_get', name)
+        return self._range(name)
+
+    def worksheet(self, title):
+        self._call('worksheet', title)
+        if title not in self.tabs: self.tabs[title] = []
+        return FakeWorksheet(self, title)
+
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+
+class FakeWorksheet:
+    """ชีตหนึ่งของ FakeSpreadsheet: แถวเก็บใน spreadsheet.tabs[title]
+
+    `failures` เป็น list ของ (error, applied) ที่ใช้กับการเรียกครั้งถัดๆ ไป
+    applied=True จำลองกรณีที่ Sheets เขียนสำเร็จแล้วแต่ผู้เรียกได้ error (เช่น 503 / timeout)
+    """
+
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet, self.title, self.id = spreadsheet, title, f"{spreadsheet.id}/{title}"
+        self.failures = []
+        self.gate = None  # threading.Event: ให้การอ่านรอจนกว่าจะ set (ใช้ทดสอบการรวม request)
+
+    @property
+    def rows(self):
+        return self.spreadsheet.tabs[self.title]
+
+    def _run(self, name, args, apply):
+        self.spreadsheet.calls.append((f"{self.title}.{name}",) + args)
+        error, applied = self.failures.pop(0) if self.failures else (None, False)
+        if error is not None and not applied: raise error
+        result = apply()
+        if error is not None: raise error
+        return result
+
+    def col_values(self, col):
+        def apply():
+            if self.gate: self.gate.wait(2)
+            return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+        return self._run('col_values', (col,), apply)
+
+    def find(self, query, in_column=None):
+        def apply():
+            for number, row in enumerate(self.rows, start=1):
+                for col, value in enumerate(row, start=1):
+                    if value == query and in_column in (None, col): return FakeCell(number, col, value)
+            return None
+        return self._run('find', (query,), apply)
+
+    def append_row(self, values, value_input_option=None):
+        return self.append_rows([values], value_input_option=value_input_option)
+
+    def append_rows(self, values, value_input_option=None):
+        def apply():
+            first = len(self.rows) + 1
+            self.rows.extend(list(row) for row in values)
+            return {'updates': {'updatedRange': f"{self.title}!A{first}:J{len(self.rows)}"}}
+        return self._run('append_rows', (len(values),), apply)
+
+    def update_cell(self, row, col, value):
+        def apply():
+            while len(self.rows) < row: self.rows.append([])
+            cells = self.rows[row - 1]
+            while len(cells) < col: cells.append('')
+            cells[col - 1] = value
+        return self._run('update_cell', (row, col), apply)
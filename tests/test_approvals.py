@@ -0,0 +1,62 @@
+import threading
+
+from approvals import ApprovalCache
+
+
+class Loader:
+    def __init__(self, table):
+        self.table = dict(table)
+        self.calls = 0
+        self.gate = None
+
+    def __call__(self):
+        self.calls += 1
+        table = dict(self.table)
+        if self.gate: self.gate.wait(2)
+        return table
+
+
+def test_caches_the_table_until_invalidated():
+    loader = Loader({'G1': 'approved'})
+    cache = ApprovalCache(loader, ttl=300, negative_ttl=300)
+    assert cache.is_approved('G1') is True
+    assert cache.is_approved('G2') is False
+    assert loader.calls == 1
+    loader.table['G2'] = 'approved'
+    cache.invalidate()
+    assert cache.is_approved('G2') is True
+    assert loader.calls == 2
+
+
+def test_returns_none_when_the_table_never_loaded():
+    def failing(): raise RuntimeError("429")
+    assert ApprovalCache(failing).is_approved('G1') is None
+
+
+def test_refresh_started_before_invalidate_does_not_install_stale_table():
+    loader = Loader({'G1': 'pending'})
+    cache = ApprovalCache(loader, ttl=300, negative_ttl=300)
+    loader.gate = threading.Event()
+    stale = threading.Thread(target=cache.refresh)
+    stale.start()
+    while loader.calls == 0: pass
+    loader.table['G1'] = 'approved'
+    cache.invalidate()
+    loader.gate.set()
+    stale.join()
+    assert cache.is_approved('G1') is True
+    assert loader.calls == 2
+
+
+def test_invalidate_reaches_other_workers_through_the_generation_file(tmp_path):
+    path = str(tmp_path / 'approval_generation')
+    loader_a, loader_b = Loader({'G1': 'pending'}), Loader({'G1': 'pending'})
+    worker_a = ApprovalCache(loader_a, ttl=300, negative_ttl=300, generation_path=path, poll_interval=0)
+    worker_b = ApprovalCache(loader_b, ttl=300, negative_ttl=300, generation_path=path, poll_interval=0)
+    assert worker_b.is_approved('G1') is False
+    loader_a.table['G1'] = loader_b.table['G1'] = 'approved'
+    worker_a.invalidate()
+    assert worker_b.is_approved('G1') is True
+    assert loader_b.calls == 2
+    assert worker_b.is_approved('G1') is True and loader_b.calls == 2  # ไฟล์ไม่เปลี่ยนอีก ไม่โหลดซ้ำ
+    assert worker_a.is_approved('G1') is True and loader_a.calls == 1
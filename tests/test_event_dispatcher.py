@@ -0,0 +1,137 @@
+import hmac
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+from event_dispatcher import EventDispatcher, sign
+from job_queue import JobQueue, QueueFullError
+
+SECRET = 'channel-secret'
+
+
+def make_queue(workers=2, maxsize=10):
+    return JobQueue(workers=workers, put_timeout=0.05, backend=queue.Queue(maxsize=maxsize), drain_timeout=1.0)
+
+
+def event(message_id, group_id):
+    return {'type': 'message', 'webhookEventId': f'ev-{message_id}', 'source': {'type': 'group', 'groupId': group_id},
+            'message': {'type': 'text', 'id': message_id, 'text': 'hello'}}
+
+
+def body_of(*events):
+    return json.dumps({'destination': 'Ubot', 'events': list(events)})
+
+
+class Recorder:
+    """handle แบบ WebhookHandler.handle: ตรวจ signature ของ body ย่อยแล้วจดลำดับ event ที่ทำ"""
+
+    def __init__(self, action=None):
+        self.action = action
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, body, signature):
+        assert hmac.compare_digest(signature, sign(SECRET, body))
+        events = json.loads(body)['events']
+        assert len(events) == 1
+        if self.action: self.action(events[0])
+        with self.lock: self.handled.append(events[0]['message']['id'])
+
+
+def test_sign_matches_line_signature():
+    from linebot.v3.webhook import SignatureValidator
+    body = body_of(event('1', 'G1'))
+    assert SignatureValidator(SECRET).validate(body, sign(SECRET, body))
+
+
+def test_events_from_one_source_run_in_order():
+    jobs = make_queue(workers=4)
+    recorder = Recorder(action=lambda ev: time.sleep(0.01 * (5 - int(ev['message']['id']))))
+    dispatcher = EventDispatcher(recorder, SECRET, jobs.submit)
+    dispatcher.dispatch(body_of(*[event(str(i), 'G1') for i in range(5)]))
+    dispatcher.dispatch(body_of(event('5', 'G1')))
+    jobs.join()
+    assert recorder.handled == ['0', '1', '2', '3', '4', '5']
+    assert dispatcher.stats()['dispatched'] == 6 and dispatcher.stats()['lanes'] == 0
+    jobs.stop()
+
+
+def test_sources_run_in_parallel():
+    jobs = make_queue(workers=2)
+    barrier = threading.Barrier(2, timeout=2)
+    recorder = Recorder(action=lambda ev: barrier.wait())  # ผ่านได้ก็ต่อเมื่อสองกลุ่มทำพร้อมกัน
+    dispatcher = EventDispatcher(recorder, SECRET, jobs.submit)
+    dispatcher.dispatch(body_of(event('1', 'G1'), event('2', 'G2')))
+    jobs.join()
+    assert sorted(recorder.handled) == ['1', '2']
+    assert not barrier.broken
+    jobs.stop()
+
+
+def block_worker(jobs):
+    release, started = threading.Event(), threading.Event()
+    jobs.submit(lambda: (started.set(), release.wait(2)))
+    started.wait(1)
+    return release
+
+
+def test_full_queue_rejects_the_whole_body():
+    jobs = make_queue(workers=1, maxsize=1)
+    release = block_worker(jobs)
+    jobs.submit(lambda: None)  # คิวเต็ม
+    recorder = Recorder()
+    dispatcher = EventDispatcher(recorder, SECRET, jobs.submit)
+    with pytest.raises(QueueFullError):  # webhook ตอบ 503 ให้ LINE ส่งซ้ำ
+        dispatcher.dispatch(body_of(event('1', 'G1'), event('2', 'G2')))
+    assert dispatcher.stats() == {'lanes': 0, 'waiting': 0, 'orphans': 0, 'dispatched': 0, 'timed_out': 0}
+    release.set()
+    jobs.join()
+    assert recorder.handled == []
+    jobs.stop()
+
+
+def test_lane_left_without_a_worker_is_adopted():
+    jobs = make_queue(workers=1, maxsize=1)
+    release = block_worker(jobs)
+    recorder = Recorder()
+    dispatcher = EventDispatcher(recorder, SECRET, jobs.submit)
+    dispatcher.dispatch(body_of(event('1', 'G1'), event('2', 'G2'), event('3', 'G2')))  # G1 ได้ช่องสุดท้าย G2 ไม่มีที่
+    assert dispatcher.stats()['orphans'] == 1
+    release.set()
+    jobs.join()
+    assert recorder.handled == ['1', '2', '3']
+    assert dispatcher.stats()['orphans'] == 0 and dispatcher.stats()['lanes'] == 0
+    jobs.stop()
+
+
+def test_deadline_does_not_unblock_the_lane(caplog):
+    jobs = make_queue(workers=2)
+    timings = {}
+    def action(ev):
+        timings[ev['message']['id']] = [time.monotonic()]
+        if ev['message']['id'] == '1': time.sleep(0.2)
+        timings[ev['message']['id']].append(time.monotonic())
+    overdue = []
+    dispatcher = EventDispatcher(Recorder(action), SECRET, jobs.submit, deadline=0.05, on_timeout=lambda: overdue.append(1))
+    dispatcher.dispatch(body_of(event('1', 'G1'), event('2', 'G1')))
+    jobs.join()
+    assert timings['2'][0] >= timings['1'][1]  # event ที่ 2 เริ่มหลัง event แรกเสร็จจริง
+    assert dispatcher.stats()['timed_out'] == 1 and overdue == [1]
+    assert "the lane keeps waiting" in caplog.text
+    jobs.stop()
+
+
+def test_failed_handler_does_not_stop_the_lane(caplog):
+    jobs = make_queue(workers=1)
+    def action(ev):
+        if ev['message']['id'] == '1': raise RuntimeError("boom")
+    recorder = Recorder(action)
+    dispatcher = EventDispatcher(recorder, SECRET, jobs.submit, deadline=1.0)
+    dispatcher.dispatch(body_of(event('1', 'G1'), event('2', 'G1')))
+    jobs.join()
+    assert recorder.handled == ['2']
+    assert "Event handler failed" in caplog.text and dispatcher.stats()['timed_out'] == 0
+    jobs.stop()
@@ -0,0 +1,36 @@
+import io
+
+import pytest
+
+import image_preprocess
+from image_preprocess import preprocess
+
+pytestmark = pytest.mark.skipif(image_preprocess.Image is None, reason="Pillow is not installed")
+
+
+def png_file(width=40, height=20):
+    buffer = io.BytesIO()
+    image_preprocess.Image.new('RGB', (width, height), (200, 10, 10)).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_downscale_and_grayscale_to_jpeg():
+    data, filename, mimetype = preprocess(png_file(), ['downscale', 'grayscale'], target_width=20)
+    assert (filename, mimetype) == ('receipt.jpg', 'image/jpeg')
+    with image_preprocess.Image.open(io.BytesIO(data)) as img: assert (img.size, img.mode) == ((20, 10), 'L')
+
+
+def test_unknown_stage_or_format_is_rejected_before_decoding():
+    with pytest.raises(ValueError, match="sharpen"): preprocess(io.BytesIO(b'not an image'), ['sharpen'])
+    with pytest.raises(ValueError, match="bmp"): preprocess(png_file(), [], output_format='bmp')
+
+
+def test_undecodable_file_is_sent_unchanged():
+    assert preprocess(io.BytesIO(b'\x89PNG broken'), ['grayscale']) == (b'\x89PNG broken', 'receipt.png', 'image/png')
+
+
+def test_decompression_bomb_falls_back_to_the_original_bytes(monkeypatch):
+    original = png_file(400, 400).getvalue()
+    monkeypatch.setattr(image_preprocess.Image, 'MAX_IMAGE_PIXELS', 100)  # 400*400 เกินสองเท่า: DecompressionBombError
+    assert preprocess(io.BytesIO(original), ['grayscale']) == (original, 'receipt.png', 'image/png')
@@ -0,0 +1,77 @@
+import logging
+import queue
+import threading
+
+import pytest
+
+from job_queue import JobQueue, QueueFullError
+
+
+def make_queue(workers=2, maxsize=10, **kwargs):
+    return JobQueue(workers=workers, put_timeout=0.05, backend=queue.Queue(maxsize=maxsize), drain_timeout=1.0, **kwargs)
+
+
+def test_runs_submitted_jobs_with_arguments():
+    jobs = make_queue()
+    results = []
+    for i in range(5): jobs.submit(results.append, i)
+    jobs.join()
+    assert sorted(results) == [0, 1, 2, 3, 4]
+    jobs.stop()
+
+
+def test_failed_job_does_not_kill_the_worker(caplog):
+    jobs = make_queue(workers=1)
+    def boom(): raise RuntimeError("boom")
+    results = []
+    jobs.submit(boom)
+    jobs.submit(results.append, 'after')
+    jobs.join()
+    assert results == ['after']
+    assert "Background job failed" in caplog.text
+    jobs.stop()
+
+
+def test_full_queue_raises_queue_full_error():
+    jobs = make_queue(workers=1, maxsize=1)
+    release = threading.Event()
+    started = threading.Event()
+    jobs.submit(lambda: (started.set(), release.wait()))
+    started.wait(1)
+    jobs.submit(lambda: None)  # รออยู่ในคิว
+    with pytest.raises(QueueFullError):
+        jobs.submit(lambda: None)
+    assert jobs.stats() == {'queued': 1, 'active': 1, 'workers': 1}
+    release.set()
+    jobs.join()
+    jobs.stop()
+
+
+def test_drain_waits_for_queued_jobs():
+    jobs = make_queue(workers=1)
+    release = threading.Event()
+    results = []
+    jobs.submit(release.wait)
+    for i in range(3): jobs.submit(results.append, i)
+    threading.Timer(0.1, release.set).start()
+    assert jobs.drain() == 0
+    assert results == [0, 1, 2]
+
+
+def test_drain_logs_and_drops_jobs_left_after_timeout(caplog):
+    jobs = make_queue(workers=1)
+    release = threading.Event()
+    started = threading.Event()
+    results = []
+    jobs.submit(lambda: (started.set(), release.wait()))
+    started.wait(1)
+    jobs.submit(results.append, 'late')
+    with caplog.at_level(logging.ERROR, logger='job_queue'):
+        assert jobs.drain(timeout=0.1) == 1
+    assert "Dropped queued job at shutdown" in caplog.text and "'late'" in caplog.text
+    assert "1 jobs were still running at shutdown" in caplog.text
+    with pytest.raises(QueueFullError):
+        jobs.submit(results.append, 'after shutdown')
+    release.set()
+    assert jobs.drain() == 0  # เรียกซ้ำ (atexit หลัง worker_exit) ไม่ต้องรออีก
+    assert results == []
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+from metrics import Metrics, clear_directory
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_worker(directory, pid, counters=(), histograms=(), gauges=(), buckets=(0.1, 1)):
+    with open(os.path.join(directory, f"{pid}.json"), 'w', encoding='utf-8') as f:
+        json.dump({'buckets': list(buckets), 'counters': list(counters), 'histograms': list(histograms), 'gauges': list(gauges)}, f)
+
+
+def test_counters_and_histograms_are_summed_across_worker_files(tmp_path):
+    metrics = Metrics(str(tmp_path), buckets=(0.1, 1))
+    metrics.inc('slip_cache_total', cache='ocr', result='hit')
+    metrics.observe('slip_request_seconds', 0.05, handler='image')
+    write_worker(tmp_path, os.getppid(), counters=[['slip_cache_total', {'result': 'hit', 'cache': 'ocr'}, 2]],
+                 histograms=[['slip_request_seconds', {'handler': 'image'}, [0, 1, 1], 3.5]])
+    write_worker(tmp_path, dead_pid(), counters=[['slip_cache_total', {'cache': 'ocr', 'result': 'hit'}, 4]])
+    counters, histograms, _ = metrics.collect()
+    # ไฟล์ของ worker ที่ตายแล้วยังนับรวม counter ไม่ลดลง
+    assert counters == {('slip_cache_total', (('cache', 'ocr'), ('result', 'hit'))): 7}
+    assert histograms == {('slip_request_seconds', (('handler', 'image'),)): [[1, 1, 1], 3.55]}
+
+
+def test_snapshots_with_other_buckets_and_broken_files_are_skipped(tmp_path):
+    metrics = Metrics(str(tmp_path), buckets=(0.1, 1))
+    write_worker(tmp_path, 1, histograms=[['slip_request_seconds', {}, [1, 0, 0, 0], 0.01]], buckets=(0.01, 0.1, 1))
+    (tmp_path / '2.json').write_text('{"counters": [', encoding='utf-8')  # worker กำลังเขียน
+    (tmp_path / '3.json.tmp').write_text('{}', encoding='utf-8')
+    assert metrics.collect() == ({}, {}, {})
+
+
+def test_gauges_only_count_live_workers(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.gauge('slip_write_behind_backlog', lambda: 2)
+    metrics.gauge('slip_write_behind_lag_seconds', lambda: 1.5, aggregate='max')
+    write_worker(tmp_path, os.getppid(), gauges=[['slip_write_behind_backlog', {}, 3, 'sum'], ['slip_write_behind_lag_seconds', {}, 9.0, 'max']])
+    write_worker(tmp_path, dead_pid(), gauges=[['slip_write_behind_backlog', {}, 100, 'sum'], ['slip_write_behind_lag_seconds', {}, 99.0, 'max']])
+    _, _, gauges = metrics.collect()
+    assert gauges == {('slip_write_behind_backlog', ()): 5, ('slip_write_behind_lag_seconds', ()): 9.0}
+
+
+def test_dump_writes_own_file_and_clear_directory_removes_previous_run(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    metrics.inc('ocr_failures_total', reason='transient')
+    metrics.dump()
+    with open(tmp_path / f"{os.getpid()}.json", encoding='utf-8') as f: dumped = json.load(f)
+    assert dumped['counters'] == [['ocr_failures_total', {'reason': 'transient'}, 1]]
+    write_worker(tmp_path, dead_pid(), counters=[['ocr_failures_total', {'reason': 'transient'}, 5]])
+    (tmp_path / '7.json.tmp').write_text('{}', encoding='utf-8')
+    (tmp_path / 'README').write_text('keep', encoding='utf-8')
+    assert clear_directory(str(tmp_path)) == 3
+    assert sorted(os.listdir(tmp_path)) == ['README']
+    assert clear_directory(str(tmp_path / 'missing')) == 0
+    assert Metrics(str(tmp_path)).collect()[0] == {}
+
+
+def test_render_uses_the_prometheus_text_format(tmp_path):
+    metrics = Metrics(None, buckets=(0.1, 1))
+    metrics.describe('slip_duplicates_total', "Slips rejected as duplicates")
+    metrics.inc('slip_duplicates_total', check='index')
+    metrics.inc('slip_duplicates_total', 2, check='q"r\n')
+    metrics.observe('slip_stage_seconds', 0.05, stage='ocr')
+    metrics.observe('slip_stage_seconds', 5, stage='ocr')
+    metrics.gauge('slip_write_behind_backlog', lambda: 4)
+    assert metrics.render().splitlines() == [
+        '# HELP slip_duplicates_total Slips rejected as duplicates',
+        '# TYPE slip_duplicates_total counter',
+        'slip_duplicates_total{check="index"} 1',
+        'slip_duplicates_total{check="q\\"r\\n"} 2',
+        '# HELP slip_write_behind_backlog slip_write_behind_backlog',
+        '# TYPE slip_write_behind_backlog gauge',
+        'slip_write_behind_backlog 4',
+        '# HELP slip_stage_seconds slip_stage_seconds',
+        '# TYPE slip_stage_seconds histogram',
+        'slip_stage_seconds_bucket{stage="ocr",le="0.1"} 1',
+        'slip_stage_seconds_bucket{stage="ocr",le="1"} 1',
+        'slip_stage_seconds_bucket{stage="ocr",le="+Inf"} 2',
+        'slip_stage_seconds_sum{stage="ocr"} 5.050000',
+        'slip_stage_seconds_count{stage="ocr"} 2',
+    ]
+
+
+def test_trace_records_request_and_stage_timings():
+    metrics = Metrics(None, slow_threshold=0)
+    with metrics.trace('image'):
+        with metrics.stage('ocr'): pass
+    _, histograms, _ = metrics.collect()
+    assert set(histograms) == {('slip_request_seconds', (('handler', 'image'),)),
+                               ('slip_stage_seconds', (('handler', 'image'), ('stage', 'ocr')))}
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+import ocr_cache
+from ocr_cache import OCRCache
+
+pytestmark = pytest.mark.skipif(ocr_cache.Image is None, reason="Pillow is not installed")
+
+
+def slip_image(shade, quality=95):
+    image = ocr_cache.Image.new('L', (90, 80), 255)
+    for x in range(90):
+        for y in range(10, 70): image.putpixel((x, y), (x * shade) % 256)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return OCRCache(str(tmp_path / 'ocr.sqlite3'), phash_distance=6)
+
+
+def test_exact_hit_does_not_need_confirmation(cache):
+    content = slip_image(3)
+    cache.store(cache.keys(content), "text", {'ref_id': 'REF1'}, 'v1')
+    def confirm(entry): raise AssertionError("not called for an exact match")
+    assert cache.lookup(cache.keys(content), confirm=confirm)['parsed'] == {'ref_id': 'REF1'}
+
+
+def test_similar_image_is_used_only_when_confirmed(cache):
+    original, recompressed = slip_image(3), slip_image(3, quality=60)
+    assert original != recompressed
+    cache.store(cache.keys(original), "text", {'ref_id': 'REF1'}, 'v1')
+    keys = cache.keys(recompressed)
+    assert cache.lookup(keys) is None  # ไม่มี confirm = ไม่ใช้ผลจาก dHash
+    seen = []
+    assert cache.lookup(keys, confirm=lambda entry: seen.append(entry['parsed']['ref_id']) or False) is None
+    assert cache.lookup(keys, confirm=lambda entry: entry['parsed']['ref_id'] == 'REF1')['text'] == "text"
+    assert seen == ['REF1']
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'similar_hits': 1, 'similar_rejected': 1}
+
+
+def test_different_image_is_not_offered_for_confirmation(cache):
+    cache.store(cache.keys(slip_image(3)), "text", {'ref_id': 'REF1'}, 'v1')
+    image = ocr_cache.Image.new('L', (90, 80))
+    for x in range(90):
+        for y in range(80): image.putpixel((x, y), 255 - x * 2)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    def confirm(entry): raise AssertionError("unrelated image")
+    assert cache.lookup(cache.keys(buffer.getvalue()), confirm=confirm) is None
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from ocr_client import CircuitBreaker, FakeBackend, OCRClient, OCRError, RetryableOCRError
+
+
+def make_client(*backends, **kwargs):
+    kwargs.setdefault('backoff', 0)
+    return OCRClient(list(backends), **kwargs)
+
+
+def test_transient_errors_are_retried():
+    backend = FakeBackend([RetryableOCRError("HTTP 503"), "text"])
+    assert make_client(backend, retries=2).recognize(b'img') == "text"
+    assert backend.calls == 2
+
+
+def test_unreadable_image_is_not_retried_and_keeps_the_circuit_closed():
+    backend = FakeBackend([OCRError("bad image")])
+    client = make_client(backend, retries=3, breaker_threshold=1)
+    with pytest.raises(OCRError, match="bad image"): client.recognize(b'img')
+    assert backend.calls == 1
+    assert client.stats() == {'fake': 'closed'}
+
+
+def test_falls_back_to_the_next_backend():
+    primary = FakeBackend([RetryableOCRError("down")], name='primary')
+    secondary = FakeBackend(["from secondary"], name='secondary')
+    assert make_client(primary, secondary, retries=1).recognize(b'img') == "from secondary"
+    assert primary.calls == 2
+
+
+def test_open_circuit_skips_the_backend_until_reset():
+    primary = FakeBackend([RetryableOCRError("down"), RetryableOCRError("down"), "recovered"], name='primary')
+    secondary = FakeBackend(["from secondary"], name='secondary')
+    client = make_client(primary, secondary, retries=0, breaker_threshold=2, breaker_reset=0.05)
+    for _ in range(2): client.recognize(b'img')
+    assert client.stats()['primary'] == 'open'
+    client.recognize(b'img')
+    assert primary.calls == 2  # วงจรเปิด: ไม่เรียก primary
+    time.sleep(0.06)
+    assert client.recognize(b'img') == "recovered"  # half-open ให้ลอง 1 ครั้ง
+    assert client.stats()['primary'] == 'closed'
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.02)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.03)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_slow_primary_is_hedged_with_the_next_backend():
+    primary = FakeBackend(["slow"], delay=0.5, name='primary')
+    secondary = FakeBackend(["fast"], name='secondary')
+    client = make_client(primary, secondary, hedge_after=0.05)
+    started = time.monotonic()
+    assert client.recognize(b'img') == "fast"
+    assert time.monotonic() - started < 0.4
+
+
+def test_fast_primary_is_not_hedged():
+    primary = FakeBackend(["primary"], name='primary')
+    secondary = FakeBackend(["secondary"], name='secondary')
+    assert make_client(primary, secondary, hedge_after=0.2).recognize(b'img') == "primary"
+    assert secondary.calls == 0
+
+
+def test_deadline_covers_all_retries():
+    backend = FakeBackend(["never"], delay=1.0)
+    client = make_client(backend, deadline=0.1, retries=5)
+    started = time.monotonic()
+    with pytest.raises(RetryableOCRError): client.recognize(b'img')
+    assert time.monotonic() - started < 0.5
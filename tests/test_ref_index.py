@@ -0,0 +1,69 @@
+import sqlite3
+import time
+
+from ref_index import RefIndex
+
+
+def make_index(tmp_path):
+    return RefIndex(str(tmp_path / 'refs.sqlite3'))
+
+
+def test_claim_is_exclusive_until_released(tmp_path):
+    index = make_index(tmp_path)
+    assert index.claim('REF1')
+    assert not index.claim('REF1')
+    assert index.find('REF1') == 0
+    index.release('REF1')
+    assert index.find('REF1') is None
+    assert index.claim('REF1')
+
+
+def test_reconcile_syncs_rows_with_sheet(tmp_path):
+    index = make_index(tmp_path)
+    assert index.reconcile(['RefId', 'A', 'N/A', 'B']) == (2, 0, 0)
+    assert (index.find('A'), index.find('B')) == (2, 4)
+    assert index.reconcile(['RefId', 'B']) == (0, 1, 0)
+    assert index.find('A') is None and index.find('B') == 2
+
+
+def test_reconcile_releases_only_stale_claims_missing_everywhere(tmp_path):
+    index = make_index(tmp_path)
+    for ref_id in ('leaked', 'journaled', 'written', 'fresh'): index.claim(ref_id)
+    with sqlite3.connect(index.path) as conn:
+        conn.execute("UPDATE refs SET claimed_at = ? WHERE ref_id != 'fresh'", (time.time() - 3600,))
+    added, removed, released = index.reconcile(['RefId', 'written'], pending={'journaled'}, stale_after=600)
+    assert (added, removed, released) == (0, 0, 1)
+    assert index.find('leaked') is None
+    assert index.find('journaled') == 0  # ยังรอ flush
+    assert index.find('fresh') == 0      # อาจกำลังเขียนอยู่
+    assert index.find('written') == 2
+
+
+def test_claims_from_an_index_without_claimed_at_are_treated_as_stale(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE refs (ref_id TEXT PRIMARY KEY, row INTEGER)")
+        conn.execute("INSERT INTO refs VALUES ('old-claim', NULL), ('A', 2)")
+    index = RefIndex(path)
+    assert index.claim('new-claim')
+    assert index.reconcile(['RefId', 'A']) == (0, 0, 1)
+    assert index.find('old-claim') is None and index.find('new-claim') == 0
+
+
+def test_reconcile_keeps_rows_flushed_while_the_column_was_read(tmp_path):
+    index = make_index(tmp_path)
+    index.claim('A')
+    index.set_row('A', 5)  # flush เสร็จหลังอ่าน journal แต่ไม่ทันคอลัมน์ที่อ่านมา
+    assert index.reconcile(['RefId'], pending={'A'}) == (0, 0, 0)
+    assert index.find('A') == 5
+
+
+def test_reconcile_keeps_rows_written_after_it_started(tmp_path):
+    index = make_index(tmp_path)
+    for ref_id in ('old', 'new'): index.claim(ref_id)
+    index.set_row('old', 2)
+    time.sleep(0.01)
+    started_at = time.time()
+    index.set_row('new', 3)
+    assert index.reconcile(['RefId'], started_at=started_at) == (0, 1, 0)
+    assert index.find('old') is None and index.find('new') == 3
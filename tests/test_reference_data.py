@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from gspread.exceptions import APIError
+
+from fakes import FakeSpreadsheet, api_error
+from reference_data import EMPTY_SNAPSHOT, ReferenceStore, fetch_reference_values
+
+TABS = {'Config': [['Key', 'Value'], ['MSG_HELLO', 'สวัสดี']],
+        'Aliases': [['OriginalName', 'Nickname'], ['นาย ก', 'ก']],
+        'ParsingRules': [['IdentifierText', 'TargetField', 'SearchMethod', 'FixedValue', 'SearchTerm']]}
+
+
+def read(fn, *args, key=None, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def test_reads_all_reference_sheets_in_one_call():
+    spreadsheet = FakeSpreadsheet(TABS)
+    sheets = fetch_reference_values(spreadsheet, read)
+    assert sheets['Config'] == [{'Key': 'MSG_HELLO', 'Value': 'สวัสดี'}]
+    assert sheets['ParsingRules'] == []
+    assert [call[0] for call in spreadsheet.calls] == ['values_batch_get']
+
+
+def test_missing_tab_gives_empty_data_for_that_tab_only():
+    spreadsheet = FakeSpreadsheet({name: rows for name, rows in TABS.items() if name != 'Aliases'})
+    sheets = fetch_reference_values(spreadsheet, read)
+    assert sheets['Aliases'] == []
+    assert sheets['Config'] == [{'Key': 'MSG_HELLO', 'Value': 'สวัสดี'}]
+    assert [call[0] for call in spreadsheet.calls] == ['values_batch_get'] + ['values_get'] * 3
+
+
+def test_other_errors_are_not_turned_into_empty_sheets():
+    spreadsheet = FakeSpreadsheet(TABS)
+    spreadsheet.errors = [api_error(503)]
+    with pytest.raises(APIError): fetch_reference_values(spreadsheet, read)
+    spreadsheet.errors = [api_error(400), None, api_error(503)]
+    with pytest.raises(APIError): fetch_reference_values(spreadsheet, read)
+
+
+def test_failed_fetch_is_not_retried_until_retry_after(tmp_path):
+    calls = []
+    def fetch():
+        calls.append(time.monotonic())
+        if len(calls) == 1: raise RuntimeError("quota exceeded")
+        return {name: [] for name in TABS}
+    store = ReferenceStore(str(tmp_path / 'snapshot.json'), fetch, poll_interval=0, retry_after=0.1)
+    assert store.current() is EMPTY_SNAPSHOT
+    for _ in range(5): assert store.current() is EMPTY_SNAPSHOT
+    assert len(calls) == 1
+    time.sleep(0.12)
+    assert store.current().version == 1
+    assert len(calls) == 2
+
+
+def test_reload_ignores_the_failure_backoff(tmp_path):
+    results = [RuntimeError("quota exceeded"), {'Config': [{'Key': 'A', 'Value': '1'}]}]
+    def fetch():
+        result = results.pop(0)
+        if isinstance(result, Exception): raise result
+        return result
+    store = ReferenceStore(str(tmp_path / 'snapshot.json'), fetch, poll_interval=0, retry_after=60)
+    store.current()
+    assert store.reload().config == {'A': '1'}
+
+
+def test_failed_reload_raises_and_keeps_the_previous_snapshot(tmp_path):
+    results = [{'Config': [{'Key': 'A', 'Value': '1'}]}, RuntimeError("quota exceeded")]
+    def fetch():
+        result = results.pop(0)
+        if isinstance(result, Exception): raise result
+        return result
+    store = ReferenceStore(str(tmp_path / 'snapshot.json'), fetch, poll_interval=0)
+    assert store.reload().version == 1
+    with pytest.raises(RuntimeError, match="quota exceeded"):
+        store.reload()
+    assert store.current().version == 1 and store.current().config == {'A': '1'}
@@ -0,0 +1,58 @@
+from datetime import date
+
+from rollups import RollupStore, parse_amount, parse_transaction_date
+
+
+def make_store(tmp_path):
+    return RollupStore(str(tmp_path / 'rollups.sqlite3'))
+
+
+def record(source_id, day, recipient, amount):
+    return {'SourceId': source_id, 'TransactionDate': day, 'ToRecipient': recipient, 'Amount': amount}
+
+
+def test_parsers_accept_sheet_formats():
+    assert parse_transaction_date('2026-09-15') == date(2026, 9, 15)
+    assert parse_transaction_date('15-09-2026') == date(2026, 9, 15)
+    assert parse_transaction_date('N/A') is None
+    assert parse_amount('1,250.50') == 1250.5
+    assert parse_amount('N/A') is None
+
+
+def test_add_accumulates_per_day_and_recipient(tmp_path):
+    store = make_store(tmp_path)
+    assert store.add('G1', '2026-09-01', 'ร้าน A', '100')
+    assert store.add('G1', '2026-09-02', 'ร้าน A', 50.5)
+    assert store.add('G1', '2026-09-02', None, 10)
+    assert store.add('G2', '2026-09-02', 'ร้าน A', 999)
+    assert not store.add('G1', 'N/A', 'ร้าน A', 10)      # วันที่อ่านไม่ได้
+    assert not store.add('G1', '2026-09-02', 'ร้าน A', 'x')
+    assert store.totals('G1', date(2026, 9, 1), date(2026, 9, 30)) == {'ร้าน A': 150.5, 'N/A': 10}
+    assert store.totals('G1', date(2026, 9, 2), date(2026, 9, 2)) == {'ร้าน A': 50.5, 'N/A': 10}
+    assert store.totals('G1', date(2026, 10, 1), date(2026, 10, 31)) == {}
+
+
+def test_rebuild_replaces_everything_with_sheet_rows(tmp_path):
+    store = make_store(tmp_path)
+    assert not store.is_built()
+    store.add('G1', '2026-09-01', 'เก่า', 1)
+    count = store.rebuild([record('G1', '2026-09-01', 'ร้าน A', '1,000'), record('G1', '2026-09-03', 'ร้าน A', 20),
+                           record('G1', 'N/A', 'ร้าน A', 5), record('', '2026-09-03', 'ร้าน A', 5)])
+    assert count == 2 and store.is_built()
+    assert store.totals('G1', date(2026, 9, 1), date(2026, 9, 30)) == {'ร้าน A': 1020.0}
+    assert make_store(tmp_path).is_built()  # worker อื่นเห็นว่าสร้างแล้ว
+
+
+def test_first_write_is_counted_once_when_the_store_is_built_before_it(tmp_path):
+    sheet = []
+    # ลำดับเดียวกับ log_transaction_to_sheet: สร้างตารางสรุปจากชีตก่อน แล้วจึงเขียนแถวและ add
+    store = make_store(tmp_path)
+    if not store.is_built(): store.rebuild(list(sheet))
+    sheet.append(record('G1', '2026-09-01', 'ร้าน A', 100))
+    store.add('G1', '2026-09-01', 'ร้าน A', 100)
+    assert store.totals('G1', date(2026, 9, 1), date(2026, 9, 1)) == {'ร้าน A': 100.0}
+    # ถ้าสร้างหลังเขียน (ลำดับเดิม) แถวเดียวกันจะถูกนับสองครั้ง
+    late = RollupStore(str(tmp_path / 'late.sqlite3'))
+    late.rebuild(list(sheet))
+    late.add('G1', '2026-09-01', 'ร้าน A', 100)
+    assert late.totals('G1', date(2026, 9, 1), date(2026, 9, 1)) == {'ร้าน A': 200.0}
@@ -0,0 +1,157 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+from fakes import FakeSpreadsheet, api_error
+from sheets_scheduler import BACKGROUND, READ, WRITE, SheetsScheduler, TokenBucket
+
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet({'Transactions': [['Timestamp', 'RefId'], ['t0', 'REF0']]})
+
+
+@pytest.fixture
+def scheduler(spreadsheet):
+    return SheetsScheduler(lambda: (spreadsheet, None), requests_per_minute=6000, base_backoff=0.001, max_backoff=0.01)
+
+
+def test_waiting_writes_go_before_reads_and_reads_before_background():
+    bucket = TokenBucket(per_minute=600, capacity=1)  # token ใหม่ทุก 0.1 วินาที
+    bucket.acquire()
+    order = []
+    threads = []
+    for priority in (BACKGROUND, READ, WRITE):
+        threads.append(threading.Thread(target=lambda p=priority: (bucket.acquire(p), order.append(p))))
+        threads[-1].start()
+        time.sleep(0.01)
+    for t in threads: t.join(2)
+    assert order == [WRITE, READ, BACKGROUND]
+
+
+def test_acquire_gives_up_after_timeout():
+    bucket = TokenBucket(per_minute=1, capacity=1)
+    assert bucket.acquire(timeout=0.01)
+    assert not bucket.acquire(timeout=0.05)
+
+
+def take_all(path, results):
+    bucket = TokenBucket(per_minute=1, capacity=3, state_path=path)
+    results.put(sum(bucket.acquire(timeout=0.05) for _ in range(3)))
+
+
+def test_bucket_file_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'bucket.bin')
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=take_all, args=(path, results)) for _ in range(2)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join(5)
+    assert results.get(timeout=1) + results.get(timeout=1) == 3  # ทั้งสอง process ได้รวมกันไม่เกินขนาด bucket
+    assert TokenBucket(per_minute=1, capacity=3, state_path=path).available() < 1
+
+
+def test_shared_bucket_refills_over_time(tmp_path):
+    bucket = TokenBucket(per_minute=600, capacity=1, state_path=str(tmp_path / 'bucket.bin'))
+    assert bucket.acquire(timeout=0)
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert 0.05 < time.monotonic() - started < 0.5
+
+
+def test_identical_concurrent_reads_are_coalesced(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.gate = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(scheduler.read(worksheet.col_values, 2))) for _ in range(5)]
+    for t in threads: t.start()
+    while scheduler.coalesced < 4: time.sleep(0.001)
+    worksheet.gate.set()
+    for t in threads: t.join(2)
+    assert results == [['RefId', 'REF0']] * 5
+    assert [call for call in spreadsheet.calls if call[0] == 'Transactions.col_values'] == [('Transactions.col_values', 2)]
+
+
+def test_uncoalesced_read_always_calls_the_api(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.gate = threading.Event()
+    reader = threading.Thread(target=scheduler.read, args=(worksheet.col_values, 2))
+    reader.start()
+    while not any(call[0] == 'Transactions.col_values' for call in spreadsheet.calls): time.sleep(0.001)
+    worksheet.gate.set()
+    assert scheduler.read(worksheet.col_values, 2, coalesce=False) == ['RefId', 'REF0']
+    reader.join(2)
+    assert sum(call[0] == 'Transactions.col_values' for call in spreadsheet.calls) == 2
+
+
+def test_reads_are_retried_on_server_errors(scheduler):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(503), False), (requests.ConnectionError("reset"), False)]
+    assert scheduler.read(worksheet.col_values, 2) == ['RefId', 'REF0']
+    assert scheduler.retries == 2
+
+
+def test_append_is_retried_on_429(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(429), False)]
+    scheduler.write(worksheet.append_row, ['t1', 'REF1'])
+    assert spreadsheet.tabs['Transactions'][-1] == ['t1', 'REF1']
+    assert len(spreadsheet.tabs['Transactions']) == 3
+
+
+def test_append_is_retried_when_the_connection_never_opened(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(requests.ConnectTimeout("connect timeout"), False)]
+    scheduler.write(worksheet.append_row, ['t1', 'REF1'])
+    assert len(spreadsheet.tabs['Transactions']) == 3
+
+
+def test_ambiguous_append_without_verify_is_not_resent(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(503), True)]
+    with pytest.raises(APIError): scheduler.write(worksheet.append_row, ['t1', 'REF1'])
+    assert len(spreadsheet.tabs['Transactions']) == 3  # เขียนไปแล้วครั้งเดียว ไม่ส่งซ้ำ
+
+
+def test_ambiguous_append_that_was_applied_is_not_duplicated(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(requests.ReadTimeout("read timeout"), True)]
+    verify = lambda: 'REF1' in scheduler.read(worksheet.col_values, 2, coalesce=False)
+    assert scheduler.write(worksheet.append_row, ['t1', 'REF1'], verify=verify) is None
+    assert [row[1] for row in spreadsheet.tabs['Transactions']].count('REF1') == 1
+
+
+def test_ambiguous_append_that_was_not_applied_is_resent(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(502), False)]
+    verify = lambda: 'REF1' in scheduler.read(worksheet.col_values, 2, coalesce=False)
+    response = scheduler.write(worksheet.append_row, ['t1', 'REF1'], verify=verify)
+    assert response == {'updates': {'updatedRange': 'Transactions!A3:J3'}}
+    assert [row[1] for row in spreadsheet.tabs['Transactions']].count('REF1') == 1
+
+
+def test_last_attempt_still_verifies_before_failing(spreadsheet):
+    scheduler = SheetsScheduler(lambda: (spreadsheet, None), requests_per_minute=6000, max_retries=0, base_backoff=0.001)
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(500), True)]
+    verify = lambda: 'REF1' in scheduler.read(worksheet.col_values, 2, coalesce=False)
+    assert scheduler.write(worksheet.append_row, ['t1', 'REF1'], verify=verify) is None
+
+
+def test_idempotent_write_is_retried_like_a_read(scheduler, spreadsheet):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(503), True)]
+    scheduler.write(worksheet.update_cell, 2, 2, 'REF9', idempotent=True)
+    assert spreadsheet.tabs['Transactions'][1] == ['t0', 'REF9']
+    assert scheduler.retries == 1
+
+
+def test_client_errors_are_not_retried(scheduler):
+    worksheet = scheduler.worksheet('Transactions')
+    worksheet.failures = [(api_error(400), False)]
+    with pytest.raises(APIError): scheduler.write(worksheet.update_cell, 2, 2, 'x', idempotent=True)
+    assert scheduler.retries == 0
@@ -0,0 +1,90 @@
+import io
+
+import pytest
+
+import slip_qr
+from slip_qr import crc16, parse_slip_qr, parse_tlv, read_slip_qr
+
+REF_ID = '015034080512BPM05522'
+
+
+def tlv(tag, value):
+    return f"{tag}{len(value):02d}{value}"
+
+
+def slip_payload(ref_id=REF_ID, amount=None, crc=True):
+    payload = tlv('00', tlv('00', '000001') + tlv('01', '004') + tlv('02', ref_id)) + tlv('51', 'TH')
+    if amount is not None: payload += tlv('54', amount)
+    if crc: payload += '9104' + crc16(payload + '9104')
+    return payload
+
+
+def png_bytes(img):
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_crc16_matches_the_ccitt_false_check_value():
+    assert crc16('123456789') == '29B1'
+
+
+def test_parse_tlv_splits_tags():
+    assert parse_tlv('0003abc5102TH') == {'00': 'abc', '51': 'TH'}
+    with pytest.raises(ValueError): parse_tlv('0010abc')   # ความยาวเกิน payload
+    with pytest.raises(ValueError): parse_tlv('00xxabc')   # ความยาวไม่ใช่ตัวเลข
+
+
+def test_parse_slip_qr_reads_ref_bank_and_amount():
+    assert parse_slip_qr(slip_payload()) == {'ref_id': REF_ID, 'bank_code': '004', 'amount': None}
+    assert parse_slip_qr(slip_payload(amount='1250.00') + '\n')['amount'] == 1250.0
+    assert parse_slip_qr(slip_payload(amount='abc'))['amount'] is None
+    assert parse_slip_qr(slip_payload(crc=False))['ref_id'] == REF_ID  # QR ที่ไม่มี tag 91
+
+
+def test_parse_slip_qr_rejects_bad_crc():
+    payload = slip_payload()
+    assert parse_slip_qr(payload[:-4] + ('0000' if payload[-4:] != '0000' else '1111')) is None
+    assert parse_slip_qr(payload.replace(REF_ID, REF_ID[:-1] + '9')) is None  # ค่าเปลี่ยนแต่ CRC เดิม
+    assert parse_slip_qr(payload[:-4] + payload[-4:].lower())['ref_id'] == REF_ID
+
+
+@pytest.mark.parametrize('payload', ['', 'hello', 'http://example.com', '00', '0041' + '0' * 10,
+                                     tlv('00', tlv('02', 'short')), tlv('00', tlv('02', 'ref-with-dash-00')), tlv('51', 'TH')])
+def test_parse_slip_qr_ignores_malformed_payloads(payload):
+    assert parse_slip_qr(payload) is None
+
+
+def test_unreadable_images_fall_back_to_ocr(caplog):
+    assert read_slip_qr(io.BytesIO(b'not an image')) is None
+    assert "Reading slip QR failed" in caplog.text
+
+
+def test_decompression_bomb_falls_back_to_ocr(monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    data = png_bytes(Image.new('L', (100, 100), 255))
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 10)
+    fileobj = io.BytesIO(data)
+    assert read_slip_qr(fileobj) is None
+    assert fileobj.tell() == 0  # ยังส่งต่อให้ OCR อ่านได้
+
+
+def test_decoder_errors_fall_back_to_ocr(monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    pytest.importorskip('numpy')
+    class BrokenDetector:
+        def detectAndDecodeMulti(self, image): raise RuntimeError("cv2.error: bad image")
+    class FakeCV2:
+        QRCodeDetector = BrokenDetector
+    monkeypatch.setattr(slip_qr, 'pyzbar', None)
+    monkeypatch.setattr(slip_qr, 'cv2', FakeCV2)
+    assert read_slip_qr(io.BytesIO(png_bytes(Image.new('L', (40, 40), 255)))) is None
+
+
+def test_reads_ref_id_from_a_qr_image():
+    cv2 = pytest.importorskip('cv2')
+    Image = pytest.importorskip('PIL.Image')
+    if slip_qr.cv2 is None: pytest.skip("slip_qr has no OpenCV decoder")
+    matrix = cv2.QRCodeEncoder.create().encode(slip_payload(amount='500.00'))
+    img = Image.fromarray(matrix).resize((matrix.shape[1] * 8, matrix.shape[0] * 8), Image.NEAREST)
+    assert read_slip_qr(io.BytesIO(png_bytes(img))) == {'ref_id': REF_ID, 'bank_code': '004', 'amount': 500.0}
@@ -0,0 +1,95 @@
+from datetime import date
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from transaction_export import csv_chunks, export_url, iter_rows, parse_period, sign_export, verify_export
+
+SECRET = 'export-secret'
+HEADER = ['Timestamp', 'TransactionDate', 'FromAccount', 'ToRecipient', 'Amount', 'RefId', 'SourceId', 'SenderName', 'SenderId', 'SourceGroupName']
+
+
+def row(day, source_id='G1', ref_id='REF'):
+    return ['t', day, 'a', 'b', '100', ref_id, source_id, 'n', 'u', 'g']
+
+
+def test_parse_period_accepts_year_month_and_range():
+    assert parse_period('2026') == (date(2026, 1, 1), date(2026, 12, 31))
+    assert parse_period(' 2024-02 ') == (date(2024, 2, 1), date(2024, 2, 29))
+    assert parse_period('2026-09-01:2026-09-15') == (date(2026, 9, 1), date(2026, 9, 15))
+
+
+@pytest.mark.parametrize('period', ['', '26', '2026-13', '2026-9', '2026-09-15:2026-09-01', '2026-02-30:2026-03-01', '2026-09-01:'])
+def test_parse_period_rejects_bad_periods(period):
+    with pytest.raises(ValueError): parse_period(period)
+
+
+def test_signed_link_verifies_until_it_expires():
+    url = export_url('https://bot.example/', SECRET, 'G1', '2026-09', 'csv', 1000)
+    assert url.startswith('https://bot.example/export?')
+    query = {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+    args = (query['source'], query['period'], query['format'], query['expires'], query['sig'])
+    assert verify_export(SECRET, *args, now=999)
+    assert verify_export(SECRET, *args, now=1000)
+    assert not verify_export(SECRET, *args, now=1001)
+
+
+@pytest.mark.parametrize('field, value', [('source', 'G2'), ('period', '2026'), ('fmt', 'xlsx'), ('expires', 99999), ('expires', 'soon'),
+                                          ('expires', None), ('signature', ''), ('signature', None), ('signature', 'x' * 43)])
+def test_tampered_links_are_rejected(field, value):
+    link = {'source': 'G1', 'period': '2026-09', 'fmt': 'csv', 'expires': 1000}
+    link['signature'] = sign_export(SECRET, link['source'], link['period'], link['fmt'], link['expires'])
+    link[field] = value
+    assert not verify_export(SECRET, link['source'], link['period'], link['fmt'], link['expires'], link['signature'], now=0)
+
+
+def test_links_need_the_same_non_empty_secret():
+    signature = sign_export(SECRET, 'G1', '2026-09', 'csv', 1000)
+    assert not verify_export('other-secret', 'G1', '2026-09', 'csv', 1000, signature, now=0)
+    assert not verify_export('', 'G1', '2026-09', 'csv', 1000, sign_export('', 'G1', '2026-09', 'csv', 1000), now=0)
+    assert not verify_export(None, 'G1', '2026-09', 'csv', 1000, signature, now=0)
+
+
+def make_sheet(rows):
+    sheet = [HEADER] + rows
+    reads = []
+    def read_page(first_row, last_row):
+        reads.append((first_row, last_row))
+        page = sheet[first_row - 1:last_row]
+        while page and not any(page[-1]): page.pop()  # API ตัดแถวว่างท้ายช่วงทิ้ง
+        return page
+    return sheet, read_page, reads
+
+
+def test_iter_rows_reads_every_page_up_to_the_last_row():
+    rows = [row('2026-09-01', ref_id=f'R{i}') for i in range(7)]
+    rows[2:6] = [[''] * 10] * 4  # แถวที่ถูกลบค่ากลางชีต: หน้าที่ 2 ว่างทั้งหน้า
+    sheet, read_page, reads = make_sheet(rows)
+    header, found = iter_rows(read_page, 'G1', date(2026, 9, 1), date(2026, 9, 30), last_row=len(sheet), page_size=3)
+    assert header == HEADER
+    assert [r[5] for r in found] == ['R0', 'R1', 'R6']
+    assert reads == [(1, 3), (4, 6), (7, 8)]
+
+
+def test_iter_rows_filters_by_source_and_date():
+    rows = [row('2026-09-01', ref_id='in'), row('2026-10-01', ref_id='late'), row('N/A', ref_id='no-date'),
+            row('2026-09-05', source_id='G2', ref_id='other'), ['t', '2026-09-05'], row('15-09-2026', ref_id='dmy')]
+    sheet, read_page, _ = make_sheet(rows)
+    _, found = iter_rows(read_page, 'G1', date(2026, 9, 1), date(2026, 9, 30), last_row=len(sheet), page_size=1000)
+    assert [r[5] for r in found] == ['in', 'dmy']
+
+
+def test_iter_rows_on_an_empty_sheet():
+    _, read_page, reads = make_sheet([])
+    header, found = iter_rows(read_page, 'G1', date(2026, 1, 1), date(2026, 12, 31), last_row=1, page_size=10)
+    assert header == HEADER and list(found) == []
+    assert reads == [(1, 1)]
+
+
+def test_csv_starts_with_bom_and_streams_in_chunks():
+    rows = [row('2026-09-01', ref_id=f'R{i}') for i in range(1001)]
+    chunks = list(csv_chunks(HEADER, iter(rows)))
+    assert len(chunks) == 3
+    text = ''.join(chunks)
+    assert text.startswith('\ufeffTimestamp,TransactionDate')
+    assert text.count('\r\n') == 1002
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from ttl_cache import TTLCache
+
+
+def test_hit_after_first_load():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+    assert cache.get_or_load('a', lambda: calls.append(1) or 'A') == 'A'
+    assert cache.get_or_load('a', lambda: calls.append(1) or 'other') == 'A'
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.get_or_load('a', lambda: 'old')
+    time.sleep(0.08)
+    assert cache.get_or_load('a', lambda: 'new') == 'new'
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.get_or_load('a', lambda: 'A')
+    cache.get_or_load('b', lambda: 'B')
+    cache.get_or_load('a', lambda: 'unused')  # a ใช้ล่าสุด b จึงถูกไล่ออก
+    cache.get_or_load('c', lambda: 'C')
+    assert cache.get_or_load('a', lambda: 'reloaded') == 'A'
+    assert cache.get_or_load('b', lambda: 'reloaded') == 'reloaded'
+    assert cache.stats()['size'] == 2
+
+
+def test_concurrent_misses_call_the_loader_once():
+    cache = TTLCache()
+    release = threading.Event()
+    calls = []
+    def loader():
+        calls.append(1)
+        release.wait(2)
+        return 'value'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader))) for _ in range(8)]
+    for t in threads: t.start()
+    while cache.stats()['coalesced'] < 7: time.sleep(0.001)
+    release.set()
+    for t in threads: t.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+
+
+def test_leader_exception_reaches_waiters_and_is_not_cached():
+    cache = TTLCache()
+    release = threading.Event()
+    def failing():
+        release.wait(2)
+        raise ValueError("profile API down")
+    errors = []
+    def call():
+        try: cache.get_or_load('k', failing)
+        except ValueError as e: errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads: t.start()
+    while cache.stats()['coalesced'] < 3: time.sleep(0.001)
+    release.set()
+    for t in threads: t.join()
+    assert len(errors) == 4 and len({id(e) for e in errors}) == 1
+    assert cache.get_or_load('k', lambda: 'recovered') == 'recovered'
+
+
+def test_invalidate_single_key_and_all():
+    cache = TTLCache()
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.invalidate('a')
+    assert cache.get_or_load('a', lambda: 10) == 10
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+    with pytest.raises(KeyError):
+        cache.get_or_load('c', lambda: {}['missing'])
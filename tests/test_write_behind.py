@@ -0,0 +1,116 @@
+import atexit
+import json
+import os
+
+from write_behind import WriteBehindBuffer
+
+
+def make_buffer(journal_dir, flushed=None, fail=None):
+    def flush_fn(batch):
+        if fail and fail[0]: raise RuntimeError("sheet unavailable")
+        if flushed is not None: flushed.append([entry['ref_id'] for entry in batch])
+    return WriteBehindBuffer(str(journal_dir), flush_fn, flush_interval=3600, max_batch=100)
+
+
+def write_journal(path, records, tail=''):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records: f.write(json.dumps(record) + "\n")
+        f.write(tail)
+
+
+def test_flush_sends_appended_entries_and_clears_the_journal(tmp_path):
+    flushed = []
+    buffer = make_buffer(tmp_path, flushed)
+    buffer.append({'ref_id': 'A'})
+    buffer.append({'ref_id': 'B'})
+    assert buffer.flush() == 2
+    assert flushed == [['A', 'B']]
+    assert buffer.flush() == 0
+    assert [os.path.getsize(path) for path in tmp_path.iterdir()] == [0]
+
+
+def test_failed_flush_keeps_entries_for_the_next_attempt(tmp_path):
+    flushed, fail = [], [True]
+    buffer = make_buffer(tmp_path, flushed, fail)
+    buffer.append({'ref_id': 'A'})
+    assert buffer.flush() == 0
+    assert buffer.failed_flushes == 1
+    assert buffer.pending_entries()[0]['uncertain']  # อาจเขียนไปแล้ว: flush_fn ต้องตรวจชีตก่อนส่งซ้ำ
+    fail[0] = False
+    assert buffer.flush() == 1
+    assert flushed == [['A']]
+
+
+def test_start_replays_pending_entries_of_a_dead_process(tmp_path):
+    a, b, c = ({'id': key, 'ref_id': key, 'queued_at': 0} for key in 'abc')
+    orphan = tmp_path / 'journal-1-dead.log'
+    write_journal(orphan, [{'op': 'add', 'entry': a}, {'op': 'add', 'entry': b}, {'op': 'done', 'ids': ['a']},
+                           {'op': 'add', 'entry': c}], tail='{"op": "add", "entry": {"id": "d"')  # crash กลางบรรทัด
+    flushed = []
+    buffer = make_buffer(tmp_path, flushed)
+    buffer.start()
+    assert not orphan.exists()
+    assert buffer.stats()['backlog'] == 2
+    assert all(entry['uncertain'] for entry in buffer.pending_entries())
+    assert buffer.flush() == 2
+    assert flushed == [['b', 'c']]
+
+
+def test_replayed_entries_survive_a_second_crash(tmp_path):
+    entry = {'id': 'a', 'ref_id': 'a', 'queued_at': 0}
+    write_journal(tmp_path / 'journal-1-dead.log', [{'op': 'add', 'entry': entry}])
+    first = make_buffer(tmp_path, fail=[True])
+    first.start()
+    first.flush()
+    # first "ตาย" โดยยังไม่ได้เขียน: journal ของมันต้องมี entry เดิมอยู่
+    first._journal.close()
+    atexit.unregister(first.flush)
+    flushed = []
+    second = make_buffer(tmp_path, flushed)
+    second.start()
+    assert second.flush() == 1
+    assert flushed == [['a']]
+
+
+def test_journal_of_a_live_worker_is_not_adopted_but_is_visible(tmp_path):
+    live = make_buffer(tmp_path)
+    live.append({'ref_id': 'A'})
+    other = make_buffer(tmp_path)
+    other.start()
+    assert other.stats()['backlog'] == 0
+    assert [entry['ref_id'] for entry in other.pending_entries()] == ['A']
+    live.flush()
+    assert other.pending_entries() == []
+
+
+def test_poison_row_moves_to_dead_letter_and_stops_blocking(tmp_path, caplog):
+    flushed = []
+    def flush_fn(batch):
+        if any(entry['ref_id'] == 'BAD' for entry in batch): raise ValueError("HTTP 400 invalid row")
+        flushed.append([entry['ref_id'] for entry in batch])
+    buffer = WriteBehindBuffer(str(tmp_path), flush_fn, flush_interval=3600, max_attempts=3)
+    for ref_id in ('BAD', 'A', 'B'): buffer.append({'ref_id': ref_id})
+    assert buffer.flush() == 0  # ชุดแรกล้ม ต่อไปส่งทีละแถว
+    assert buffer.flush() == 0
+    assert buffer.flush() == 2  # ครั้งที่ 3: BAD ไป dead letter แล้วแถวที่เหลือส่งต่อได้
+    assert flushed == [['A'], ['B']]
+    assert buffer.stats()['backlog'] == 0 and buffer.dead_lettered == 1
+    with open(tmp_path / 'dead-letter.jsonl', encoding='utf-8') as f: dead = [json.loads(line) for line in f]
+    assert [(record['entry']['ref_id'], record['error']) for record in dead] == [('BAD', 'ValueError: HTTP 400 invalid row')]
+    assert "Moved 1 write-behind rows" in caplog.text
+    assert buffer.pending_entries() == []
+    atexit.unregister(buffer.flush)
+
+
+def test_transient_failures_are_retried_without_a_cap(tmp_path):
+    fail = [True]
+    def flush_fn(batch):
+        if fail[0]: raise ConnectionError("sheet unavailable")
+    buffer = WriteBehindBuffer(str(tmp_path), flush_fn, flush_interval=3600, max_attempts=2,
+                               is_transient=lambda error: isinstance(error, ConnectionError))
+    buffer.append({'ref_id': 'A'})
+    for _ in range(5): assert buffer.flush() == 0
+    assert buffer.dead_lettered == 0 and not buffer.pending_entries()[0].get('attempts')
+    fail[0] = False
+    assert buffer.flush() == 1
+    atexit.unregister(buffer.flush)
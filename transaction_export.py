@@ -0,0 +1,110 @@
+"""ส่งออกรายการของ source หนึ่งในช่วงวันที่ เป็น CSV หรือ XLSX แบบ stream
+
+- อ่านชีต Transactions ทีละหน้า (`read_page(first_row, last_row)` คืน list ของแถว) จนถึงแถวสุดท้ายที่ใช้
+  จึงใช้หน่วยความจำคงที่ไม่ว่าชีตจะใหญ่แค่ไหน (ไม่ใช้ get_all_records)
+- ลิงก์ดาวน์โหลดเซ็นด้วย HMAC ของ (source, ช่วงเวลา, รูปแบบ, เวลาหมดอายุ) ด้วย key ของ export โดยเฉพาะ
+  (ไม่มี key = ปิดการ export)
+- XLSX ต้องมี openpyxl (เขียนแบบ write_only ลงไฟล์ชั่วคราว แล้ว stream ไฟล์ออกไป)
+"""
+import base64
+import calendar
+import csv
+import hashlib
+import hmac
+import io
+import re
+import tempfile
+from datetime import date
+from urllib.parse import urlencode
+
+from rollups import parse_transaction_date
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+SOURCE_ID_COLUMN, DATE_COLUMN = 6, 1  # ตำแหน่งคอลัมน์ (นับจาก 0) ของ SourceId และ Date ในชีต Transactions
+LAST_COLUMN = 'J'
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+PERIOD_PATTERN = re.compile(r'^(\d{4})(?:-(\d{2}))?$|^(\d{4}-\d{2}-\d{2}):(\d{4}-\d{2}-\d{2})$')
+
+
+def parse_period(period):
+    """'2026' / '2026-09' / '2026-09-01:2026-09-15' -> (วันแรก, วันสุดท้าย) หรือ raise ValueError"""
+    match = PERIOD_PATTERN.match(period.strip())
+    if not match: raise ValueError(f"Unknown period: {period}")
+    year, month, start, end = match.groups()
+    if start: start, end = date.fromisoformat(start), date.fromisoformat(end)
+    elif month: start = date(int(year), int(month), 1); end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    else: start, end = date(int(year), 1, 1), date(int(year), 12, 31)
+    if start > end: raise ValueError(f"Period ends before it starts: {period}")
+    return start, end
+
+
+def sign_export(secret, source_id, period, fmt, expires):
+    message = f"{source_id}|{period}|{fmt}|{int(expires)}".encode('utf-8')
+    return base64.urlsafe_b64encode(hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest()).decode('ascii').rstrip('=')
+
+
+def verify_export(secret, source_id, period, fmt, expires, signature, now):
+    if not secret: return False
+    try: expires = int(expires)
+    except (TypeError, ValueError): return False
+    if expires < now: return False
+    return hmac.compare_digest(sign_export(secret, source_id, period, fmt, expires), signature or '')
+
+
+def export_url(base_url, secret, source_id, period, fmt, expires):
+    query = {'source': source_id, 'period': period, 'format': fmt, 'expires': int(expires),
+             'sig': sign_export(secret, source_id, period, fmt, expires)}
+    return f"{base_url.rstrip('/')}/export?{urlencode(query)}"
+
+
+def iter_rows(read_page, source_id, start, end, last_row, page_size=1000):
+    """คืน (header, generator ของแถวที่ตรงเงื่อนไข) โดยอ่านชีตทีละ page_size แถวจนถึงแถว last_row
+
+    last_row คือแถวสุดท้ายที่มีข้อมูล (เช่น จำนวนค่าใน col_values ของคอลัมน์ Timestamp)
+    หน้าที่ว่างหรือไม่เต็ม (API ตัดแถวว่างทิ้ง) จึงไม่ทำให้หยุดก่อนถึงแถวสุดท้าย
+    """
+    first_page = read_page(1, min(page_size, max(last_row, 1)))
+    header = first_page[0] if first_page else []
+    def rows():
+        page, first_row = first_page[1:], 1
+        while True:
+            for row in page:
+                if len(row) > SOURCE_ID_COLUMN and row[SOURCE_ID_COLUMN] == source_id:
+                    day = parse_transaction_date(row[DATE_COLUMN])
+                    if day and start <= day <= end: yield row
+            first_row += page_size
+            if first_row > last_row: return
+            page = read_page(first_row, min(first_row + page_size - 1, last_row))
+    return header, rows()
+
+
+def csv_chunks(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # BOM ให้ Excel เปิดภาษาไทยได้ถูกต้อง
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_chunks(header, rows, chunk_size=64 * 1024):
+    if Workbook is None: raise RuntimeError("openpyxl is not installed")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Transactions")
+    sheet.append(header)
+    for row in rows: sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk: return
+            yield chunk
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """LRU cache จำกัดขนาด + หมดอายุตาม TTL พร้อม single-flight
+
+    ถ้ามีหลาย thread ขอ key เดียวกันที่ยังไม่อยู่ใน cache พร้อมกัน
+    จะเรียก loader แค่ครั้งเดียว ที่เหลือรอผลเดียวกัน
+    ถ้า loader ล้มเหลวจะไม่ถูก cache (ทุกคนที่รออยู่ได้ exception เดียวกัน)
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None: raise flight.error
+            return flight.value
+        try:
+            flight.value = loader()
+            with self._lock:
+                self._data[key] = (flight.value, time.monotonic() + self.ttl)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize: self._data.popitem(last=False)
+            return flight.value
+        except BaseException as e:
+            # รวม KeyboardInterrupt/SystemExit: ไม่อย่างนั้นคนที่รออยู่จะได้ None กลับไปแทน error
+            flight.error = e
+            raise
+        finally:
+            with self._lock: self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None: self._data.clear()
+            else: self._data.pop(key, None)
+
+    def stats(self):
+        requests = self.hits + self.misses + self.coalesced
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                'hit_rate': (self.hits + self.coalesced) / requests if requests else 0.0}
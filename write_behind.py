@@ -0,0 +1,188 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """บัฟเฟอร์เขียนแถวลงชีตแบบ write-behind พร้อม journal บนดิสก์
+
+    `append` เขียน entry ลง journal (fsync) แล้วคืนทันที ส่วน flusher thread
+    เรียก `flush_fn(entries)` ทีละชุดตามรอบเวลาหรือเมื่อครบ `max_batch` แถว
+    journal เป็นไฟล์ append-only ต่อ process มี 2 แบบคือ {"op": "add"} และ
+    {"op": "done"} ถ้า process ตายไป journal ที่ค้าง (ไม่มีใครถือ lock)
+    จะถูก worker ถัดไปรับมา replay ตอน start
+    entry ที่อาจเขียนลงชีตไปแล้ว (อยู่ในชุดที่ flush ล้ม หรือรับมาจาก journal ของ process ที่ตาย
+    ซึ่งอาจตายระหว่างรอคำตอบ) จะมี `uncertain: True` ให้ flush_fn ตรวจชีตก่อนส่งซ้ำ
+    ชุดที่ล้มด้วย error ที่ `is_transient(error)` ไม่ถือว่าชั่วคราว (เช่น HTTP 400) จะถูกส่งใหม่ทีละแถว
+    แถวที่ล้มครบ `max_attempts` ครั้งถูกย้ายไป `dead_letter_path` (JSON ทีละบรรทัด) ไม่ให้ขวางแถวหลังจากนั้น
+    """
+
+    def __init__(self, journal_dir, flush_fn, flush_interval=5.0, max_batch=20, max_attempts=5, dead_letter_path=None,
+                 is_transient=None):
+        self.journal_dir = journal_dir
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path or os.path.join(journal_dir, 'dead-letter.jsonl')
+        self.is_transient = is_transient
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._journal = None
+        self._pid = None
+        self.flushed_total = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.last_flush_at = None
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+            self._pending = []
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.log")
+            self._journal = open(path, 'a+', encoding='utf-8')
+            fcntl.flock(self._journal, fcntl.LOCK_EX)
+            for orphan in glob.glob(os.path.join(self.journal_dir, 'journal-*.log')):
+                if orphan != path: self._adopt(orphan)
+        threading.Thread(target=self._run, name="write-behind-flusher", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _adopt(self, path):
+        # journal ของ process ที่ตายไปแล้ว: ไม่มีใครถือ lock อยู่
+        try: f = open(path, 'r', encoding='utf-8')
+        except FileNotFoundError: return
+        with f:
+            try: fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: return
+            try:
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino: return
+            except FileNotFoundError: return
+            entries = [dict(entry, uncertain=True) for entry in self._read_pending(f)]
+            for entry in entries: self._write({'op': 'add', 'entry': entry})
+            self._pending.extend(entries)
+            os.unlink(path)
+        if entries: logger.warning("Replaying %d journaled rows from %s", len(entries), path)
+
+    @staticmethod
+    def _read_pending(f):
+        pending = {}
+        for line in f:
+            try: record = json.loads(line)
+            except ValueError: continue  # บรรทัดสุดท้ายเขียนไม่ครบตอน crash
+            if record.get('op') == 'add': pending[record['entry']['id']] = record['entry']
+            elif record.get('op') == 'done':
+                for entry_id in record.get('ids', []): pending.pop(entry_id, None)
+        return list(pending.values())
+
+    def _write(self, record):
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def append(self, entry):
+        """บันทึก entry (dict ที่ serialize เป็น JSON ได้) ลง journal แล้วคืนทันที"""
+        self.start()
+        entry = dict(entry, id=uuid.uuid4().hex, queued_at=time.time())
+        with self._lock:
+            self._write({'op': 'add', 'entry': entry})
+            self._pending.append(entry)
+            if len(self._pending) >= self.max_batch: self._wakeup.set()
+        return entry
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            flushed = 0
+            while True:
+                with self._lock:
+                    if not self._pending: return flushed
+                    # แถวที่เคยล้มมาแล้ว: ส่งทีละแถวเพื่อแยกแถวที่มีปัญหาออกจากแถวอื่น
+                    single = bool(self._pending[0].get('attempts'))
+                    batch = self._pending[:1] if single else list(self._pending)
+                started = time.time()
+                try:
+                    self.flush_fn(batch)
+                except Exception as e:
+                    if self._failed(batch, e): continue  # ย้ายแถวที่มีปัญหาออกแล้ว ส่งแถวที่เหลือต่อ
+                    return flushed
+                self.last_flush_at = time.time()
+                self.last_flush_seconds = self.last_flush_at - started
+                self.flushed_total += len(batch)
+                flushed += len(batch)
+                self._done(batch)
+                if not single: return flushed
+
+    def _done(self, batch):
+        done = {entry['id'] for entry in batch}
+        with self._lock:
+            self._pending = [entry for entry in self._pending if entry['id'] not in done]
+            if self._pending: self._write({'op': 'done', 'ids': sorted(done)})
+            else:
+                self._journal.truncate(0)
+                os.fsync(self._journal.fileno())
+
+    def _failed(self, batch, error):
+        """นับครั้งที่ล้ม คืน True ถ้ามีแถวถูกย้ายไป dead letter"""
+        transient = self.is_transient is not None and self.is_transient(error)
+        with self._lock:
+            for entry in batch:
+                entry['uncertain'] = True
+                if not transient: entry['attempts'] = entry.get('attempts', 0) + 1
+        self.failed_flushes += 1
+        logger.exception("Write-behind flush of %d rows failed, will retry", len(batch))
+        poison = [entry for entry in batch if entry.get('attempts', 0) >= self.max_attempts]
+        if not poison: return False
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            for entry in poison:
+                f.write(json.dumps({'entry': entry, 'error': f"{type(error).__name__}: {error}", 'failed_at': time.time()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += len(poison)
+        logger.error("Moved %d write-behind rows to %s after %d failed attempts: %s",
+                     len(poison), self.dead_letter_path, self.max_attempts, [entry.get('ref_id', entry['id']) for entry in poison])
+        self._done(poison)
+        return True
+
+    def pending_entries(self):
+        """entry ที่ยังไม่ได้เขียนลงชีตจาก journal ทุกไฟล์ในโฟลเดอร์ (รวมของ worker อื่น) อ่านอย่างเดียว"""
+        entries = {}
+        for path in glob.glob(os.path.join(self.journal_dir, 'journal-*.log')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for entry in self._read_pending(f): entries[entry['id']] = entry
+            except FileNotFoundError: continue
+        with self._lock:
+            for entry in self._pending: entries[entry['id']] = entry
+        return list(entries.values())
+
+    def stats(self):
+        with self._lock:
+            backlog = len(self._pending)
+            oldest = min((entry.get('queued_at', time.time()) for entry in self._pending), default=None)
+        return {
+            'backlog': backlog,
+            'flush_lag_seconds': time.time() - oldest if oldest else 0.0,
+            'flushed_total': self.flushed_total,
+            'failed_flushes': self.failed_flushes,
+            'dead_lettered': self.dead_lettered,
+            'last_flush_seconds': self.last_flush_seconds,
+        }